@@ -18,7 +18,8 @@ class ActionForm(BaseActionForm):
                                              self.config_d["repository"])
         r = requests.get(url,
                          auth=(self.config_d["user"], self.config_d["access_token"]),
-                         headers={'Accept': "application/vnd.github.v3+json"})
+                         headers={'Accept': "application/vnd.github.v3+json"},
+                         timeout=self.timeout)
         r.raise_for_status()
         return [(a["login"], a["login"]) for a in r.json()]
 
@@ -45,6 +46,6 @@ class Action(BaseAction):
 
         r = requests.post(url,
                           auth=(self.config_d["user"], self.config_d["access_token"]),
-                          headers={'Accept': "application/vnd.github.v3+json"}, data=json.dumps(args)
-                          )
+                          headers={'Accept': "application/vnd.github.v3+json"}, data=json.dumps(args),
+                          timeout=self.timeout)
         r.raise_for_status()
@@ -21,5 +21,5 @@ class Action(BaseAction):
                 'From': self.from_number}
         for number in self.to_numbers:
             args['To'] = number
-            r = requests.post(self.url, data=args, auth=self.auth)
+            r = requests.post(self.url, data=args, auth=self.auth, timeout=self.timeout)
             r.raise_for_status()
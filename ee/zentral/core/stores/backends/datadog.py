@@ -1,6 +1,7 @@
 from datetime import datetime
 from kombu.utils import json
 import logging
+import random
 import re
 import requests
 import time
@@ -14,6 +15,10 @@ logger = logging.getLogger('zentral.core.stores.backends.datadog')
 
 
 class EventStore(BaseEventStore):
+    # log intake limits
+    max_batch_size = 1000
+    max_payload_bytes = 5 * 2**20  # uncompressed
+    max_retries = 3
     machine_events = True
     machine_events_url = True
     probe_events = True
@@ -50,7 +55,10 @@ class EventStore(BaseEventStore):
     def _serialize_event(self, event):
         if not isinstance(event, dict):
             event = event.serialize()
-        ddevent = event.pop("_zentral")
+        else:
+            # do not modify the event, it can still be used by the store worker
+            event = event.copy()
+        ddevent = event.pop("_zentral").copy()
         event_type = ddevent.pop("type")
         namespace = ddevent.get("namespace", event_type)
         ddevent[namespace] = event
@@ -72,6 +80,7 @@ class EventStore(BaseEventStore):
         http = {}
         usr = {}
         if request:
+            request = ddevent["request"] = request.copy()
             ip = request.pop("ip", None)
             if ip:
                 network_client["ip"] = ip
@@ -80,6 +89,7 @@ class EventStore(BaseEventStore):
                 http["useragent"] = user_agent
             user = request.get("user", None)
             if user:
+                user = request["user"] = user.copy()
                 for ztl_attr, dd_attr in (("id", "id"),
                                           ("email", "email"),
                                           ("username", "name")):
@@ -143,6 +153,58 @@ class EventStore(BaseEventStore):
         )
         r.raise_for_status()
 
+    def _iter_bulk_payloads(self, events):
+        # JSON arrays of entries, within the intake limits
+        entries = []
+        event_keys = []
+        payload_size = 2  # []
+        for event in events:
+            ddevent = self._serialize_event(event)
+            entry = json.dumps(ddevent).encode("utf-8")
+            entry_size = len(entry) + 1  # ,
+            if entries and (len(entries) >= self.max_batch_size
+                            or payload_size + entry_size > self.max_payload_bytes):
+                yield entries, event_keys
+                entries = []
+                event_keys = []
+                payload_size = 2
+            entries.append(entry)
+            event_keys.append((ddevent["id"], ddevent["index"]))
+            payload_size += entry_size
+        if entries:
+            yield entries, event_keys
+
+    def _post_bulk_payload(self, entries):
+        data = zlib.compress(b"[" + b",".join(entries) + b"]")
+        for i in range(self.max_retries):
+            r = self._session.post(
+                self.input_url,
+                data=data,
+                headers={"Content-Encoding": "deflate"}
+            )
+            if r.ok:
+                return
+            if r.status_code == 429 or r.status_code >= 500:
+                logger.error("Datadog status code %s for bulk store request", r.status_code)
+                if i + 1 < self.max_retries:
+                    seconds = random.uniform(3, 4) * (i + 1)
+                    logger.error("Retry Datadog bulk store request in %.1fs", seconds)
+                    time.sleep(seconds)
+                    continue
+            r.raise_for_status()
+
+    def bulk_store(self, events):
+        if self.batch_size < 2:
+            raise RuntimeError("bulk_store is not available when batch_size < 2")
+        for entries, event_keys in self._iter_bulk_payloads(events):
+            try:
+                self._post_bulk_payload(entries)
+            except Exception:
+                # the events of the other payloads can still be stored
+                logger.exception("Could not store %s event(s)", len(event_keys))
+                continue
+            yield from event_keys
+
     @staticmethod
     def _prepare_datetime(dt, tick=1):
         return str(int(time.mktime(dt.timetuple())) * tick)
@@ -0,0 +1,53 @@
+import random
+import time
+from unittest.mock import patch
+from dateutil import parser
+from django.core.management.base import BaseCommand
+from accounts.events import EventMetadata, LoginEvent
+from zentral.core.events import event_from_event_d
+from zentral.core.events.base import EventRequest
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the event_from_event_d round trip, eager dateutil parsing vs. lazy created_at parsing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--event-count', type=int, default=50000)
+        parser.add_argument('--stages', type=int, default=4,
+                            help="number of deserializations per event (preprocess, enrich, process, store)")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def build_event_ds(self, count, rng):
+        event_ds = []
+        for _ in range(count):
+            metadata = EventMetadata(request=EventRequest(user_agent="Mozilla/5.0", ip="10.0.0.1"),
+                                     tags=["zentral"])
+            event = LoginEvent(metadata, {"user": {"username": f"user{rng.randrange(1000)}"}})
+            event_ds.append(event.serialize(machine_metadata=False))
+        return event_ds
+
+    def run_benchmark(self, event_ds, stages, access_created_at):
+        start = time.perf_counter()
+        for event_d in event_ds:
+            for _ in range(stages):
+                event = event_from_event_d(event_d)
+                if access_created_at:
+                    event.metadata.created_at
+                event_d = event.serialize(machine_metadata=False)
+        return len(event_ds) * stages / (time.perf_counter() - start)
+
+    def handle(self, **options):
+        rng = random.Random(options["seed"])
+        event_ds = self.build_event_ds(options["event_count"], rng)
+        stages = options["stages"]
+        self.stdout.write(f"{options['event_count']} events, {stages} round trip(s) per event")
+        self.stdout.write(f"{'mode':>8} {'round trips/s':>14}")
+        # before the lazy parsing, the created_at values were always parsed with dateutil
+        with patch("zentral.core.events.base.parse_created_at", parser.parse):
+            eager_rps = self.run_benchmark(event_ds, stages, True)
+        self.stdout.write(f"{'eager':>8} {eager_rps:>14.0f}")
+        lazy_rps = self.run_benchmark(event_ds, stages, False)
+        self.stdout.write(f"{'lazy':>8} {lazy_rps:>14.0f} {lazy_rps / eager_rps:>7.1f}x")
+        # created_at values used in every stage, parsed on the fast path
+        accessed_rps = self.run_benchmark(event_ds, stages, True)
+        self.stdout.write(f"{'fast':>8} {accessed_rps:>14.0f} {accessed_rps / eager_rps:>7.1f}x")
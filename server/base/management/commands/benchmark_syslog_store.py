@@ -0,0 +1,90 @@
+import random
+import socketserver
+import threading
+import time
+from django.core.management.base import BaseCommand
+from accounts.events import EventMetadata, LoginEvent
+from zentral.core.stores.backends.syslog import EventStore
+
+
+class CountingTCPHandler(socketserver.BaseRequestHandler):
+    """Local syslog listener. Only counts the received bytes."""
+
+    def handle(self):
+        while True:
+            data = self.request.recv(262144)
+            if not data:
+                break
+            with self.server.lock:
+                self.server.received_bytes += len(data)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the syslog store TCP transport against a local listener, store vs. bulk_store'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--event-count', type=int, default=20000)
+        parser.add_argument('--batch-sizes', type=int, nargs="+", default=[10, 100, 1000])
+        parser.add_argument('--payload-size', type=int, default=512,
+                            help="approximate size of the event payloads, in bytes")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def build_events(self, count, payload_size, rng):
+        return [LoginEvent(EventMetadata(), {"user": {"username": f"user{rng.randrange(1000)}"},
+                                             "padding": "x" * payload_size}).serialize()
+                for _ in range(count)]
+
+    def wait_for_bytes(self, server, expected_bytes, timeout=60):
+        end = time.monotonic() + timeout
+        while time.monotonic() < end:
+            with server.lock:
+                if server.received_bytes >= expected_bytes:
+                    return True
+            time.sleep(0.001)
+        return False
+
+    def run_benchmark(self, server, events, framing, batch_size):
+        store = EventStore({"store_name": "benchmark", "protocol": "tcp",
+                            "host": "127.0.0.1", "port": server.server_address[1],
+                            "framing": framing, "batch_size": batch_size})
+        store.wait_and_configure()
+        expected_bytes = sum(len(store._serialize_event(event)) for event in events)
+        with server.lock:
+            server.received_bytes = 0
+        start = time.perf_counter()
+        if batch_size < 2:
+            for event in events:
+                store.store(event)
+        else:
+            for i in range(0, len(events), batch_size):
+                for _ in store.bulk_store(events[i:i + batch_size]):
+                    pass
+        # end to end, until the listener got everything
+        if not self.wait_for_bytes(server, expected_bytes):
+            self.stderr.write("Listener timeout")
+        duration = time.perf_counter() - start
+        store.socket.close()
+        return len(events) / duration, expected_bytes / duration / 2**20
+
+    def handle(self, **options):
+        rng = random.Random(options["seed"])
+        events = self.build_events(options["event_count"], options["payload_size"], rng)
+        server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), CountingTCPHandler)
+        server.daemon_threads = True
+        server.received_bytes = 0
+        server.lock = threading.Lock()
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            self.stdout.write(f"{options['event_count']} events, ~{options['payload_size']}B payloads")
+            self.stdout.write(f"{'framing':>15} {'method':>11} {'batch':>6} {'ev/s':>10} {'MiB/s':>8}")
+            for framing in ("null", "octet_counting"):
+                eps, mibps = self.run_benchmark(server, events, framing, 1)
+                self.stdout.write(f"{framing:>15} {'store':>11} {1:>6} {eps:>10.0f} {mibps:>8.1f}")
+                for batch_size in options["batch_sizes"]:
+                    eps, mibps = self.run_benchmark(server, events, framing, batch_size)
+                    self.stdout.write(f"{framing:>15} {'bulk_store':>11} {batch_size:>6} "
+                                      f"{eps:>10.0f} {mibps:>8.1f}")
+        finally:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,53 @@
+from unittest.mock import Mock, patch
+from django.test import SimpleTestCase
+from zentral.core.actions.backends.github import Action as GitHubAction
+from zentral.core.actions.backends.trello import Action as TrelloAction
+from zentral.core.actions.backends.twilio import Action as TwilioAction
+
+
+class ActionBackendsTestCase(SimpleTestCase):
+    @staticmethod
+    def build_event():
+        event = Mock()
+        event.get_notification_subject.return_value = "Subject"
+        event.get_notification_body.return_value = "Body"
+        return event
+
+    @patch("zentral.core.actions.backends.github.requests.get")
+    @patch("zentral.core.actions.backends.github.requests.post")
+    def test_github_timeout(self, requests_post, requests_get):
+        requests_get.return_value.json.return_value = [{"login": "yolo"}]
+        action = GitHubAction({"action_name": "github", "timeout": 17,
+                               "repository": "zentral/yolo", "user": "yolo", "access_token": "fomo"})
+        form = action.get_action_form()
+        self.assertEqual(form.fields["assignees"].choices, [("yolo", "yolo")])
+        self.assertEqual(requests_get.call_args.kwargs["timeout"], 17)
+        action.trigger(self.build_event(), None, None)
+        self.assertEqual(requests_post.call_args.kwargs["timeout"], 17)
+
+    @patch("zentral.core.actions.backends.trello.requests.get")
+    @patch("zentral.core.actions.backends.trello.requests.post")
+    def test_trello_timeout(self, requests_post, requests_get):
+        requests_get.return_value.json.side_effect = [
+            [{"id": "board", "name": "Board"}],
+            [{"id": "list", "name": "List"}],
+            [],
+        ]
+        requests_post.return_value.json.return_value = {"id": "label"}
+        action = TrelloAction({"action_name": "trello", "timeout": 17,
+                               "application_key": "yolo", "token": "fomo"})
+        action.trigger(self.build_event(), None, {"board": "Board", "list": "List", "labels": [{"color": "red"}]})
+        self.assertEqual(requests_get.call_count, 3)
+        self.assertEqual(requests_post.call_count, 2)
+        for call in requests_get.call_args_list + requests_post.call_args_list:
+            self.assertEqual(call.kwargs["timeout"], 17)
+
+    @patch("zentral.core.actions.backends.twilio.requests.post")
+    def test_twilio_timeout(self, requests_post):
+        action = TwilioAction({"action_name": "twilio",
+                               "account_sid": "yolo", "auth_token": "fomo",
+                               "from_number": "+1234", "to_numbers": ["+5678", "+9012"]})
+        action.trigger(self.build_event(), None, None)
+        self.assertEqual(requests_post.call_count, 2)
+        for call in requests_post.call_args_list:
+            self.assertEqual(call.kwargs["timeout"], 10)
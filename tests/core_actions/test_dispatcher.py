@@ -0,0 +1,223 @@
+import threading
+import time
+from unittest.mock import patch
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase
+from zentral.core.actions.backends.base import BaseAction
+from zentral.core.actions.dispatcher import ActionDispatcher
+from zentral.core.events.base import BaseEvent, EventMetadata
+from zentral.core.events.pipeline import process_event
+
+
+class TestAction(BaseAction):
+    def __init__(self, config_d, trigger_func=None):
+        super().__init__(config_d)
+        self.trigger_func = trigger_func
+        self.triggered = []
+        self.lock = threading.Lock()
+
+    def trigger(self, event, probe, action_config_d):
+        if self.trigger_func:
+            self.trigger_func()
+        with self.lock:
+            self.triggered.append((event, probe, action_config_d))
+
+
+def build_action(trigger_func=None, **config_d):
+    config_d["action_name"] = "test"
+    return TestAction(config_d, trigger_func)
+
+
+def wait_for(condition, timeout=5):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class ActionDispatcherTestCase(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.dispatcher = ActionDispatcher()
+
+    def tearDown(self):
+        self.dispatcher.shutdown()
+        super().tearDown()
+
+    # action config
+
+    def test_action_default_dispatch_options(self):
+        action = build_action(url="https://www.example.com")
+        self.assertEqual(action.timeout, 10)
+        self.assertEqual(action.concurrency, 4)
+        self.assertEqual(action.queue_size, 100)
+        self.assertEqual(action.max_retries, 3)
+        self.assertEqual(action.retry_delay, 30)
+        self.assertEqual(action.config_d, {"url": "https://www.example.com"})
+
+    def test_action_dispatch_options_bounds(self):
+        action = build_action(timeout=0, concurrency=1000, queue_size=-1, max_retries="12", retry_delay=7200)
+        self.assertEqual(action.timeout, 1)
+        self.assertEqual(action.concurrency, 20)
+        self.assertEqual(action.queue_size, 0)
+        self.assertEqual(action.max_retries, 10)
+        self.assertEqual(action.retry_delay, 3600)
+
+    def test_action_dispatch_options_error(self):
+        with self.assertRaises(ImproperlyConfigured) as cm:
+            build_action(concurrency="yolo")
+        self.assertEqual(cm.exception.args[0], "Action test concurrency must be an integer")
+
+    # dispatch
+
+    def test_dispatch(self):
+        action = build_action()
+        self.assertTrue(self.dispatcher.dispatch(action, "event", "probe", {"un": 1}))
+        self.assertTrue(wait_for(lambda: len(action.triggered) == 1))
+        self.assertEqual(action.triggered, [("event", "probe", {"un": 1})])
+
+    def test_slow_action_does_not_block_dispatch(self):
+        release = threading.Event()
+        action = build_action(trigger_func=release.wait, concurrency=2)
+        start = time.monotonic()
+        for i in range(10):
+            self.assertTrue(self.dispatcher.dispatch(action, f"event{i}", "probe", {}))
+        self.assertLess(time.monotonic() - start, 1)
+        release.set()
+        self.assertTrue(wait_for(lambda: len(action.triggered) == 10))
+
+    def test_concurrency_limit(self):
+        running = []
+        max_running = []
+        lock = threading.Lock()
+
+        def trigger_func():
+            with lock:
+                running.append(1)
+                max_running.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.pop()
+
+        action = build_action(trigger_func=trigger_func, concurrency=3)
+        for i in range(12):
+            self.dispatcher.dispatch(action, f"event{i}", "probe", {})
+        self.assertTrue(wait_for(lambda: len(action.triggered) == 12))
+        self.assertEqual(max(max_running), 3)
+
+    def test_saturated_action_spool(self):
+        release = threading.Event()
+        action = build_action(trigger_func=release.wait, concurrency=1, queue_size=1)
+        self.assertTrue(self.dispatcher.dispatch(action, "event0", "probe", {}))
+        self.assertTrue(self.dispatcher.dispatch(action, "event1", "probe", {}))
+        self.assertFalse(self.dispatcher.dispatch(action, "event2", "probe", {}))
+        self.assertEqual(self.dispatcher.spool_size(), 1)
+        release.set()
+        self.assertTrue(wait_for(lambda: len(action.triggered) == 3))
+        self.assertEqual(sorted(t[0] for t in action.triggered), ["event0", "event1", "event2"])
+        self.assertEqual(self.dispatcher.spool_size(), 0)
+
+    def test_other_actions_not_blocked(self):
+        release = threading.Event()
+        slow_action = build_action(trigger_func=release.wait, concurrency=1, queue_size=0)
+        slow_action.name = "slow"
+        action = build_action()
+        self.dispatcher.dispatch(slow_action, "event", "probe", {})
+        self.dispatcher.dispatch(action, "event", "probe", {})
+        self.assertTrue(wait_for(lambda: len(action.triggered) == 1))
+        self.assertEqual(slow_action.triggered, [])
+        release.set()
+        self.assertTrue(wait_for(lambda: len(slow_action.triggered) == 1))
+
+    @patch("zentral.core.actions.dispatcher.logger.exception")
+    def test_retry(self, logger_exception):
+        attempts = []
+
+        def trigger_func():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise ValueError("yolo")
+
+        action = build_action(trigger_func=trigger_func, max_retries=3)
+        action.retry_delay = 0.01  # not configurable below 1s
+        self.dispatcher.dispatch(action, "event", "probe", {})
+        self.assertTrue(wait_for(lambda: len(action.triggered) == 1))
+        self.assertEqual(len(attempts), 3)
+        self.assertEqual(logger_exception.call_count, 2)
+        logger_exception.assert_called_with("Could not trigger action %s. Attempt %s/%s. Spool trigger.",
+                                            "test", 2, 4)
+
+    @patch("zentral.core.actions.dispatcher.logger.exception")
+    def test_max_retries(self, logger_exception):
+        attempts = []
+
+        def trigger_func():
+            attempts.append(1)
+            raise ValueError("yolo")
+
+        action = build_action(trigger_func=trigger_func, max_retries=1)
+        action.retry_delay = 0.01
+        self.dispatcher.dispatch(action, "event", "probe", {})
+        self.assertTrue(wait_for(lambda: logger_exception.call_count == 2))
+        logger_exception.assert_called_with("Could not trigger action %s. Attempt %s/%s. Drop trigger.",
+                                            "test", 2, 2)
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(action.triggered, [])
+        self.assertEqual(self.dispatcher.spool_size(), 0)
+
+    @patch("zentral.core.actions.dispatcher.logger.error")
+    def test_spool_full(self, logger_error):
+        release = threading.Event()
+        action = build_action(trigger_func=release.wait, concurrency=1, queue_size=0)
+        self.dispatcher.max_spool_size = 1
+        self.assertTrue(self.dispatcher.dispatch(action, "event0", "probe", {}))
+        self.assertFalse(self.dispatcher.dispatch(action, "event1", "probe", {}))
+        self.assertFalse(self.dispatcher.dispatch(action, "event2", "probe", {}))
+        self.assertEqual(self.dispatcher.spool_size(), 1)
+        logger_error.assert_called_once_with("Action retry spool full. Drop %s trigger.", "test")
+        release.set()
+
+    def test_reconfigured_action_new_executor(self):
+        action = build_action(concurrency=1, queue_size=0)
+        self.assertTrue(self.dispatcher.dispatch(action, "event0", "probe", {}))
+        self.assertTrue(wait_for(lambda: len(action.triggered) == 1))
+        executor, slots = self.dispatcher._get_executor(action)
+        self.assertEqual(executor._max_workers, 1)
+        reconfigured_action = build_action(concurrency=3, queue_size=10)
+        self.assertTrue(self.dispatcher.dispatch(reconfigured_action, "event1", "probe", {}))
+        self.assertTrue(wait_for(lambda: len(reconfigured_action.triggered) == 1))
+        new_executor, new_slots = self.dispatcher._get_executor(reconfigured_action)
+        self.assertIsNot(new_executor, executor)
+        self.assertEqual(new_executor._max_workers, 3)
+        self.assertEqual(len(self.dispatcher._executors), 1)
+
+    @patch("zentral.core.actions.dispatcher.logger.error")
+    def test_shutdown_drops_spooled_triggers(self, logger_error):
+        action = build_action()
+        self.dispatcher._spool_trigger(3600, action, "event", "probe", {}, 1)
+        self.assertEqual(self.dispatcher.spool_size(), 1)
+        self.dispatcher.shutdown()
+        logger_error.assert_called_once_with("Action dispatcher shut down. Drop %s spooled trigger(s).", 1)
+
+    # pipeline
+
+    def test_process_event_dispatch(self):
+        release = threading.Event()
+        action = build_action(trigger_func=release.wait, concurrency=1)
+
+        class TestProbe:
+            pk = 1
+            actions = [(action, {"deux": 2})]
+
+        probe = TestProbe()
+        event = BaseEvent(EventMetadata(probes=[{"pk": 1}]), {})
+        with patch("zentral.core.events.pipeline.action_dispatcher", self.dispatcher), \
+             patch("zentral.core.events.base.all_probes_dict", {1: probe}):
+            process_event(event)
+        # the event processing does not wait for the trigger
+        self.assertEqual(action.triggered, [])
+        release.set()
+        self.assertTrue(wait_for(lambda: len(action.triggered) == 1))
+        self.assertEqual(action.triggered, [(event, probe, {"deux": 2})])
@@ -0,0 +1,220 @@
+from datetime import datetime
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.utils.crypto import get_random_string
+from zentral.contrib.inventory.models import MachineSnapshotCommit, Tag
+from zentral.contrib.osquery.compliance_checks import OsqueryCheck
+from zentral.contrib.osquery.models import Query
+from zentral.core.compliance_checks import compliance_check_classes
+from zentral.core.compliance_checks.models import ComplianceCheck, MachineStatus, Status
+from zentral.core.compliance_checks.utils import get_machine_compliance_check_statuses
+from tests.inventory.utils import force_jmespath_check
+
+
+# get_machine_compliance_check_statuses before the cached tag scoped compliance checks
+LEGACY_SCOPED_CC_QUERIES = {
+    "InventoryJMESPathCheck": (
+        "select cc.model, cc.id, cc.name, cc.version "
+        "from compliance_checks_compliancecheck as cc "
+        "join inventory_jmespathcheck as jc on (jc.compliance_check_id = cc.id) "
+        "left join inventory_jmespathcheck_tags as jct on (jct.jmespathcheck_id = jc.id) "
+        "where (jct.tag_id is null or jct.tag_id = any (%(tag_ids)s)) "
+        "and lower(jc.source_name) in ("
+        " select distinct lower(s.name)"
+        " from inventory_source as s"
+        " join inventory_currentmachinesnapshot as cms on (cms.source_id = s.id)"
+        " where cms.serial_number = %(serial_number)s"
+        ") and jc.platforms && array("
+        " select platform from inventory_machinesnapshot as ms"
+        " join inventory_currentmachinesnapshot as cms on (cms.machine_snapshot_id = ms.id)"
+        " where cms.serial_number = %(serial_number)s"
+        ")"
+    ),
+    "OsqueryCheck": (
+        "select cc.model, cc.id, cc.name, cc.version "
+        "from compliance_checks_compliancecheck as cc "
+        "join osquery_query as q on (q.compliance_check_id = cc.id) "
+        "join compliance_checks_machinestatus as ms on (ms.compliance_check_id = cc.id) "
+        "where ms.serial_number = %(serial_number)s"
+    ),
+    "MunkiScriptCheck": (
+        "select cc.model, cc.id, cc.name, cc.version "
+        "from compliance_checks_compliancecheck as cc "
+        "join munki_scriptcheck as sc on (sc.compliance_check_id = cc.id) "
+        "join compliance_checks_machinestatus as ms on (ms.compliance_check_id = cc.id) "
+        "where ms.serial_number = %(serial_number)s"
+    ),
+}
+
+
+def legacy_get_machine_compliance_check_statuses(serial_number, tags):
+    scoped_cc_queries = [LEGACY_SCOPED_CC_QUERIES[model] for model in compliance_check_classes
+                         if model in LEGACY_SCOPED_CC_QUERIES]
+    scoped_cc_query = " UNION ".join(scoped_cc_queries)
+    if len(scoped_cc_queries) < 2:
+        scoped_cc_query += " group by cc.model, cc.id, cc.name, cc.version"
+    query = (
+        f"with scoped_cc as ({scoped_cc_query}) "
+        "select cc.model, cc.id, cc.name, "
+        "case when ms.compliance_check_version = cc.version then ms.status else null end as status,"
+        "case when ms.compliance_check_version = cc.version then ms.status_time else null end as status_time "
+        "from scoped_cc as cc "
+        "left join compliance_checks_machinestatus as ms on (cc.id = ms.compliance_check_id) "
+        "where ms.serial_number is null or ms.serial_number = %(serial_number)s "
+        "order by cc.name"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(query, {"serial_number": serial_number,
+                               "tag_ids": [t.id for t in tags] if tags else None})
+        return [(cc_model, cc_pk, cc_name, Status.PENDING if status is None else Status(status), status_time)
+                for cc_model, cc_pk, cc_name, status, status_time in cursor.fetchall()]
+
+
+class ComplianceCheckStatusesTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        # the cache is not rolled back with the DB
+        cache.clear()
+
+    # utility methods
+
+    def _force_machine(self, sources_platforms, serial_number=None):
+        if serial_number is None:
+            serial_number = get_random_string(12)
+        for source_name, platform in sources_platforms:
+            MachineSnapshotCommit.objects.commit_machine_snapshot_tree({
+                "source": {"module": "tests.zentral.io", "name": source_name},
+                "serial_number": serial_number,
+                "platform": platform,
+            })
+        return serial_number
+
+    def _force_status(self, cc, serial_number, status=Status.OK, version=None):
+        return MachineStatus.objects.create(
+            serial_number=serial_number,
+            compliance_check=cc,
+            compliance_check_version=cc.version if version is None else version,
+            status=status.value,
+            status_time=datetime.utcnow()
+        )
+
+    def _sorted(self, compliance_check_statuses):
+        return sorted(compliance_check_statuses, key=lambda t: (t[2], t[1]))
+
+    # tests
+
+    def test_no_compliance_checks(self):
+        serial_number = self._force_machine([("Yolo", "MACOS")])
+        self.assertEqual(get_machine_compliance_check_statuses(serial_number, []), [])
+
+    def test_same_results_as_legacy_query(self):
+        tag1 = Tag.objects.create(name=get_random_string(12))
+        tag2 = Tag.objects.create(name=get_random_string(12))
+        machines = [
+            (self._force_machine([("Yolo", "MACOS")]), [tag1]),
+            (self._force_machine([("Yolo", "MACOS"), ("Fomo", "IOS")]), [tag1, tag2]),
+            (self._force_machine([("fomo", "WINDOWS")]), []),
+            (self._force_machine([("Yolo", "LINUX")]), [tag2]),
+        ]
+        ccs = []
+        for source_name in ("Yolo", "FOMO", "Other"):
+            for platforms in (["MACOS"], ["IOS", "WINDOWS"], ["LINUX", "MACOS"], []):
+                for tags in (None, [tag1], [tag2], [tag1, tag2]):
+                    ccs.append(force_jmespath_check(source_name, platforms=platforms, tags=tags).compliance_check)
+        for i, cc in enumerate(ccs):
+            if i % 3 == 0:
+                continue
+            # statuses for all the machines, because of the legacy query behavior
+            # with the compliance checks having only statuses for other machines.
+            for serial_number, _ in machines:
+                self._force_status(cc, serial_number,
+                                   status=Status.FAILED if i % 2 else Status.OK,
+                                   version=cc.version - (i % 5 == 0))
+        for serial_number, tags in machines:
+            legacy_statuses = legacy_get_machine_compliance_check_statuses(serial_number, tags)
+            self.assertTrue(len(legacy_statuses) > 0)
+            # not cached, then cached
+            for _ in range(2):
+                self.assertEqual(
+                    self._sorted(get_machine_compliance_check_statuses(serial_number, tags)),
+                    self._sorted(legacy_statuses)
+                )
+
+    def test_other_machine_status_pending(self):
+        serial_number = self._force_machine([("Yolo", "MACOS")])
+        cc = force_jmespath_check("Yolo").compliance_check
+        self._force_status(cc, get_random_string(12))
+        # dropped by the legacy query
+        self.assertEqual(legacy_get_machine_compliance_check_statuses(serial_number, []), [])
+        self.assertEqual(
+            get_machine_compliance_check_statuses(serial_number, []),
+            [(cc.model, cc.pk, cc.name, Status.PENDING, None)]
+        )
+
+    def test_cached_tag_scoped_compliance_checks(self):
+        serial_number = self._force_machine([("Yolo", "MACOS")])
+        cc = force_jmespath_check("Yolo").compliance_check
+        ms = self._force_status(cc, serial_number)
+        expected_result = [(cc.model, cc.pk, cc.name, Status.OK, ms.status_time)]
+        with self.assertNumQueries(3):  # tag scoped compliance checks, statuses, machine sources & platforms
+            self.assertEqual(get_machine_compliance_check_statuses(serial_number, []), expected_result)
+        with self.assertNumQueries(2):
+            self.assertEqual(get_machine_compliance_check_statuses(serial_number, []), expected_result)
+
+    def test_status_update_not_cached(self):
+        serial_number = self._force_machine([("Yolo", "MACOS")])
+        cc = force_jmespath_check("Yolo").compliance_check
+        self.assertEqual(get_machine_compliance_check_statuses(serial_number, [])[0][3], Status.PENDING)
+        self._force_status(cc, serial_number, status=Status.FAILED)
+        self.assertEqual(get_machine_compliance_check_statuses(serial_number, [])[0][3], Status.FAILED)
+
+    def test_new_compliance_check_cache_invalidation(self):
+        serial_number = self._force_machine([("Yolo", "MACOS")])
+        self.assertEqual(get_machine_compliance_check_statuses(serial_number, []), [])
+        cc = force_jmespath_check("Yolo").compliance_check
+        self.assertEqual(get_machine_compliance_check_statuses(serial_number, []),
+                         [(cc.model, cc.pk, cc.name, Status.PENDING, None)])
+
+    def test_deleted_compliance_check_cache_invalidation(self):
+        serial_number = self._force_machine([("Yolo", "MACOS")])
+        jmespath_check = force_jmespath_check("Yolo")
+        self.assertEqual(len(get_machine_compliance_check_statuses(serial_number, [])), 1)
+        jmespath_check.compliance_check.delete()
+        self.assertEqual(get_machine_compliance_check_statuses(serial_number, []), [])
+
+    def test_jmespath_check_update_cache_invalidation(self):
+        serial_number = self._force_machine([("Yolo", "MACOS")])
+        jmespath_check = force_jmespath_check("Yolo")
+        self.assertEqual(len(get_machine_compliance_check_statuses(serial_number, [])), 1)
+        jmespath_check.platforms = ["WINDOWS"]
+        jmespath_check.save()
+        self.assertEqual(get_machine_compliance_check_statuses(serial_number, []), [])
+
+    def test_jmespath_check_tags_cache_invalidation(self):
+        tag = Tag.objects.create(name=get_random_string(12))
+        serial_number = self._force_machine([("Yolo", "MACOS")])
+        jmespath_check = force_jmespath_check("Yolo")
+        self.assertEqual(len(get_machine_compliance_check_statuses(serial_number, [])), 1)
+        jmespath_check.tags.add(tag)
+        self.assertEqual(get_machine_compliance_check_statuses(serial_number, []), [])
+        self.assertEqual(len(get_machine_compliance_check_statuses(serial_number, [tag])), 1)
+
+    def test_tag_deletion_cache_invalidation(self):
+        tag = Tag.objects.create(name=get_random_string(12))
+        serial_number = self._force_machine([("Yolo", "MACOS")])
+        force_jmespath_check("Yolo", tags=[tag])
+        self.assertEqual(get_machine_compliance_check_statuses(serial_number, []), [])
+        tag.delete()
+        # no more tags, the compliance check is in scope for all the machines
+        self.assertEqual(len(get_machine_compliance_check_statuses(serial_number, [])), 1)
+
+    def test_query_compliance_check_cache_invalidation(self):
+        serial_number = self._force_machine([("Yolo", "MACOS")])
+        # compliance check created before the query points to it
+        cc = ComplianceCheck.objects.create(model=OsqueryCheck.get_model(), name=get_random_string(12), version=1)
+        ms = self._force_status(cc, serial_number)
+        self.assertEqual(get_machine_compliance_check_statuses(serial_number, []), [])
+        Query.objects.create(name=cc.name, sql="select 1 from processes;", compliance_check=cc)
+        self.assertEqual(get_machine_compliance_check_statuses(serial_number, []),
+                         [(cc.model, cc.pk, cc.name, Status.OK, ms.status_time)])
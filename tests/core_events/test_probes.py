@@ -3,7 +3,7 @@ from django.utils.crypto import get_random_string
 from zentral.core.events import event_from_event_d
 from zentral.core.events.pipeline import enrich_event
 from zentral.core.incidents.models import Incident, IncidentUpdate, MachineIncident, Severity
-from zentral.core.probes.conf import all_probes
+from zentral.core.probes.conf import all_probes, ProbeList
 from zentral.core.probes.models import ProbeSource
 
 
@@ -239,3 +239,14 @@ class EventDeserializationTestCase(TestCase):
         events = list(enrich_event(serialized_event))
         self.assertEqual(len(events), 1)
         self.assertEqual(events[0].metadata.event_type, "inventory_heartbeat")
+
+    def test_enrich_event_probes_matcher(self):
+        probes = ProbeList([self.probe])
+        event = list(enrich_event(serialized_event, probes.matcher()))[-1]
+        self.assertEqual(event.metadata.event_type, "inventory_heartbeat")
+        self.assertEqual(event.metadata.probes, [{"pk": self.probe.pk, "name": self.probe.name}])
+        # the probes are loaded from the given dict
+        updated_event = event_from_event_d(event.serialize())
+        probes_dict = probes.dict(item_func=lambda p: [(p.pk, p)], unique_key=True)
+        self.assertEqual(list(updated_event.metadata.iter_loaded_probes(probes_dict)), [self.probe])
+        self.assertEqual(list(updated_event.metadata.iter_loaded_probes({})), [])
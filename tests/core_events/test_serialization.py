@@ -1,6 +1,9 @@
+from datetime import datetime, timezone
+from unittest.mock import patch
 from django.core.cache import cache
 from django.test import TestCase, override_settings
-from zentral.contrib.inventory.models import MachineSnapshotCommit
+from zentral.contrib.inventory.models import MachineSnapshotCommit, MetaMachine
+from zentral.core.events import event_from_event_d
 from zentral.core.events.base import EventMetadata, EventRequest, BaseEvent, register_event_type
 
 
@@ -66,7 +69,7 @@ class EventSerializationTestCase(TestCase):
         self.assertEqual(source_machine["groups"][0]["reference"], "grp1")
         self.assertEqual(source_machine["os_version"], "OS X 10.11.1")
         # cached info
-        cache_key = f"mm-si_{self.ms.serial_number}"
+        cache_key = MetaMachine(self.ms.serial_number).get_cache_key("mm-si")
         machine = cache.get(cache_key)
         self.assertEqual(machine["meta_business_units"][0]["id"],
                          self.ms.business_unit.meta_business_unit.pk)
@@ -90,18 +93,18 @@ class EventSerializationTestCase(TestCase):
         metadata = d["_zentral"]
         self.assertEqual(metadata["request"], {"ip": "10.1.2.3"})
         event = make_event(ua="YO! ua")
-        cache.delete(f"mm-si_{self.ms.serial_number}")
+        cache.delete(MetaMachine(self.ms.serial_number).get_cache_key("mm-si"))
         d = event.serialize()
         metadata = d["_zentral"]
         self.assertEqual(metadata["request"], {"user_agent": "YO! ua"})
-        cache.delete(f"mm-si_{self.ms.serial_number}")
+        cache.delete(MetaMachine(self.ms.serial_number).get_cache_key("mm-si"))
 
     def test_event_without_request(self):
         event = make_event()
         d = event.serialize()
         metadata = d["_zentral"]
         self.assertNotIn("request", metadata)
-        cache.delete(f"mm-si_{self.ms.serial_number}")
+        cache.delete(MetaMachine(self.ms.serial_number).get_cache_key("mm-si"))
 
     def test_event_routing_key(self):
         event = make_event(routing_key="yolo123")
@@ -109,3 +112,53 @@ class EventSerializationTestCase(TestCase):
         self.assertEqual(d["_zentral"]["routing_key"], "yolo123")
         event2 = TestEvent3.deserialize(d)
         self.assertEqual(event2.metadata.routing_key, "yolo123")
+
+    def test_event_metadata_slots(self):
+        metadata = EventMetadata()
+        self.assertFalse(hasattr(metadata, "__dict__"))
+        with self.assertRaises(AttributeError):
+            metadata.yolo = 1
+
+    def test_event_metadata_default_created_at(self):
+        before = datetime.utcnow()
+        metadata = EventMetadata()
+        self.assertTrue(before <= metadata.created_at <= datetime.utcnow())
+
+    def test_event_metadata_lazy_created_at(self):
+        with patch("zentral.core.events.base.parser.parse") as parse:
+            event = TestEvent3.deserialize(
+                make_event(with_msn=False).serialize(machine_metadata=False)
+            )
+            self.assertIsNone(event.metadata._created_at)
+            # serialized as is, not parsed
+            d = event.serialize(machine_metadata=False)
+            self.assertIsNone(event.metadata._created_at)
+            self.assertEqual(d["_zentral"]["created_at"], event.metadata._raw_created_at)
+            # parsed on first use, on the fast path
+            self.assertIsInstance(event.metadata.created_at, datetime)
+        parse.assert_not_called()
+
+    def test_event_metadata_created_at_parsing(self):
+        for value, expected_created_at, expected_serialized_created_at in (
+            ("2024-01-02T03:04:05", datetime(2024, 1, 2, 3, 4, 5), "2024-01-02T03:04:05"),
+            ("2024-01-02T03:04:05.123456", datetime(2024, 1, 2, 3, 4, 5, 123456), "2024-01-02T03:04:05.123456"),
+            ("2024-01-02T03:04:05+00:00", datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc),
+             "2024-01-02T03:04:05+00:00"),
+            # dateutil fallback
+            ("2024-01-02T03:04:05Z", datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc),
+             "2024-01-02T03:04:05+00:00"),
+            ("Tue, 02 Jan 2024 03:04:05", datetime(2024, 1, 2, 3, 4, 5), "2024-01-02T03:04:05"),
+        ):
+            event_d = make_event(with_msn=False).serialize(machine_metadata=False)
+            event_d["_zentral"]["created_at"] = value
+            event = event_from_event_d(event_d)
+            self.assertEqual(event.serialize(machine_metadata=False)["_zentral"]["created_at"],
+                             expected_serialized_created_at)
+            self.assertEqual(event.metadata.created_at, expected_created_at)
+
+    def test_event_metadata_created_at_setter(self):
+        metadata = EventMetadata(created_at=datetime(2024, 1, 2))
+        metadata.created_at = "2024-01-03T00:00:00"
+        self.assertEqual(metadata.created_at, datetime(2024, 1, 3))
+        metadata.created_at = datetime(2024, 1, 4)
+        self.assertEqual(metadata.created_at, datetime(2024, 1, 4))
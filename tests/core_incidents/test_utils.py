@@ -1,4 +1,5 @@
 from datetime import datetime
+from unittest.mock import patch
 from django.http import HttpRequest
 from django.test import TestCase
 from django.utils.crypto import get_random_string
@@ -7,7 +8,9 @@ from zentral.core.incidents.events import (IncidentCreatedEvent, IncidentSeverit
                                            IncidentStatusUpdatedEvent, MachineIncidentCreatedEvent,
                                            MachineIncidentStatusUpdatedEvent)
 from zentral.core.incidents.models import Incident, IncidentUpdate, MachineIncident, Severity, Status
-from zentral.core.incidents.utils import apply_incident_updates, update_incident_status, update_machine_incident_status
+from zentral.core.incidents import utils as incidents_utils
+from zentral.core.incidents.utils import (apply_incident_updates, apply_incident_updates_batch,
+                                          update_incident_status, update_machine_incident_status)
 
 
 class TestEvent(BaseEvent):
@@ -477,6 +480,176 @@ class IncidentTestCase(TestCase):
              "machine_incident": [(new_machine_incident.pk,)]}
         )
 
+    # batches
+
+    def _create_batch(self, serial_numbers, severity=Severity.CRITICAL, incident_type=None, key=None):
+        if incident_type is None:
+            incident_type = get_random_string(12)
+        if key is None:
+            key = {"key": get_random_string(12)}
+        original_events = [
+            TestEvent(EventMetadata(machine_serial_number=serial_number,
+                                    incident_updates=[IncidentUpdate(incident_type, key, severity)]), {})
+            for serial_number in serial_numbers
+        ]
+        return original_events, incident_type, key
+
+    def test_batch_open_incident_and_machine_incidents(self):
+        serial_numbers = [get_random_string(12) for _ in range(50)]
+        original_events, incident_type, key = self._create_batch(serial_numbers)
+        # get incident, create incident, get machine incidents, create machine incidents + 2 savepoints
+        with self.assertNumQueries(8):
+            events = apply_incident_updates_batch(original_events)
+        incident = Incident.objects.get(incident_type=incident_type, key=key)
+        self.assertEqual(incident.status, Status.OPEN.value)
+        self.assertEqual(MachineIncident.objects.filter(incident=incident, status=Status.OPEN.value).count(), 50)
+        # the incident creation is linked to the first event
+        self.assertEqual([type(e) for e in events[0]], [IncidentCreatedEvent, MachineIncidentCreatedEvent])
+        for original_event, incident_events in zip(original_events[1:], events[1:]):
+            self.assertEqual(len(incident_events), 1)
+            machine_incident_event = incident_events[0]
+            self.assertIsInstance(machine_incident_event, MachineIncidentCreatedEvent)
+            machine_incident = MachineIncident.objects.get(pk=machine_incident_event.payload["machine_incident"]["pk"])
+            self.assertEqual(machine_incident.serial_number, original_event.metadata.machine_serial_number)
+            self.assertEqual(machine_incident_event.metadata.index, 0)
+            self.assertEqual(machine_incident_event.metadata.machine_serial_number, machine_incident.serial_number)
+            self.assertEqual(
+                original_event.metadata.objects,
+                {"yolo": [(17,)],
+                 "incident": [(incident.pk,)],
+                 "machine_incident": [(machine_incident.pk,)]}
+            )
+        # same uuid for the incident events of the same original event
+        self.assertEqual(events[0][0].metadata.uuid, events[0][1].metadata.uuid)
+        self.assertEqual([e.metadata.index for e in events[0]], [0, 1])
+        self.assertNotEqual(events[0][0].metadata.uuid, events[1][0].metadata.uuid)
+
+    def test_batch_open_incident_max_severity(self):
+        original_events, incident_type, key = self._create_batch(["12345678"], severity=Severity.MAJOR)
+        original_events2, _, _ = self._create_batch(["87654321"], severity=Severity.CRITICAL,
+                                                    incident_type=incident_type, key=key)
+        existing_incident = Incident.objects.create(
+            incident_type=incident_type,
+            key=key,
+            status=Status.OPEN.value,
+            status_time=datetime.utcnow(),
+            severity=Severity.MINOR.value
+        )
+        events = apply_incident_updates_batch(original_events + original_events2)
+        # only one severity update, linked to the event with the max severity
+        self.assertEqual([type(e) for e in events[0]], [MachineIncidentCreatedEvent])
+        self.assertEqual([type(e) for e in events[1]], [IncidentSeverityUpdatedEvent, MachineIncidentCreatedEvent])
+        self.assertEqual(events[1][0].payload["previous_severity"], Severity.MINOR.value)
+        existing_incident.refresh_from_db()
+        self.assertEqual(existing_incident.severity, Severity.CRITICAL.value)
+
+    def test_batch_close_machine_incidents_and_incident(self):
+        serial_numbers = [get_random_string(12) for _ in range(20)]
+        original_events, incident_type, key = self._create_batch(serial_numbers, severity=Severity.NONE)
+        existing_incident = Incident.objects.create(
+            incident_type=incident_type,
+            key=key,
+            status=Status.OPEN.value,
+            status_time=datetime.utcnow(),
+            severity=Severity.MAJOR.value
+        )
+        existing_machine_incidents = MachineIncident.objects.bulk_create([
+            MachineIncident(incident=existing_incident,
+                            serial_number=serial_number,
+                            status=Status.OPEN.value,
+                            status_time=datetime.utcnow())
+            for serial_number in serial_numbers
+        ])
+        # get machine incidents, update machine incidents, count open machine incidents, update incident
+        with self.assertNumQueries(6):
+            events = apply_incident_updates_batch(original_events)
+        for incident_events in events[:-1]:
+            self.assertEqual([type(e) for e in incident_events], [MachineIncidentStatusUpdatedEvent])
+        # the incident closing is linked to the last event
+        self.assertEqual([type(e) for e in events[-1]],
+                         [MachineIncidentStatusUpdatedEvent, IncidentStatusUpdatedEvent])
+        self.assertEqual(events[-1][1].payload["previous_status"]["status"], Status.OPEN.value)
+        existing_incident.refresh_from_db()
+        self.assertEqual(existing_incident.status, Status.CLOSED.value)
+        for machine_incident in existing_machine_incidents:
+            machine_incident.refresh_from_db()
+            self.assertEqual(machine_incident.status, Status.CLOSED.value)
+
+    def test_batch_open_and_close_machine_incidents(self):
+        original_events, incident_type, key = self._create_batch(["12345678"], severity=Severity.NONE)
+        original_events2, _, _ = self._create_batch(["87654321"], incident_type=incident_type, key=key)
+        existing_incident = Incident.objects.create(
+            incident_type=incident_type,
+            key=key,
+            status=Status.OPEN.value,
+            status_time=datetime.utcnow(),
+            severity=Severity.CRITICAL.value
+        )
+        existing_machine_incident = MachineIncident.objects.create(
+            incident=existing_incident,
+            serial_number="12345678",
+            status=Status.OPEN.value,
+            status_time=datetime.utcnow()
+        )
+        events = apply_incident_updates_batch(original_events + original_events2)
+        self.assertEqual([type(e) for e in events[0]], [MachineIncidentStatusUpdatedEvent])
+        self.assertEqual([type(e) for e in events[1]], [MachineIncidentCreatedEvent])
+        existing_machine_incident.refresh_from_db()
+        self.assertEqual(existing_machine_incident.status, Status.CLOSED.value)
+        # the incident is kept open for the other machine
+        existing_incident.refresh_from_db()
+        self.assertEqual(existing_incident.status, Status.OPEN.value)
+        self.assertEqual(events[1][0].payload["pk"], existing_incident.pk)
+
+    def test_batch_same_machine_updates_applied_in_order(self):
+        original_events, incident_type, key = self._create_batch(["12345678"])
+        original_events2, _, _ = self._create_batch(["12345678"], severity=Severity.NONE,
+                                                    incident_type=incident_type, key=key)
+        events = apply_incident_updates_batch(original_events + original_events2)
+        self.assertEqual([type(e) for e in events[0]], [IncidentCreatedEvent, MachineIncidentCreatedEvent])
+        self.assertEqual([type(e) for e in events[1]],
+                         [MachineIncidentStatusUpdatedEvent, IncidentStatusUpdatedEvent])
+        self.assertEqual(Incident.objects.get(incident_type=incident_type, key=key).status, Status.CLOSED.value)
+
+    def test_batch_different_incidents(self):
+        original_events, incident_type, key = self._create_batch(["12345678"])
+        original_events2, incident_type2, key2 = self._create_batch(["12345678"])
+        original_events[0].metadata.incident_updates.extend(original_events2[0].metadata.incident_updates)
+        events = apply_incident_updates_batch(original_events + [self._create_event()[0]])
+        self.assertEqual([type(e) for e in events[0]],
+                         [IncidentCreatedEvent, MachineIncidentCreatedEvent,
+                          IncidentCreatedEvent, MachineIncidentCreatedEvent])
+        self.assertEqual([e.metadata.index for e in events[0]], [0, 1, 2, 3])
+        self.assertEqual([e.payload["type"] for e in events[0]],
+                         [incident_type, incident_type, incident_type2, incident_type2])
+        self.assertEqual([type(e) for e in events[1]], [IncidentCreatedEvent])
+
+    def test_batch_failure_rolls_back_all_the_groups(self):
+        original_events, incident_type, key = self._create_batch(["12345678"])
+        original_events2, incident_type2, key2 = self._create_batch(["87654321"])
+        open_incident_round = incidents_utils._open_incident_round
+        calls = []
+
+        def failing_open_incident_round(updates):
+            calls.append(updates)
+            if len(calls) > 1:
+                raise ValueError("YOLO")
+            yield from open_incident_round(updates)
+
+        with patch("zentral.core.incidents.utils._open_incident_round", side_effect=failing_open_incident_round):
+            with self.assertRaises(ValueError):
+                apply_incident_updates_batch(original_events + original_events2)
+        # the first group is rolled back too
+        self.assertFalse(Incident.objects.filter(incident_type__in=[incident_type, incident_type2]).exists())
+        self.assertFalse(MachineIncident.objects.filter(serial_number__in=["12345678", "87654321"]).exists())
+        # re-applied, the updates are not lost
+        events = apply_incident_updates_batch(original_events)
+        self.assertEqual([type(e) for e in events[0]], [IncidentCreatedEvent, MachineIncidentCreatedEvent])
+
+    def test_batch_no_incident_updates(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(apply_incident_updates_batch([TestEvent(EventMetadata(), {})]), [[]])
+
     def test_update_incident_status_noop(self):
         incident = Incident.objects.create(
             incident_type=get_random_string(12),
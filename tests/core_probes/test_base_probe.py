@@ -3,7 +3,8 @@ from zentral.contrib.inventory.models import MetaBusinessUnit, Tag
 from zentral.core.events import event_types
 from zentral.core.events.base import BaseEvent, EventMetadata
 from zentral.core.incidents.models import Severity
-from zentral.core.probes.base import BaseProbe, get_flattened_payload_values
+from zentral.core.probes.base import BaseProbe, PayloadAttributePath
+from zentral.core.probes.management.commands.benchmark_payload_filters import get_flattened_payload_values
 from zentral.core.probes.models import ProbeSource
 from tests.inventory.utils import MockMetaMachine
 
@@ -317,6 +318,33 @@ class PayloadFilterBaseProbeTestCase(TestCase):
                                        ({"a": [{"b": [2, 3, 3]}]}, ["a", "b"], {"2", "3"})):
             self.assertEqual(set(get_flattened_payload_values(payload, attrs)), result)
 
+    def test_payload_attribute_path_get_values(self):
+        for payload, attribute in (({"a": 1}, "a"),
+                                   ({"a": [{"b": [2, 3, 3]}]}, "a.b"),
+                                   ({"a": [[{"b": 1}, {"b": [True, None]}], {"b": {"c": 2}}]}, "a.b"),
+                                   ([{"a": {"b": "c"}}, {"a": [{"b": "d"}, "e"]}], "a.b"),
+                                   ({"a": {"b": {"c": set(["abc"]), "d": "d"}}}, "a.b.c"),
+                                   ({"a": "b"}, "a.b"),
+                                   ({"a": None}, "a"),
+                                   ({}, "a.b.c")):
+            self.assertEqual(PayloadAttributePath(attribute).get_values(payload),
+                             set(get_flattened_payload_values(payload, attribute.split("."))))
+
+    def test_payload_attribute_path_cached_values(self):
+        path = PayloadAttributePath("a.b")
+        payload_values_cache = {}
+        self.assertEqual(path.get_cached_values({"a": {"b": 1}}, payload_values_cache), {"1"})
+        self.assertEqual(payload_values_cache, {"a.b": {"1"}})
+        # memoized
+        self.assertEqual(path.get_cached_values({"a": {"b": 2}}, payload_values_cache), {"1"})
+
+    def test_probe_test_event_payload_values_cache(self):
+        event = _build_event("base", machine_serial_number="YOZO",
+                             payload={"yo": "yoval1", "yo2": ["yo2val"], "zo2": "zo2val"})
+        self.assertTrue(self.probe.test_event(event))
+        self.assertEqual(event.payload_values_cache["yo"], {"yoval1"})
+        self.assertEqual(event.payload_values_cache["yo2"], {"yo2val"})
+
     def test_dotted_payload_attribute(self):
         payload_filter = self.probe.payload_filters[2]
         for payload, result in (({"a": 1}, False),
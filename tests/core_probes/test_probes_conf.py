@@ -1,6 +1,8 @@
 from django.test import TestCase
 from django.utils.crypto import get_random_string
-from zentral.core.probes.conf import all_probes, all_probes_dict
+from accounts.events import LoginEvent, LogoutEvent
+from zentral.core.events.base import EventMetadata
+from zentral.core.probes.conf import all_probes, all_probes_dict, all_probes_matcher, ProbeList, ProbeMatcher
 from zentral.core.probes.models import ProbeSource
 
 
@@ -27,3 +29,88 @@ class ProbesConfTestCase(TestCase):
         self.assertEqual(all_probes_dict[self.probe.pk], self.probe)
         with self.assertRaises(KeyError):
             all_probes_dict[self.inactive_probe.pk]
+
+
+class ProbeMatcherTestCase(TestCase):
+    @staticmethod
+    def build_probe(body):
+        return ProbeSource.objects.create(model="BaseProbe",
+                                          name=get_random_string(12),
+                                          status=ProbeSource.ACTIVE,
+                                          body=body).load()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.login_probe = cls.build_probe({"filters": {"metadata": [{"event_types": ["zentral_login"]}]}})
+        cls.zentral_tag_probe = cls.build_probe({"filters": {"metadata": [{"event_tags": ["zentral"]}]}})
+        cls.logout_or_tag_probe = cls.build_probe(
+            {"filters": {"metadata": [{"event_types": ["zentral_logout"]},
+                                      {"event_tags": ["yolo"]}]}}
+        )
+        cls.login_and_tag_probe = cls.build_probe(
+            {"filters": {"metadata": [{"event_types": ["zentral_login"], "event_tags": ["fomo"]}]}}
+        )
+        cls.payload_probe = cls.build_probe(
+            {"filters": {"payload": [[{"attribute": "user.username",
+                                       "operator": "IN",
+                                       "values": ["godzilla"]}]]}}
+        )
+        cls.all_events_probe = cls.build_probe({})
+        cls.invalid_probe = cls.build_probe({"filters": {"metadata": "yolo"}})
+        cls.probes = [
+            cls.login_probe,
+            cls.zentral_tag_probe,
+            cls.logout_or_tag_probe,
+            cls.login_and_tag_probe,
+            cls.payload_probe,
+            cls.all_events_probe,
+            cls.invalid_probe,
+        ]
+
+    def test_invalid_probe_not_indexed(self):
+        self.assertFalse(self.invalid_probe.loaded)
+        matcher = ProbeMatcher(self.probes)
+        self.assertEqual(len(matcher), 6)
+        self.assertNotIn(self.invalid_probe, list(matcher))
+
+    def test_login_event(self):
+        matcher = ProbeMatcher(self.probes)
+        event = LoginEvent(EventMetadata(), {"user": {"username": "godzilla"}})
+        self.assertEqual(
+            list(matcher.event_filtered(event)),
+            [self.login_probe, self.zentral_tag_probe, self.payload_probe, self.all_events_probe]
+        )
+
+    def test_logout_event(self):
+        matcher = ProbeMatcher(self.probes)
+        event = LogoutEvent(EventMetadata(), {"user": {"username": "mothra"}})
+        self.assertEqual(
+            list(matcher.event_filtered(event)),
+            [self.zentral_tag_probe, self.logout_or_tag_probe, self.all_events_probe]
+        )
+
+    def test_event_metadata_tags(self):
+        matcher = ProbeMatcher(self.probes)
+        event = LoginEvent(EventMetadata(tags=["fomo", "yolo"]), {"user": {"username": "mothra"}})
+        self.assertEqual(
+            list(matcher.event_filtered(event)),
+            [self.login_probe, self.zentral_tag_probe, self.logout_or_tag_probe,
+             self.login_and_tag_probe, self.all_events_probe]
+        )
+
+    def test_same_results_as_probe_list(self):
+        matcher = ProbeMatcher(self.probes)
+        probe_list = ProbeList(self.probes)
+        for event in (LoginEvent(EventMetadata(), {"user": {"username": "godzilla"}}),
+                      LoginEvent(EventMetadata(tags=["fomo"]), {"user": {"username": "mothra"}}),
+                      LogoutEvent(EventMetadata(tags=["yolo"]), {"user": {"username": "godzilla"}})):
+            self.assertEqual(list(matcher.event_filtered(event)), list(probe_list.event_filtered(event)))
+
+    def test_all_probes_matcher_cleared(self):
+        event = LoginEvent(EventMetadata(), {"user": {"username": "godzilla"}})
+        all_probes.clear()
+        self.assertEqual(
+            list(all_probes_matcher.event_filtered(event)),
+            [p for p in all_probes if p.test_event(event)]
+        )
+        self.assertIn(self.login_probe, list(all_probes_matcher.event_filtered(event)))
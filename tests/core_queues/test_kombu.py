@@ -0,0 +1,627 @@
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import uuid
+from unittest.mock import call, patch, Mock, PropertyMock
+from amqp.exceptions import MessageNacked
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase
+from django.utils.crypto import get_random_string
+from kombu import Connection
+from zentral.core.events.base import BaseEvent, EventMetadata
+from zentral.core.queues.backends.kombu import (BulkStoreWorker, EnrichWorker, EventQueues, PipelineWorker,
+                                                PreprocessWorker, ProcessWorker, PublisherConfirms, StoreWorker,
+                                                enrich_events_queue, enriched_events_exchange, events_exchange,
+                                                retry_events_exchange)
+from zentral.core.queues.exceptions import RetryLater
+from zentral.core.stores.backends.base import BaseEventStore
+
+
+class BulkTestEventStore(BaseEventStore):
+    max_batch_size = 10
+
+    def __init__(self, config_d):
+        super().__init__(config_d)
+        self.bulk_store = Mock()
+
+
+class KombuBulkStoreWorkerTestCase(SimpleTestCase):
+    @staticmethod
+    def build_store(**cfg):
+        cfg.setdefault("store_name", get_random_string(12))
+        return BulkTestEventStore(cfg)
+
+    @staticmethod
+    def build_event_d(event_type="zentral_login"):
+        return {"_zentral": {"id": str(uuid.uuid4()), "index": 0, "type": event_type}}
+
+    def build_worker(self, **cfg):
+        worker = BulkStoreWorker(Mock(), self.build_store(**cfg))
+        worker.setup_metrics_exporter()
+        return worker
+
+    def test_get_store_worker(self):
+        event_queues = EventQueues({"backend_url": "memory://"})
+        self.assertIsInstance(event_queues.get_store_worker(self.build_store()), StoreWorker)
+        self.assertIsInstance(event_queues.get_store_worker(self.build_store(batch_size=5)), BulkStoreWorker)
+
+    def test_batch_not_full(self):
+        worker = self.build_worker(batch_size=2)
+        message = Mock()
+        worker.do_store_event(self.build_event_d(), message)
+        worker.event_store.bulk_store.assert_not_called()
+        message.ack.assert_not_called()
+        self.assertEqual(len(worker.batch), 1)
+
+    def test_skipped_event(self):
+        worker = self.build_worker(batch_size=2, excluded_event_filters=[{"event_type": ["zentral_logout"]}])
+        message = Mock()
+        worker.do_store_event(self.build_event_d("zentral_logout"), message)
+        message.ack.assert_called_once_with()
+        self.assertEqual(len(worker.batch), 0)
+
+    def test_full_batch_all_stored(self):
+        worker = self.build_worker(batch_size=2)
+
+        def bulk_store(events):
+            for event_d in events:
+                yield event_d["_zentral"]["id"], event_d["_zentral"]["index"]
+
+        worker.event_store.bulk_store.side_effect = bulk_store
+        messages = [Mock(), Mock()]
+        for message in messages:
+            worker.do_store_event(self.build_event_d(), message)
+        worker.event_store.bulk_store.assert_called_once()
+        for message in messages:
+            message.ack.assert_called_once_with()
+            message.reject.assert_not_called()
+        self.assertEqual(len(worker.batch), 0)
+        self.assertIsNone(worker.batch_start_ts)
+
+    @patch("zentral.core.queues.backends.kombu.save_dead_letter")
+    def test_full_batch_partially_stored(self, save_dead_letter):
+        worker = self.build_worker(batch_size=2)
+        event_d1 = self.build_event_d()
+        event_d2 = self.build_event_d()
+
+        def bulk_store(events):
+            list(events)
+            yield event_d2["_zentral"]["id"], event_d2["_zentral"]["index"]
+
+        worker.event_store.bulk_store.side_effect = bulk_store
+        message1 = Mock()
+        message2 = Mock()
+        worker.do_store_event(event_d1, message1)
+        worker.do_store_event(event_d2, message2)
+        message1.ack.assert_not_called()
+        message1.reject.assert_called_once_with()
+        message2.ack.assert_called_once_with()
+        message2.reject.assert_not_called()
+        save_dead_letter.assert_called_once_with(event_d1, f"event store {worker.event_store.name} error")
+
+    @patch("zentral.core.queues.backends.kombu.save_dead_letter")
+    def test_full_batch_store_error(self, save_dead_letter):
+        worker = self.build_worker(batch_size=2)
+        event_d1 = self.build_event_d()
+        event_d2 = self.build_event_d()
+
+        def bulk_store(events):
+            next(events)
+            raise ValueError("yolo")
+            yield
+
+        worker.event_store.bulk_store.side_effect = bulk_store
+        message1 = Mock()
+        message2 = Mock()
+        worker.do_store_event(event_d1, message1)
+        worker.do_store_event(event_d2, message2)
+        for message in (message1, message2):
+            message.ack.assert_not_called()
+            message.reject.assert_called_once_with()
+        save_dead_letter.assert_has_calls(
+            [call(event_d1, f"event store {worker.event_store.name} error"),
+             call(event_d2, f"event store {worker.event_store.name} error")],
+            any_order=True
+        )
+        self.assertEqual(len(worker.batch), 0)
+
+    @patch("zentral.core.queues.backends.kombu.time.monotonic")
+    def test_max_event_age(self, monotonic):
+        monotonic.return_value = 100
+        worker = self.build_worker(batch_size=5)
+        worker.event_store.bulk_store.side_effect = lambda events: (
+            (e["_zentral"]["id"], e["_zentral"]["index"]) for e in events
+        )
+        message = Mock()
+        worker.do_store_event(self.build_event_d(), message)
+        worker.on_iteration()
+        worker.event_store.bulk_store.assert_not_called()
+        monotonic.return_value = 100 + worker.max_event_age_seconds + 1
+        worker.on_iteration()
+        worker.event_store.bulk_store.assert_called_once()
+        message.ack.assert_called_once_with()
+
+    def test_flush_on_consume_end(self):
+        worker = self.build_worker(batch_size=5)
+        worker.event_store.bulk_store.side_effect = lambda events: (
+            (e["_zentral"]["id"], e["_zentral"]["index"]) for e in events
+        )
+        message = Mock()
+        worker.do_store_event(self.build_event_d(), message)
+        worker.on_consume_end(Mock(), Mock())
+        message.ack.assert_called_once_with()
+
+    def test_drop_batch_on_connection_revived(self):
+        worker = self.build_worker(batch_size=5)
+        message = Mock()
+        worker.do_store_event(self.build_event_d(), message)
+        worker.on_connection_revived()
+        self.assertEqual(len(worker.batch), 0)
+        self.assertIsNone(worker.batch_start_ts)
+        worker.event_store.bulk_store.assert_not_called()
+        message.ack.assert_not_called()
+        message.reject.assert_not_called()
+
+
+class KombuEventPostingTestCase(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.event_queues = EventQueues({"backend_url": "memory://"})
+        self.consumer_connection = Connection("memory://")
+        self.queue = enrich_events_queue(self.consumer_connection.default_channel)
+        self.queue.declare()
+        self.queue.purge()
+
+    def tearDown(self):
+        self.consumer_connection.release()
+        super().tearDown()
+
+    @staticmethod
+    def build_event(index=0):
+        return BaseEvent(EventMetadata(index=index), {"index": index})
+
+    def get_posted_events(self):
+        posted_events = []
+        while True:
+            message = self.queue.get(no_ack=True)
+            if message is None:
+                break
+            posted_events.append(message.decode())
+        return posted_events
+
+    def test_post_event(self):
+        event = self.build_event()
+        self.event_queues.post_event(event)
+        self.assertEqual(self.get_posted_events(), [event.serialize(machine_metadata=False)])
+
+    def test_post_events(self):
+        events = [self.build_event(i) for i in range(3)]
+        self.event_queues.post_events(iter(events))
+        self.assertEqual(self.get_posted_events(), [e.serialize(machine_metadata=False) for e in events])
+
+    def test_batch_posting(self):
+        events = [self.build_event(i) for i in range(4)]
+        with self.event_queues.batch_posting():
+            self.event_queues.post_event(events[0])
+            with self.event_queues.batch_posting():
+                self.event_queues.post_events(events[1:3])
+            # nested batch, not published yet
+            self.assertEqual(self.get_posted_events(), [])
+            self.event_queues.post_event(events[3])
+        self.assertEqual(self.get_posted_events(), [e.serialize(machine_metadata=False) for e in events])
+
+    def test_batch_posting_exception(self):
+        event = self.build_event()
+        with self.assertRaises(ValueError):
+            with self.event_queues.batch_posting():
+                self.event_queues.post_event(event)
+                raise ValueError("yolo")
+        # events posted before the exception are published
+        self.assertEqual(self.get_posted_events(), [event.serialize(machine_metadata=False)])
+        # batch reset
+        self.event_queues.post_event(event)
+        self.assertEqual(self.get_posted_events(), [event.serialize(machine_metadata=False)])
+
+
+class KombuPublisherConfirmsTestCase(SimpleTestCase):
+    @staticmethod
+    def build_confirms(published_count):
+        channel = Mock()
+        channel.events = defaultdict(set)
+        confirms = PublisherConfirms(channel)
+        channel.confirm_select.assert_called_once_with()
+        for _ in range(published_count):
+            confirms.add_published_message()
+        return confirms
+
+    @staticmethod
+    def build_connection(confirms, *methods):
+        # each drain_events call delivers one ack or nack
+        connection = Mock()
+        methods = list(methods)
+
+        def drain_events(timeout):
+            event, delivery_tag, multiple = methods.pop(0)
+            for callback in confirms.channel.events[event]:
+                callback(delivery_tag, multiple)
+
+        connection.drain_events.side_effect = drain_events
+        return connection
+
+    def test_all_acked(self):
+        confirms = self.build_confirms(4)
+        connection = self.build_connection(
+            confirms,
+            ("basic_ack", 1, False),
+            ("basic_ack", 3, True),
+            ("basic_ack", 4, False),
+        )
+        confirms.wait(connection, 10)
+        self.assertEqual(connection.drain_events.call_count, 3)
+        self.assertEqual(confirms.unconfirmed_tags, set())
+
+    def test_nacked(self):
+        confirms = self.build_confirms(3)
+        connection = self.build_connection(
+            confirms,
+            ("basic_nack", 2, True),
+            ("basic_ack", 3, False),
+        )
+        with self.assertRaises(MessageNacked) as cm:
+            confirms.wait(connection, 10)
+        self.assertEqual(cm.exception.args[0], "2/3 message(s) nacked")
+
+    def test_nothing_published(self):
+        confirms = self.build_confirms(0)
+        connection = Mock()
+        confirms.wait(connection, 10)
+        connection.drain_events.assert_not_called()
+
+
+class KombuPipelineWorkerTestCase(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        producer_patcher = patch.object(PipelineWorker, "producer", new_callable=PropertyMock)
+        self.producer = producer_patcher.start().return_value
+        self.addCleanup(producer_patcher.stop)
+
+    @staticmethod
+    def build_event_d(index=0):
+        return BaseEvent(EventMetadata(index=index), {"index": index}).serialize(machine_metadata=False)
+
+    @staticmethod
+    def build_message(routing_key=None, retries=None):
+        message = Mock()
+        message.delivery_info = {"routing_key": routing_key}
+        message.headers = {"x-zentral-retries": retries} if retries else {}
+        return message
+
+    @staticmethod
+    def build_enrich_worker(enrich_event, enrich_events=None, **worker_config):
+        worker = EnrichWorker(Mock(), enrich_event, worker_config, enrich_events)
+        worker.setup_metrics_exporter()
+        return worker
+
+    @staticmethod
+    def batch_enrich_events(batches):
+        def enrich_events(event_ds):
+            batches.append(event_ds)
+            return [[BaseEvent.deserialize(event_d)] for event_d in event_ds]
+        return enrich_events
+
+    # configuration
+
+    def test_default_worker_config(self):
+        event_queues = EventQueues({"backend_url": "memory://"})
+        worker = event_queues.get_enrich_worker(Mock())
+        self.assertEqual(worker.concurrency, 1)
+        self.assertEqual(worker.retry_delay, 10)
+        self.assertEqual(worker.max_retries, 100)
+        self.assertEqual(worker.batch_size, 1)
+        self.assertIsNone(worker.prefetch_count)
+
+    def test_worker_config(self):
+        event_queues = EventQueues({"backend_url": "memory://",
+                                    "workers": {"preprocess": {"prefetch_count": 50},
+                                                "process": {"concurrency": 4, "retry_delay": 60},
+                                                "store": {"prefetch_count": 2}}})
+        with patch.object(PreprocessWorker, "_get_preprocessors", return_value=[]):
+            preprocess_worker = event_queues.get_preprocess_worker()
+        self.assertEqual(preprocess_worker.concurrency, 1)
+        self.assertEqual(preprocess_worker.prefetch_count, 50)
+        process_worker = event_queues.get_process_worker(Mock())
+        self.assertEqual(process_worker.concurrency, 4)
+        self.assertEqual(process_worker.retry_delay, 60)
+        # default prefetch count to keep the thread pool busy
+        self.assertEqual(process_worker.prefetch_count, 8)
+        store = BulkTestEventStore({"store_name": get_random_string(12)})
+        self.assertEqual(event_queues.get_store_worker(store).prefetch_count, 2)
+        # the bulk store worker must be able to get a full batch
+        store = BulkTestEventStore({"store_name": get_random_string(12), "batch_size": 5})
+        self.assertEqual(event_queues.get_store_worker(store).prefetch_count, 5)
+
+    def test_worker_config_bounds(self):
+        worker = self.build_enrich_worker(Mock(), concurrency=1000, retry_delay=0, prefetch_count=1, max_retries=0)
+        self.assertEqual(worker.concurrency, 100)
+        self.assertEqual(worker.retry_delay, 1)
+        self.assertEqual(worker.max_retries, 1)
+        # at least one message per thread
+        self.assertEqual(worker.prefetch_count, 100)
+
+    def test_enrich_worker_batch_size_config(self):
+        worker = self.build_enrich_worker(Mock(), Mock(), batch_size=50)
+        self.assertEqual(worker.batch_size, 50)
+        # the broker must be able to deliver a full batch
+        self.assertEqual(worker.prefetch_count, 50)
+        worker = self.build_enrich_worker(Mock(), Mock(), batch_size=5000, concurrency=2)
+        self.assertEqual(worker.batch_size, 1000)
+        self.assertEqual(worker.prefetch_count, 4000)
+        # no batches without the batch function
+        self.assertEqual(self.build_enrich_worker(Mock(), batch_size=50).batch_size, 1)
+        # no batches for the other workers
+        self.assertEqual(ProcessWorker(Mock(), Mock(), {"batch_size": 50}).batch_size, 1)
+
+    def test_worker_config_error(self):
+        with self.assertRaises(ImproperlyConfigured) as cm:
+            self.build_enrich_worker(Mock(), prefetch_count="yolo")
+        self.assertEqual(cm.exception.args[0], "enrich worker prefetch_count must be an integer")
+
+    # sequential consumption
+
+    def test_enrich_event(self):
+        event_d = self.build_event_d()
+        enrich_event = Mock(return_value=[BaseEvent.deserialize(event_d)])
+        worker = self.build_enrich_worker(enrich_event)
+        message = self.build_message()
+        worker.on_message(event_d, message)
+        enrich_event.assert_called_once_with(event_d)
+        self.producer.publish.assert_called_once()
+        self.assertEqual(self.producer.publish.call_args.kwargs["exchange"], enriched_events_exchange)
+        message.ack.assert_called_once_with()
+
+    @patch("zentral.core.queues.backends.kombu.logger.error")
+    def test_enrich_event_retry(self, logger_error):
+        event_d = self.build_event_d()
+        worker = self.build_enrich_worker(Mock(side_effect=ValueError("yolo")), retry_delay=30)
+        message = self.build_message(retries=2)
+        worker.on_message(event_d, message)
+        self.producer.publish.assert_called_once()
+        args, kwargs = self.producer.publish.call_args
+        self.assertEqual(args, (event_d,))
+        self.assertEqual(kwargs["exchange"], retry_events_exchange)
+        self.assertEqual(kwargs["routing_key"], "enrich_events_retry_30s")
+        self.assertEqual(kwargs["headers"], {"x-zentral-retries": 3})
+        retry_queue = kwargs["declare"][0]
+        self.assertEqual(retry_queue.name, "enrich_events_retry_30s")
+        self.assertEqual(retry_queue.queue_arguments,
+                         {"x-message-ttl": 30000,
+                          "x-dead-letter-exchange": "",
+                          "x-dead-letter-routing-key": "enrich_events"})
+        # no blocking requeue
+        message.ack.assert_called_once_with()
+        message.requeue.assert_not_called()
+        self.assertEqual(logger_error.call_args.args[1:], ("enrich_events", 3, 30))
+
+    @patch("zentral.core.queues.backends.kombu.save_dead_letter")
+    @patch("zentral.core.queues.backends.kombu.logger.error")
+    def test_enrich_event_max_retries(self, logger_error, save_dead_letter):
+        event_d = self.build_event_d()
+        worker = self.build_enrich_worker(Mock(side_effect=ValueError("yolo")), max_retries=3)
+        message = self.build_message(retries=3)
+        worker.on_message(event_d, message)
+        self.producer.publish.assert_not_called()
+        save_dead_letter.assert_called_once_with(event_d, "enrich worker error")
+        message.reject.assert_called_once_with()
+        message.ack.assert_not_called()
+        self.assertEqual(logger_error.call_args.args[1:], ("enrich_events",))
+
+    @patch("zentral.core.queues.backends.kombu.logger.error")
+    def test_preprocess_retry_later(self, logger_error):
+        preprocessor = Mock(routing_key="yolo")
+        preprocessor.process_raw_event.side_effect = RetryLater
+        with patch.object(PreprocessWorker, "_get_preprocessors", return_value=[preprocessor]):
+            worker = PreprocessWorker(Mock())
+        worker.setup_metrics_exporter()
+        message = self.build_message(routing_key="yolo")
+        worker.on_message({"un": 1}, message)
+        kwargs = self.producer.publish.call_args.kwargs
+        self.assertEqual(kwargs["routing_key"], "yolo_retry_10s")
+        self.assertEqual(kwargs["headers"], {"x-zentral-retries": 1})
+        message.ack.assert_called_once_with()
+        self.assertIsNone(logger_error.call_args.kwargs["exc_info"])
+
+    def test_preprocess_raw_event(self):
+        event = BaseEvent.deserialize(self.build_event_d())
+        preprocessor = Mock(routing_key="yolo")
+        preprocessor.process_raw_event.return_value = [event]
+        with patch.object(PreprocessWorker, "_get_preprocessors", return_value=[preprocessor]):
+            worker = PreprocessWorker(Mock())
+        worker.setup_metrics_exporter()
+        message = self.build_message(routing_key="yolo")
+        worker.on_message({"un": 1}, message)
+        self.producer.publish.assert_called_once_with(event.serialize(machine_metadata=False),
+                                                      serializer="json",
+                                                      exchange=events_exchange,
+                                                      declare=[events_exchange])
+        message.ack.assert_called_once_with()
+
+    def test_process_event(self):
+        event_d = self.build_event_d()
+        process_event = Mock()
+        worker = ProcessWorker(Mock(), process_event)
+        worker.setup_metrics_exporter()
+        message = self.build_message()
+        worker.on_message(event_d, message)
+        process_event.assert_called_once_with(event_d)
+        self.producer.publish.assert_not_called()
+        message.ack.assert_called_once_with()
+
+    def test_process_worker_stop_process_event(self):
+        stop_process_event = Mock()
+        event_queues = EventQueues({"backend_url": "memory://"})
+        worker = event_queues.get_process_worker(Mock(), stop_process_event)
+        with patch("kombu.mixins.ConsumerMixin.run", side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                worker.run()
+        stop_process_event.assert_called_once_with()
+
+    # batch consumption
+
+    def test_enrich_events_batch(self):
+        batches = []
+        worker = self.build_enrich_worker(Mock(), self.batch_enrich_events(batches), batch_size=3)
+        event_ds = [self.build_event_d(i) for i in range(4)]
+        messages = [self.build_message() for _ in range(4)]
+        for event_d, message in zip(event_ds, messages):
+            worker.on_message(event_d, message)
+        self.assertEqual(batches, [event_ds[:3]])
+        self.assertEqual(self.producer.publish.call_count, 3)
+        for message in messages[:3]:
+            message.ack.assert_called_once_with()
+        messages[3].ack.assert_not_called()
+        self.assertEqual(len(worker.batch), 1)
+
+    @patch("zentral.core.queues.backends.kombu.time.monotonic")
+    def test_enrich_events_batch_max_age(self, monotonic):
+        monotonic.return_value = 100
+        batches = []
+        enrich_event = Mock(side_effect=lambda event_d: [BaseEvent.deserialize(event_d)])
+        worker = self.build_enrich_worker(enrich_event, self.batch_enrich_events(batches), batch_size=3)
+        event_d = self.build_event_d()
+        message = self.build_message()
+        worker.on_message(event_d, message)
+        worker.on_iteration()
+        message.ack.assert_not_called()
+        monotonic.return_value = 100 + worker.max_batch_age_seconds + 1
+        worker.on_iteration()
+        # a batch of one is handled with the single event function
+        self.assertEqual(batches, [])
+        worker.enrich_event.assert_called_once_with(event_d)
+        message.ack.assert_called_once_with()
+
+    @patch("zentral.core.queues.backends.kombu.logger.error")
+    @patch("zentral.core.queues.backends.kombu.logger.exception")
+    def test_enrich_events_batch_error(self, logger_exception, logger_error):
+        event_ds = [self.build_event_d(i) for i in range(2)]
+
+        def enrich_event(event_d):
+            if event_d["_zentral"]["index"] == 1:
+                raise ValueError("yolo")
+            return [BaseEvent.deserialize(event_d)]
+
+        worker = self.build_enrich_worker(enrich_event, Mock(side_effect=ValueError("yolo")), batch_size=2)
+        messages = [self.build_message() for _ in range(2)]
+        for event_d, message in zip(event_ds, messages):
+            worker.on_message(event_d, message)
+        logger_exception.assert_called_once_with(
+            "%s - could not handle batch of %s messages. Handle them one by one.", "enrich worker", 2
+        )
+        # the messages are handled one by one, only the failing one is retried
+        self.assertEqual(self.producer.publish.call_count, 2)
+        self.assertEqual(self.producer.publish.call_args_list[0].kwargs["exchange"], enriched_events_exchange)
+        self.assertEqual(self.producer.publish.call_args_list[1].kwargs["exchange"], retry_events_exchange)
+        for message in messages:
+            message.ack.assert_called_once_with()
+
+    def test_enrich_events_batch_flush_on_consume_end(self):
+        batches = []
+        worker = self.build_enrich_worker(Mock(), self.batch_enrich_events(batches), batch_size=3)
+        messages = [self.build_message() for _ in range(2)]
+        for i, message in enumerate(messages):
+            worker.on_message(self.build_event_d(i), message)
+        worker.on_consume_end(Mock(), Mock())
+        self.assertEqual(len(batches), 1)
+        for message in messages:
+            message.ack.assert_called_once_with()
+
+    def test_enrich_events_batch_dropped_on_connection_revived(self):
+        worker = self.build_enrich_worker(Mock(), Mock(), batch_size=3)
+        message = self.build_message()
+        worker.on_message(self.build_event_d(), message)
+        worker.on_connection_revived()
+        self.assertEqual(worker.batch, [])
+        worker.on_consume_end(Mock(), Mock())
+        worker.enrich_events.assert_not_called()
+        message.ack.assert_not_called()
+
+    def test_concurrent_enrich_events_batches(self):
+        batches = []
+        worker = self.build_enrich_worker(Mock(), self.batch_enrich_events(batches), batch_size=2, concurrency=2)
+        worker.executor = ThreadPoolExecutor(max_workers=worker.concurrency)
+        messages = [self.build_message() for _ in range(4)]
+        for i, message in enumerate(messages):
+            worker.on_message(self.build_event_d(i), message)
+        worker.executor.shutdown(wait=True)
+        worker.on_iteration()
+        self.assertEqual(len(batches), 2)
+        self.assertEqual(self.producer.publish.call_count, 4)
+        for message in messages:
+            message.ack.assert_called_once_with()
+
+    # concurrent consumption
+
+    def test_concurrent_enrich_events(self):
+        release = threading.Event()
+        handling_threads = set()
+
+        def enrich_event(event_d):
+            handling_threads.add(threading.current_thread())
+            release.wait()
+            yield BaseEvent.deserialize(event_d)
+
+        worker = self.build_enrich_worker(enrich_event, concurrency=3)
+        worker.executor = ThreadPoolExecutor(max_workers=worker.concurrency)
+        messages = [self.build_message() for _ in range(3)]
+        for i, message in enumerate(messages):
+            worker.on_message(self.build_event_d(i), message)
+        # the messages are handled in the thread pool
+        for message in messages:
+            message.ack.assert_not_called()
+        release.set()
+        worker.executor.shutdown(wait=True)
+        # the results are finalized in the consumer thread
+        self.producer.publish.assert_not_called()
+        worker.on_iteration()
+        self.assertEqual(self.producer.publish.call_count, 3)
+        for message in messages:
+            message.ack.assert_called_once_with()
+        self.assertNotIn(threading.current_thread(), handling_threads)
+
+    @patch("zentral.core.queues.backends.kombu.close_old_connections")
+    def test_concurrent_close_old_connections(self, close_old_connections):
+        worker = self.build_enrich_worker(lambda event_d: [BaseEvent.deserialize(event_d)], concurrency=2)
+        worker.executor = ThreadPoolExecutor(max_workers=worker.concurrency)
+        worker.on_message(self.build_event_d(), self.build_message())
+        worker.executor.shutdown(wait=True)
+        # before and after the handling of the batch in the pool thread
+        self.assertEqual(close_old_connections.call_count, 2)
+
+    def test_concurrent_results_dropped_after_reconnection(self):
+        release = threading.Event()
+
+        def enrich_event(event_d):
+            release.wait()
+            yield BaseEvent.deserialize(event_d)
+
+        worker = self.build_enrich_worker(enrich_event, concurrency=2)
+        worker.executor = ThreadPoolExecutor(max_workers=worker.concurrency)
+        message = self.build_message()
+        worker.on_message(self.build_event_d(), message)
+        worker.on_connection_revived()
+        release.set()
+        worker.executor.shutdown(wait=True)
+        worker.on_iteration()
+        # the delivery tag is bound to the previous channel, the message will be redelivered
+        self.producer.publish.assert_not_called()
+        message.ack.assert_not_called()
+        self.assertTrue(worker.handled_messages.empty())
+
+    def test_concurrent_flush_on_consume_end(self):
+        worker = self.build_enrich_worker(lambda event_d: [BaseEvent.deserialize(event_d)], concurrency=2)
+        worker.executor = ThreadPoolExecutor(max_workers=worker.concurrency)
+        message = self.build_message()
+        worker.on_message(self.build_event_d(), message)
+        worker.on_consume_end(Mock(), Mock())
+        self.assertIsNone(worker.executor)
+        self.producer.publish.assert_called_once()
+        message.ack.assert_called_once_with()
@@ -1,4 +1,6 @@
-from unittest.mock import Mock
+import json
+from unittest.mock import Mock, patch
+import zlib
 from django.test import SimpleTestCase
 from django.utils.crypto import get_random_string
 from accounts.events import EventMetadata, LoginEvent
@@ -67,3 +69,85 @@ class DatadogStoreTestCase(SimpleTestCase):
         store.store(event)
         mock_post.assert_called_once()
         mock_response.raise_for_status.assert_called_once()
+
+    # bulk
+
+    @staticmethod
+    def build_response(ok=True, status_code=202):
+        response = Mock()
+        response.ok = ok
+        response.status_code = status_code
+        if not ok:
+            response.raise_for_status.side_effect = ValueError(status_code)
+        return response
+
+    @staticmethod
+    def get_posted_entries(mock_post):
+        return [json.loads(zlib.decompress(c.kwargs["data"])) for c in mock_post.call_args_list]
+
+    @staticmethod
+    def event_key(event):
+        return str(event.metadata.uuid), event.metadata.index
+
+    def test_bulk_store_not_available(self):
+        store = self.get_store()
+        with self.assertRaises(RuntimeError) as cm:
+            list(store.bulk_store([self.build_login_event()]))
+        self.assertEqual(cm.exception.args[0], "bulk_store is not available when batch_size < 2")
+
+    def test_bulk_store_noop(self):
+        store = self.get_store(batch_size=10)
+        store._session.post = Mock()
+        self.assertEqual(list(store.bulk_store([])), [])
+        store._session.post.assert_not_called()
+
+    def test_bulk_store(self):
+        store = self.get_store(batch_size=10)
+        store._session.post = Mock(return_value=self.build_response())
+        events = [self.build_login_event() for _ in range(3)]
+        serialized_events = [e.serialize() for e in events]
+        self.assertEqual(list(store.bulk_store(serialized_events)), [self.event_key(e) for e in events])
+        store._session.post.assert_called_once()
+        self.assertEqual(store._session.post.call_args.kwargs["headers"], {"Content-Encoding": "deflate"})
+        self.assertEqual(self.get_posted_entries(store._session.post),
+                         [[store._serialize_event(e) for e in events]])
+        # the serialized events are not modified
+        self.assertEqual(serialized_events, [e.serialize() for e in events])
+
+    def test_bulk_store_intake_limits(self):
+        store = self.get_store(batch_size=10)
+        store.max_batch_size = 3
+        store.max_payload_bytes = 1200
+        store._session.post = Mock(return_value=self.build_response())
+        events = [self.build_login_event(get_random_string(200)) for _ in range(7)]
+        self.assertEqual(list(store.bulk_store(events)), [self.event_key(e) for e in events])
+        # ~ 500 bytes per entry → 2 entries per payload max
+        self.assertEqual([len(entries) for entries in self.get_posted_entries(store._session.post)],
+                         [2, 2, 2, 1])
+        store.max_payload_bytes = 5 * 2**20
+        store._session.post.reset_mock()
+        self.assertEqual(len(list(store.bulk_store(events))), 7)
+        self.assertEqual([len(entries) for entries in self.get_posted_entries(store._session.post)],
+                         [3, 3, 1])
+
+    @patch("zentral.core.stores.backends.datadog.logger.exception")
+    def test_bulk_store_partial_failure(self, logger_exception):
+        store = self.get_store(batch_size=10)
+        store.max_batch_size = 2
+        store._session.post = Mock(side_effect=[self.build_response(),
+                                                self.build_response(ok=False, status_code=400),
+                                                self.build_response()])
+        events = [self.build_login_event() for _ in range(5)]
+        self.assertEqual(list(store.bulk_store(events)),
+                         [self.event_key(e) for e in events[:2] + events[4:]])
+        logger_exception.assert_called_once_with("Could not store %s event(s)", 2)
+
+    @patch("zentral.core.stores.backends.datadog.time.sleep")
+    def test_bulk_store_retry(self, sleep):
+        store = self.get_store(batch_size=10)
+        store._session.post = Mock(side_effect=[self.build_response(ok=False, status_code=429),
+                                                self.build_response()])
+        event = self.build_login_event()
+        self.assertEqual(list(store.bulk_store([event])), [self.event_key(event)])
+        self.assertEqual(store._session.post.call_count, 2)
+        sleep.assert_called_once()
@@ -0,0 +1,143 @@
+import json
+from unittest.mock import Mock, patch
+from django.test import SimpleTestCase
+from django.utils.crypto import get_random_string
+from elasticsearch import Elasticsearch
+from accounts.events import EventMetadata, LoginEvent
+from zentral.conf.config import ConfigDict
+from zentral.core.exceptions import ImproperlyConfigured
+from zentral.core.stores.backends.elasticsearch import EventStore
+
+
+class TestElasticsearchStoreBulk(SimpleTestCase):
+    @staticmethod
+    def build_login_event():
+        return LoginEvent(EventMetadata(), {"user": {"username": get_random_string(12)}})
+
+    @staticmethod
+    def build_store(version=(8, 3, 2), use_mapping_types=False, **config):
+        config.setdefault("batch_size", 100)
+        store = EventStore(ConfigDict({
+            'servers': ["http://elastic:9200"],
+            'index': 'zentral-events',
+            'store_name': 'yolo',
+            **config
+        }))
+        store.version = list(version)
+        store.use_mapping_types = use_mapping_types
+        store.configured = True
+        return store
+
+    @staticmethod
+    def event_key(event):
+        return str(event.metadata.uuid), event.metadata.index
+
+    @staticmethod
+    def bulk_side_effect(requests, *statuses):
+        # one call per status list, one status per item
+        statuses = list(statuses)
+
+        def bulk(*args, **kwargs):
+            lines = [json.loads(line) for line in kwargs["operations"]]
+            requests.append(lines)
+            items = []
+            item_statuses = statuses.pop(0)
+            for action, status in zip(lines[::2], item_statuses):
+                item = {"_id": action["index"]["_id"], "status": status}
+                if status >= 300:
+                    item["error"] = {"type": "yolo_exception", "reason": "yolo"}
+                items.append({"index": item})
+            response = Mock()
+            response.body = {"errors": any(s >= 300 for s in item_statuses), "items": items}
+            return response
+
+        return bulk
+
+    # conf
+
+    def test_default_max_batch_bytes(self):
+        self.assertEqual(self.build_store().max_batch_bytes, 10 * 2**20)
+
+    def test_max_batch_bytes_bounds(self):
+        self.assertEqual(self.build_store(max_batch_bytes=1).max_batch_bytes, 1024)
+        self.assertEqual(self.build_store(max_batch_bytes=2**30).max_batch_bytes, 100 * 2**20)
+
+    def test_max_batch_bytes_error(self):
+        with self.assertRaises(ImproperlyConfigured) as cm:
+            self.build_store(max_batch_bytes="yolo")
+        self.assertEqual(cm.exception.args[0], "max_batch_bytes must be an integer")
+
+    def test_opensearch_version(self):
+        store = self.build_store()
+        self.assertEqual(store._get_version({"version": {"number": "6.8.23"}}), [6, 8, 23])
+        self.assertEqual(store._get_version({"version": {"number": "2.11.0", "distribution": "opensearch"}}),
+                         [7, 10, 2])
+
+    # bulk
+
+    @patch.object(Elasticsearch, "bulk")
+    def test_bulk_store(self, bulk):
+        requests = []
+        bulk.side_effect = self.bulk_side_effect(requests, [201, 201])
+        store = self.build_store()
+        events = [self.build_login_event() for _ in range(2)]
+        serialized_events = [e.serialize() for e in events]
+        self.assertEqual(list(store.bulk_store(serialized_events)), [self.event_key(e) for e in events])
+        self.assertEqual(len(requests), 1)
+        action, doc = requests[0][:2]
+        self.assertEqual(action, {"index": {"_index": "zentral-events",
+                                            "_id": f"{events[0].metadata.uuid}_0"}})
+        self.assertEqual(doc["type"], "zentral_login")
+        # the serialized events are not modified
+        self.assertEqual(serialized_events, [e.serialize() for e in events])
+
+    @patch.object(Elasticsearch, "bulk")
+    def test_bulk_store_legacy_doc_type(self, bulk):
+        requests = []
+        bulk.side_effect = self.bulk_side_effect(requests, [201])
+        store = self.build_store(version=(6, 8, 23))
+        event = self.build_login_event()
+        self.assertEqual(list(store.bulk_store([event])), [self.event_key(event)])
+        self.assertEqual(requests[0][0]["index"]["_type"], "doc")
+
+    @patch.object(Elasticsearch, "bulk")
+    def test_bulk_store_mapping_types(self, bulk):
+        requests = []
+        bulk.side_effect = self.bulk_side_effect(requests, [201])
+        store = self.build_store(version=(5, 6, 16), use_mapping_types=True)
+        event = self.build_login_event()
+        self.assertEqual(list(store.bulk_store([event])), [self.event_key(event)])
+        self.assertEqual(requests[0][0]["index"]["_type"], "zentral_login")
+
+    @patch.object(Elasticsearch, "bulk")
+    def test_bulk_store_max_batch_bytes(self, bulk):
+        requests = []
+        bulk.side_effect = self.bulk_side_effect(requests, [201, 201, 201], [201, 201])
+        store = self.build_store(max_batch_bytes=1024)
+        events = [self.build_login_event() for _ in range(5)]
+        self.assertEqual(list(store.bulk_store(events)), [self.event_key(e) for e in events])
+        # ~ 300 bytes per action + document
+        self.assertEqual([len(lines) // 2 for lines in requests], [3, 2])
+
+    @patch("zentral.core.stores.backends.es_os_base.logger.error")
+    @patch.object(Elasticsearch, "bulk")
+    def test_bulk_store_item_errors(self, bulk, logger_error):
+        requests = []
+        bulk.side_effect = self.bulk_side_effect(requests, [201, 400, 201])
+        store = self.build_store()
+        events = [self.build_login_event() for _ in range(3)]
+        self.assertEqual(list(store.bulk_store(events)), [self.event_key(events[0]), self.event_key(events[2])])
+        logger_error.assert_called_once_with("could not index event %s %s: %s %s %s",
+                                             str(events[1].metadata.uuid), 0, 400, "yolo_exception", "yolo")
+
+    @patch("elasticsearch.helpers.actions.time.sleep")
+    @patch.object(Elasticsearch, "bulk")
+    def test_bulk_store_429_retry(self, bulk, sleep):
+        requests = []
+        bulk.side_effect = self.bulk_side_effect(requests, [201, 429, 429], [429, 201], [201])
+        store = self.build_store()
+        events = [self.build_login_event() for _ in range(3)]
+        self.assertEqual(sorted(store.bulk_store(events)), sorted(self.event_key(e) for e in events))
+        # only the rejected documents are sent again, with a backoff
+        self.assertEqual([len(lines) // 2 for lines in requests], [3, 2, 1])
+        self.assertEqual([c.args[0] for c in sleep.call_args_list], [2, 4])
@@ -0,0 +1,178 @@
+from datetime import datetime
+from unittest.mock import patch
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+from elasticsearch import Elasticsearch
+from zentral.conf.config import ConfigDict
+from zentral.core.events import event_types
+from zentral.core.events.base import BaseEvent
+from zentral.core.stores.backends.elasticsearch import EventStore
+
+
+def build_heartbeat_event_types(count):
+    heartbeat_event_types = {}
+    for i in range(count):
+        event_type = f"zentral_test_heartbeat_{i:03d}"
+        heartbeat_event_types[event_type] = type(f"TestHeartbeat{i:03d}Event", (BaseEvent,),
+                                                 {"event_type": event_type, "tags": ["heartbeat"]})
+    return heartbeat_event_types
+
+
+HEARTBEAT_EVENT_TYPE = "zentral_test_heartbeat_000"
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class TestElasticsearchStoreHeartbeats(SimpleTestCase):
+    heartbeat_event_types = build_heartbeat_event_types(2)
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        event_types_patcher = patch.dict(event_types, self.heartbeat_event_types)
+        event_types_patcher.start()
+        self.addCleanup(event_types_patcher.stop)
+
+    @staticmethod
+    def build_store(version=(8, 3, 2)):
+        store = EventStore(ConfigDict({
+            'servers': ["http://elastic:9200"],
+            'index': 'zentral-events',
+            'store_name': 'yolo',
+        }))
+        store.version = list(version)
+        store.use_mapping_types = False
+        store.configured = True
+        return store
+
+    @staticmethod
+    def build_bucket(event_type, source=None, user_agent=None, created_at="2024-01-01T00:00:00"):
+        return {"key": {"event_type": event_type, "source": source, "user_agent": user_agent},
+                "doc_count": 1,
+                "max_created_at": {"value_as_string": created_at}}
+
+    @staticmethod
+    def search_side_effect(requests, buckets, page_size):
+        def search(*args, **kwargs):
+            requests.append(kwargs["body"])
+            composite = kwargs["body"]["aggs"]["heartbeats"]["composite"]
+            start = composite.get("after", {}).get("page", 0)
+            page = buckets[start * page_size:(start + 1) * page_size]
+            aggregation = {"buckets": page}
+            if page:
+                aggregation["after_key"] = {"page": start + 1}
+            return {"aggregations": {"heartbeats": aggregation}}
+        return search
+
+    @patch.object(Elasticsearch, "search")
+    def test_last_machine_heartbeats(self, search):
+        requests = []
+        search.side_effect = self.search_side_effect(requests, [
+            self.build_bucket("inventory_heartbeat", "munki", "Munki/5", "2024-01-02T00:00:00"),
+            self.build_bucket("inventory_heartbeat", "munki", "Munki/6", "2024-01-03T00:00:00"),
+            self.build_bucket("inventory_heartbeat", "osquery", None),
+            self.build_bucket("inventory_heartbeat", None, None),
+            self.build_bucket(HEARTBEAT_EVENT_TYPE, None, "agent/5.10.2", "2024-01-04T00:00:00"),
+            self.build_bucket(HEARTBEAT_EVENT_TYPE, None, "agent/5.11.0", "2024-01-05T00:00:00"),
+            self.build_bucket("zentral_yolo_unknown", None, "yolo"),
+        ], page_size=1000)
+        store = self.build_store()
+        with patch("zentral.core.stores.backends.es_os_base.logger.error") as logger_error:
+            heartbeats = store.get_last_machine_heartbeats("0123456789", datetime(2024, 1, 1))
+        logger_error.assert_called_once_with("Unknown event type %s", "zentral_yolo_unknown")
+        self.assertEqual(
+            heartbeats,
+            [(event_types["inventory_heartbeat"], "munki", [(None, datetime(2024, 1, 3))]),
+             (event_types["inventory_heartbeat"], "osquery", [(None, datetime(2024, 1, 1))]),
+             (event_types[HEARTBEAT_EVENT_TYPE], None, [("agent/5.10.2", datetime(2024, 1, 4)),
+                                                        ("agent/5.11.0", datetime(2024, 1, 5))])]
+        )
+        self.assertEqual(len(requests), 1)
+        sources = requests[0]["aggs"]["heartbeats"]["composite"]["sources"]
+        self.assertEqual(sources, [{"event_type": {"terms": {"field": "type"}}},
+                                   {"source": {"terms": {"field": "inventory.source.name", "missing_bucket": True}}},
+                                   {"user_agent": {"terms": {"field": "request.user_agent", "missing_bucket": True}}}])
+
+    @patch.object(Elasticsearch, "search")
+    def test_last_machine_heartbeats_event_type_without_user_agent(self, search):
+        search.side_effect = self.search_side_effect([], [self.build_bucket(HEARTBEAT_EVENT_TYPE)], page_size=1000)
+        self.assertEqual(self.build_store().get_last_machine_heartbeats("0123456789", datetime(2024, 1, 1)),
+                         [(event_types[HEARTBEAT_EVENT_TYPE], None, [])])
+
+    @patch.object(Elasticsearch, "search")
+    def test_last_machine_heartbeats_legacy_version(self, search):
+        requests = []
+        search.side_effect = self.search_side_effect(requests, [], page_size=1000)
+        store = self.build_store(version=(6, 3, 2))
+        self.assertEqual(store.get_last_machine_heartbeats("0123456789", datetime(2024, 1, 1)), [])
+        sources = requests[0]["aggs"]["heartbeats"]["composite"]["sources"]
+        self.assertFalse(any("missing_bucket" in terms for source in sources for terms in source.values()))
+
+    @patch.object(Elasticsearch, "search")
+    def test_last_machine_heartbeats_unconfigured_store(self, search):
+        requests = []
+        search.side_effect = self.search_side_effect(requests, [self.build_bucket("inventory_heartbeat", "munki")],
+                                                     page_size=1000)
+        store = EventStore(ConfigDict({
+            'servers': ["http://elastic:9200"],
+            'index': 'zentral-events',
+            'store_name': 'yolo',
+        }))
+        self.assertIsNone(store.version)
+        self.assertFalse(store.configured)
+
+        def wait_and_configure():
+            store.version = [8, 3, 2]
+            store.use_mapping_types = False
+            store.configured = True
+
+        with patch.object(store, "wait_and_configure", side_effect=wait_and_configure) as store_wait_and_configure:
+            heartbeats = store.get_last_machine_heartbeats("0123456789", datetime(2024, 1, 1))
+        store_wait_and_configure.assert_called_once_with()
+        self.assertEqual(heartbeats, [(event_types["inventory_heartbeat"], "munki", [(None, datetime(2024, 1, 1))])])
+        self.assertEqual(len(requests), 1)
+        sources = requests[0]["aggs"]["heartbeats"]["composite"]["sources"]
+        self.assertEqual(sources[1], {"source": {"terms": {"field": "inventory.source.name", "missing_bucket": True}}})
+
+    @patch.object(Elasticsearch, "search")
+    def test_last_machine_heartbeats_more_than_100_event_types(self, search):
+        heartbeat_event_types = build_heartbeat_event_types(150)
+        buckets = [self.build_bucket("inventory_heartbeat", f"source{i:02d}") for i in range(20)]
+        for event_type in heartbeat_event_types:
+            for i in range(3):
+                buckets.append(self.build_bucket(event_type, None, f"agent/{i}", f"2024-01-0{i + 1}T00:00:00"))
+        requests = []
+        search.side_effect = self.search_side_effect(requests, buckets, page_size=100)
+        store = self.build_store()
+        store.HEARTBEATS_COMPOSITE_SIZE = 100
+        with patch.dict(event_types, heartbeat_event_types):
+            heartbeats = store.get_last_machine_heartbeats("0123456789", datetime(2024, 1, 1))
+        # 470 buckets → 5 pages, the last one is incomplete
+        self.assertEqual(len(requests), 5)
+        self.assertEqual([r["aggs"]["heartbeats"]["composite"].get("after") for r in requests],
+                         [None, {"page": 1}, {"page": 2}, {"page": 3}, {"page": 4}])
+        self.assertEqual(len(heartbeats), 170)
+        self.assertEqual([source_name for _, source_name, _ in heartbeats[:20]],
+                         [f"source{i:02d}" for i in range(20)])
+        self.assertEqual([event_type_class for event_type_class, _, _ in heartbeats[20:]],
+                         [heartbeat_event_types[event_type] for event_type in sorted(heartbeat_event_types)])
+        for _, _, ua_max_dates in heartbeats[20:]:
+            self.assertEqual(ua_max_dates, [(f"agent/{i}", datetime(2024, 1, i + 1)) for i in range(3)])
+
+    @patch.object(Elasticsearch, "search")
+    def test_cached_last_machine_heartbeats(self, search):
+        requests = []
+        search.side_effect = self.search_side_effect(requests, [self.build_bucket("inventory_heartbeat", "munki")],
+                                                     page_size=1000)
+        store = self.build_store()
+        expected_heartbeats = [(event_types["inventory_heartbeat"], "munki", [(None, datetime(2024, 1, 1))])]
+        for _ in range(3):
+            self.assertEqual(store.get_cached_last_machine_heartbeats("0123456789", datetime(2024, 1, 1, 12)),
+                             expected_heartbeats)
+        self.assertEqual(len(requests), 1)
+        # other machine
+        store.get_cached_last_machine_heartbeats("9876543210", datetime(2024, 1, 1, 12))
+        self.assertEqual(len(requests), 2)
+        # other store
+        store.name = "fomo"
+        store.get_cached_last_machine_heartbeats("0123456789", datetime(2024, 1, 1, 12))
+        self.assertEqual(len(requests), 3)
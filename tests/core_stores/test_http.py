@@ -1,10 +1,38 @@
-from unittest.mock import Mock
+import gzip
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+from unittest.mock import Mock, patch
 from django.test import SimpleTestCase
 from django.utils.crypto import get_random_string
 from accounts.events import EventMetadata, LoginEvent
+from zentral.core.exceptions import ImproperlyConfigured
 from zentral.core.stores.backends.http import EventStore
 
 
+class BulkRequestHandler(BaseHTTPRequestHandler):
+    # local stand-in for a bulk HTTP endpoint
+
+    def do_POST(self):
+        data = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.headers.get("Content-Encoding") == "gzip":
+            data = gzip.decompress(data)
+        events = [json.loads(line) for line in data.decode("utf-8").splitlines()]
+        self.server.requests.append((dict(self.headers), events))
+        failed_events = [{"id": event["id"], "index": event["index"]}
+                         for event in events
+                         if event["zentral"]["user"]["username"] in self.server.failing_usernames]
+        response = json.dumps({"failed_events": failed_events}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+
 class HttpStoreTestCase(SimpleTestCase):
     def get_store(self, **kwargs):
         for arg, default in (("store_name", get_random_string(12)),
@@ -60,3 +88,97 @@ class HttpStoreTestCase(SimpleTestCase):
         event = self.build_login_event()
         store.store(event)
         mock_post.assert_called_once()
+
+    # bulk
+
+    def start_server(self, failing_usernames=()):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), BulkRequestHandler)
+        server.requests = []
+        server.failing_usernames = set(failing_usernames)
+        thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server, f"http://127.0.0.1:{server.server_address[1]}/bulk"
+
+    @staticmethod
+    def event_key(event):
+        return str(event.metadata.uuid), event.metadata.index
+
+    def test_default_bulk_config(self):
+        store = self.get_store()
+        self.assertEqual(store.batch_size, 1)
+        self.assertEqual(store.max_batch_bytes, 5 * 2**20)
+        self.assertFalse(store.compress)
+
+    def test_bulk_config_bounds(self):
+        store = self.get_store(batch_size=100000, max_batch_bytes=1)
+        self.assertEqual(store.batch_size, 1000)
+        self.assertEqual(store.max_batch_bytes, 1024)
+
+    def test_bulk_config_error(self):
+        with self.assertRaises(ImproperlyConfigured) as cm:
+            self.get_store(max_batch_bytes="yolo")
+        self.assertEqual(cm.exception.args[0], "max_batch_bytes must be an integer")
+
+    def test_bulk_store_not_available(self):
+        store = self.get_store()
+        with self.assertRaises(RuntimeError) as cm:
+            list(store.bulk_store([self.build_login_event()]))
+        self.assertEqual(cm.exception.args[0], "bulk_store is not available when batch_size < 2")
+
+    def test_bulk_store_noop(self):
+        store = self.get_store(batch_size=10)
+        store.client.session.post = Mock()
+        self.assertEqual(list(store.bulk_store([])), [])
+        store.client.session.post.assert_not_called()
+
+    def test_bulk_store_ndjson(self):
+        server, endpoint_url = self.start_server()
+        store = self.get_store(endpoint_url=endpoint_url, batch_size=10)
+        events = [self.build_login_event() for _ in range(3)]
+        serialized_events = [e.serialize() for e in events]
+        self.assertEqual(list(store.bulk_store(serialized_events)), [self.event_key(e) for e in events])
+        self.assertEqual(len(server.requests), 1)
+        headers, posted_events = server.requests[0]
+        self.assertEqual(headers["Content-Type"], "application/x-ndjson")
+        self.assertNotIn("Content-Encoding", headers)
+        self.assertEqual(posted_events, [store.client._serialize_event(e) for e in events])
+        # the serialized events are not modified
+        self.assertEqual(serialized_events, [e.serialize() for e in events])
+
+    def test_bulk_store_gzip(self):
+        server, endpoint_url = self.start_server()
+        store = self.get_store(endpoint_url=endpoint_url, batch_size=10, compress=True)
+        events = [self.build_login_event() for _ in range(2)]
+        self.assertEqual(list(store.bulk_store(events)), [self.event_key(e) for e in events])
+        headers, posted_events = server.requests[0]
+        self.assertEqual(headers["Content-Encoding"], "gzip")
+        self.assertEqual([e["id"] for e in posted_events], [str(e.metadata.uuid) for e in events])
+
+    def test_bulk_store_max_batch_bytes(self):
+        server, endpoint_url = self.start_server()
+        store = self.get_store(endpoint_url=endpoint_url, batch_size=10, max_batch_bytes=1024)
+        events = [self.build_login_event(get_random_string(300)) for _ in range(5)]
+        self.assertEqual(list(store.bulk_store(events)), [self.event_key(e) for e in events])
+        # ~ 500 bytes per event → 2 events per request max
+        self.assertEqual([len(posted_events) for _, posted_events in server.requests], [2, 2, 1])
+
+    def test_bulk_store_partial_failure(self):
+        failing_username = get_random_string(12)
+        server, endpoint_url = self.start_server(failing_usernames=[failing_username])
+        store = self.get_store(endpoint_url=endpoint_url, batch_size=10)
+        events = [self.build_login_event(), self.build_login_event(failing_username), self.build_login_event()]
+        self.assertEqual(list(store.bulk_store(events)), [self.event_key(events[0]), self.event_key(events[2])])
+
+    @patch("zentral.core.stores.backends.http.logger.exception")
+    def test_bulk_store_request_error(self, logger_exception):
+        mock_response = Mock()
+        mock_response.ok = False
+        mock_response.status_code = 400
+        mock_response.raise_for_status.side_effect = ValueError("yolo")
+        store = self.get_store(batch_size=10)
+        store.client.session.post = Mock(return_value=mock_response)
+        self.assertEqual(list(store.bulk_store([self.build_login_event()])), [])
+        logger_exception.assert_called_once()
@@ -1,10 +1,29 @@
+import json
+import socket
+import socketserver
+import ssl
+import threading
 from unittest.mock import Mock, patch
 from django.test import SimpleTestCase
 from django.utils.crypto import get_random_string
 from accounts.events import EventMetadata, LoginEvent
+from zentral.core.exceptions import ImproperlyConfigured
 from zentral.core.stores.backends.syslog import EventStore
 
 
+class SyslogTCPHandler(socketserver.BaseRequestHandler):
+    # local stand-in for a syslog listener, keeps the raw received data
+
+    def handle(self):
+        self.server.connection_count += 1
+        while True:
+            data = self.request.recv(65536)
+            if not data:
+                break
+            with self.server.lock:
+                self.server.data += data
+
+
 class SyslogStoreTestCase(SimpleTestCase):
     def get_store(self, **kwargs):
         for arg, default in (("store_name", get_random_string(12)),
@@ -36,3 +55,136 @@ class SyslogStoreTestCase(SimpleTestCase):
         store.store(event)
         mock_socket.connect.assert_called_once()
         mock_socket.send.assert_called_once()
+
+    # TCP transport
+
+    def start_tcp_listener(self):
+        server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), SyslogTCPHandler)
+        server.daemon_threads = True
+        server.data = b""
+        server.connection_count = 0
+        server.lock = threading.Lock()
+        thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    @staticmethod
+    def wait_for_data(server, size):
+        for _ in range(500):
+            with server.lock:
+                if len(server.data) >= size:
+                    return server.data
+            threading.Event().wait(0.01)
+        return server.data
+
+    @staticmethod
+    def parse_octet_counting_frames(data):
+        msgs = []
+        while data:
+            msg_len, data = data.split(b" ", 1)
+            msgs.append(data[:int(msg_len)])
+            data = data[int(msg_len):]
+        return msgs
+
+    @staticmethod
+    def event_key(event):
+        return str(event.metadata.uuid), event.metadata.index
+
+    def test_framing_error(self):
+        with self.assertRaises(ImproperlyConfigured) as cm:
+            self.get_store(protocol="tcp", framing="yolo")
+        self.assertEqual(cm.exception.args[0], "Unknown syslog framing yolo")
+
+    def test_tls_error(self):
+        with self.assertRaises(ImproperlyConfigured) as cm:
+            self.get_store(tls=True)
+        self.assertEqual(cm.exception.args[0], "Syslog TLS is only available with the tcp protocol and a host")
+
+    def test_tls_default_framing(self):
+        store = self.get_store(protocol="tcp", tls=True)
+        self.assertTrue(store.octet_counting)
+        self.assertFalse(self.get_store(protocol="tcp").octet_counting)
+
+    def test_tls_context(self):
+        store = self.get_store(protocol="tcp", tls=True, verify_tls=False)
+        self.assertEqual(store.ssl_context.verify_mode, ssl.CERT_NONE)
+        self.assertFalse(store.ssl_context.check_hostname)
+        self.assertEqual(self.get_store(protocol="tcp", tls=True).ssl_context.verify_mode, ssl.CERT_REQUIRED)
+
+    @patch("zentral.core.stores.backends.syslog.socket.socket")
+    def test_tls_connection(self, socket_socket):
+        store = self.get_store(protocol="tcp", tls=True, host="syslog.example.com", port=6514)
+        with patch.object(ssl.SSLContext, "wrap_socket") as wrap_socket:
+            store.wait_and_configure()
+        wrap_socket.assert_called_once_with(socket_socket.return_value, server_hostname="syslog.example.com")
+        wrap_socket.return_value.connect.assert_called_once_with(("syslog.example.com", 6514))
+        socket_socket.return_value.setsockopt.assert_called_once_with(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+    def test_bulk_store_not_available(self):
+        store = self.get_store()
+        store.configured = True
+        with self.assertRaises(RuntimeError) as cm:
+            list(store.bulk_store([self.build_login_event()]))
+        self.assertEqual(cm.exception.args[0], "bulk_store is not available when batch_size < 2")
+
+    def test_bulk_store_octet_counting(self):
+        server = self.start_tcp_listener()
+        store = self.get_store(protocol="tcp", host="127.0.0.1", port=server.server_address[1],
+                               framing="octet_counting", batch_size=100)
+        events = [self.build_login_event() for _ in range(10)]
+        self.assertEqual(list(store.bulk_store(events)), [self.event_key(e) for e in events])
+        # same connection for the next batch
+        self.assertEqual(list(store.bulk_store(events[:5])), [self.event_key(e) for e in events[:5]])
+        expected_msgs = [b"<14>" + json.dumps(e.serialize()).encode("utf-8") for e in events + events[:5]]
+        data = self.wait_for_data(server, sum(len(m) for m in expected_msgs))
+        self.assertEqual(self.parse_octet_counting_frames(data), expected_msgs)
+        self.assertEqual(server.connection_count, 1)
+        store.socket.close()
+
+    def test_bulk_store_null_framing(self):
+        server = self.start_tcp_listener()
+        store = self.get_store(protocol="tcp", host="127.0.0.1", port=server.server_address[1], batch_size=100)
+        events = [self.build_login_event() for _ in range(3)]
+        self.assertEqual(list(store.bulk_store(events)), [self.event_key(e) for e in events])
+        expected_msgs = [b"<14>" + json.dumps(e.serialize()).encode("utf-8") for e in events]
+        data = self.wait_for_data(server, sum(len(m) + 1 for m in expected_msgs))
+        self.assertEqual(data.split(b"\x00")[:-1], expected_msgs)
+        store.socket.close()
+
+    @patch("zentral.core.stores.backends.syslog.socket")
+    def test_bulk_store_udp(self, syslog_socket):
+        mock_socket = Mock()
+        syslog_socket.socket.return_value = mock_socket
+        store = self.get_store(batch_size=100)
+        events = [self.build_login_event() for _ in range(3)]
+        self.assertEqual(list(store.bulk_store(events)), [self.event_key(e) for e in events])
+        # one datagram per event
+        self.assertEqual(mock_socket.send.call_count, 3)
+        mock_socket.sendall.assert_not_called()
+
+    @patch("zentral.core.stores.backends.syslog.socket.socket")
+    def test_bulk_store_reconnect(self, socket_socket):
+        first_socket = Mock()
+        first_socket.sendall.side_effect = BrokenPipeError
+        second_socket = Mock()
+        socket_socket.side_effect = [first_socket, second_socket]
+        store = self.get_store(protocol="tcp", batch_size=100)
+        events = [self.build_login_event() for _ in range(2)]
+        self.assertEqual(list(store.bulk_store(events)), [self.event_key(e) for e in events])
+        first_socket.close.assert_called_once_with()
+        # the whole batch is sent again on the new connection
+        second_socket.sendall.assert_called_once_with(first_socket.sendall.call_args.args[0])
+
+    @patch("zentral.core.stores.backends.syslog.socket.socket")
+    def test_bulk_store_reconnect_error(self, socket_socket):
+        first_socket = Mock()
+        first_socket.sendall.side_effect = BrokenPipeError
+        second_socket = Mock()
+        second_socket.sendall.side_effect = ConnectionResetError
+        socket_socket.side_effect = [first_socket, second_socket]
+        store = self.get_store(protocol="tcp", batch_size=100)
+        with self.assertRaises(ConnectionResetError):
+            list(store.bulk_store([self.build_login_event()]))
@@ -0,0 +1,149 @@
+from unittest.mock import patch
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils.crypto import get_random_string
+from zentral.contrib.inventory.local_cache import MachineLocalCache, postgresql_channel, signal_machine_change
+from zentral.contrib.inventory.models import MachineTag, MetaMachine, Tag, Taxonomy
+
+
+class MachineLocalCacheTestCase(SimpleTestCase):
+    def test_get_set(self):
+        local_cache = MachineLocalCache(with_sync=False)
+        self.assertIsNone(local_cache.get("01234567", "mm-si"))
+        local_cache.set("01234567", "mm-si", {"un": 1})
+        self.assertEqual(local_cache.get("01234567", "mm-si"), {"un": 1})
+        self.assertIsNone(local_cache.get("01234567", "mm-probe-fvs"))
+        self.assertIsNone(local_cache.get("12345678", "mm-si"))
+
+    def test_max_size_lru(self):
+        local_cache = MachineLocalCache(max_size=2, with_sync=False)
+        local_cache.set("1", "mm-si", 1)
+        local_cache.set("2", "mm-si", 2)
+        self.assertEqual(local_cache.get("1", "mm-si"), 1)  # 1 is now the most recently used
+        local_cache.set("3", "mm-si", 3)
+        self.assertEqual(len(local_cache), 2)
+        self.assertEqual(local_cache.get("1", "mm-si"), 1)
+        self.assertIsNone(local_cache.get("2", "mm-si"))
+        self.assertEqual(local_cache.get("3", "mm-si"), 3)
+
+    @patch("zentral.contrib.inventory.local_cache.time.monotonic")
+    def test_max_age(self, monotonic):
+        monotonic.return_value = 1000
+        local_cache = MachineLocalCache(max_age=10, with_sync=False)
+        local_cache.set("1", "mm-si", 1)
+        monotonic.return_value = 1010
+        self.assertEqual(local_cache.get("1", "mm-si"), 1)
+        monotonic.return_value = 1011
+        self.assertIsNone(local_cache.get("1", "mm-si"))
+
+    def test_invalidate_clear(self):
+        local_cache = MachineLocalCache(with_sync=False)
+        local_cache.set("1", "mm-si", 1)
+        local_cache.set("1", "mm-probe-fvs", 11)
+        local_cache.set("2", "mm-si", 2)
+        local_cache.invalidate("1")
+        self.assertIsNone(local_cache.get("1", "mm-si"))
+        self.assertIsNone(local_cache.get("1", "mm-probe-fvs"))
+        self.assertEqual(local_cache.get("2", "mm-si"), 2)
+        local_cache.clear()
+        self.assertEqual(len(local_cache), 0)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class MachineCacheInvalidationTestCase(TestCase):
+    def test_signal_machine_change_notify(self):
+        serial_number = get_random_string(12)
+        cursor = connection.cursor()
+        cursor.execute(f"LISTEN {postgresql_channel}")
+        signal_machine_change(serial_number)
+        signal_machine_change()
+        # notifications are only delivered on commit
+        self.assertEqual(connection.connection.notifies, [])
+        cursor.execute(f"UNLISTEN {postgresql_channel}")
+
+    def test_cached_value_local_cache(self):
+        serial_number = get_random_string(12)
+        local_cache = MachineLocalCache(with_sync=False)
+        with patch("zentral.contrib.inventory.models.machine_local_cache", local_cache):
+            mm = MetaMachine(serial_number)
+            with self.assertNumQueries(1):
+                self.assertEqual(mm.cached_probe_filtering_values, (None, None, set(), set()))
+            self.assertEqual(local_cache.get(serial_number, "mm-probe-fvs"), (None, None, set(), set()))
+            # served from the local cache, even without the shared cache
+            cache.clear()
+            mm = MetaMachine(serial_number)
+            with self.assertNumQueries(0):
+                self.assertEqual(mm.cached_probe_filtering_values, (None, None, set(), set()))
+
+    @patch("zentral.contrib.inventory.models.signal_machine_change")
+    def test_machine_tag_invalidates_cached_info(self, signal_machine_change):
+        serial_number = get_random_string(12)
+        tag = Tag.objects.create(name=get_random_string(12))
+        mm = MetaMachine(serial_number)
+        self.assertEqual(mm.cached_probe_filtering_values, (None, None, set(), set()))
+        local_cache = MachineLocalCache(with_sync=False)
+        with patch("zentral.contrib.inventory.models.machine_local_cache", local_cache):
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                MachineTag.objects.create(serial_number=serial_number, tag=tag)
+        self.assertEqual(len(callbacks), 1)
+        signal_machine_change.assert_called_once_with(serial_number)
+        self.assertIsNone(cache.get(MetaMachine(serial_number).get_cache_key("mm-probe-fvs")))
+        mm = MetaMachine(serial_number)
+        self.assertEqual(mm.cached_probe_filtering_values, (None, None, set(), {tag.pk}))
+
+    def test_machine_tag_queryset_fast_delete(self):
+        serial_number = get_random_string(12)
+        tag = Tag.objects.create(name=get_random_string(12))
+        MachineTag.objects.create(serial_number=serial_number, tag=tag)
+        with self.assertNumQueries(1):
+            MachineTag.objects.filter(serial_number=serial_number).delete()
+
+    @patch("zentral.contrib.inventory.models.signal_machine_change")
+    def test_update_taxonomy_tags_invalidates_cached_info(self, signal_machine_change):
+        serial_number = get_random_string(12)
+        taxonomy = Taxonomy.objects.create(name=get_random_string(12))
+        tag = Tag.objects.create(taxonomy=taxonomy, name=get_random_string(12))
+        MachineTag.objects.create(serial_number=serial_number, tag=tag)
+        local_cache = MachineLocalCache(with_sync=False)
+        with patch("zentral.contrib.inventory.models.machine_local_cache", local_cache):
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                MetaMachine(serial_number).update_taxonomy_tags(taxonomy, [])
+        self.assertEqual(len(callbacks), 1)
+        signal_machine_change.assert_called_once_with(serial_number)
+        self.assertFalse(MachineTag.objects.filter(serial_number=serial_number).exists())
+
+    @patch("zentral.contrib.inventory.models.signal_machine_change")
+    def test_tag_change_clears_local_caches(self, signal_machine_change):
+        local_cache = MachineLocalCache(with_sync=False)
+        with patch("zentral.contrib.inventory.models.machine_local_cache", local_cache):
+            with self.captureOnCommitCallbacks(execute=True):
+                Tag.objects.create(name=get_random_string(12))
+        signal_machine_change.assert_called_once_with(None)
+
+    @patch("zentral.contrib.inventory.models.signal_machine_change")
+    def test_tag_delete_invalidates_shared_cached_info(self, signal_machine_change):
+        serial_number = get_random_string(12)
+        tag = Tag.objects.create(name=get_random_string(12))
+        MachineTag.objects.create(serial_number=serial_number, tag=tag)
+        local_cache = MachineLocalCache(with_sync=False)
+        with patch("zentral.contrib.inventory.models.machine_local_cache", local_cache):
+            self.assertEqual(MetaMachine(serial_number).cached_probe_filtering_values,
+                             (None, None, set(), {tag.pk}))
+            cache_key = MetaMachine(serial_number).get_cache_key("mm-probe-fvs")
+            self.assertIsNotNone(cache.get(cache_key))
+            with self.captureOnCommitCallbacks(execute=True):
+                tag.delete()
+            signal_machine_change.assert_called_once_with(None)
+            # the notification is mocked, the local cache is cleared manually
+            local_cache.clear()
+            # new version of the shared cache keys
+            self.assertNotEqual(MetaMachine(serial_number).get_cache_key("mm-probe-fvs"), cache_key)
+            self.assertEqual(MetaMachine(serial_number).cached_probe_filtering_values,
+                             (None, None, set(), set()))
+
+    @patch("zentral.contrib.inventory.models.signal_machine_change")
+    def test_no_local_cache_no_notification(self, signal_machine_change):
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(name=get_random_string(12))
+        signal_machine_change.assert_not_called()
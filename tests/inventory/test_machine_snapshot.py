@@ -16,8 +16,9 @@ from zentral.contrib.inventory.models import (BusinessUnit,
                                               MetaMachine,
                                               Source,
                                               Tag, Taxonomy)
-from zentral.contrib.inventory.utils import inventory_events_from_machine_snapshot_commit
-from zentral.utils.mt_models import MTOError
+from zentral.contrib.inventory.utils import (commit_machine_snapshot_and_yield_events,
+                                             inventory_events_from_machine_snapshot_commit)
+from zentral.utils.mt_models import MTOError, prepare_commit_tree
 
 
 @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
@@ -269,6 +270,77 @@ class MachineSnapshotTestCase(TestCase):
         self.assertEqual(msc6.parent, msc5)
         self.assertEqual(ms6, ms5)
 
+    def test_bulk_commit_same_objects_as_commit(self):
+        tree = copy.deepcopy(self.machine_snapshot5)
+        tree["certificates"][0]["signed_by"] = copy.deepcopy(self.certificate)
+        ms, created = MachineSnapshot.objects.bulk_commit(copy.deepcopy(tree))
+        self.assertTrue(created)
+        ms.refresh_from_db()
+        self.assertEqual(ms.hash(), ms.mt_hash)
+        self.assertEqual(ms.serialize(), MachineSnapshot.objects.get(pk=ms.pk).serialize())
+        self.assertEqual(ms.osx_app_instances.count(), 1)
+        self.assertEqual(ms.certificates.count(), 2)
+        self.assertEqual(Certificate.objects.count(), 3)
+        self.assertEqual(ms.extra_facts, self.extra_facts)
+        self.assertEqual(ms.business_unit, self.business_unit)
+        ms2, created = MachineSnapshot.objects.commit(copy.deepcopy(tree))
+        self.assertFalse(created)
+        self.assertEqual(ms2, ms)
+
+    def test_bulk_commit_existing_subtrees(self):
+        MachineSnapshot.objects.commit(copy.deepcopy(self.machine_snapshot2))
+        tree = copy.deepcopy(self.machine_snapshot3)
+        ms, created = MachineSnapshot.objects.bulk_commit(tree)
+        self.assertTrue(created)
+        self.assertEqual(ms.osx_app_instances.count(), 2)
+        self.assertEqual(Certificate.objects.count(), 1)
+        ms.refresh_from_db()
+        self.assertEqual(ms.hash(), ms.mt_hash)
+
+    def test_bulk_commit_existing_tree_one_query(self):
+        ms, _ = MachineSnapshot.objects.bulk_commit(copy.deepcopy(self.machine_snapshot5))
+        with self.assertNumQueries(1):
+            ms2, created = MachineSnapshot.objects.bulk_commit(copy.deepcopy(self.machine_snapshot5))
+        self.assertFalse(created)
+        self.assertEqual(ms2, ms)
+
+    def test_bulk_commit_query_count(self):
+        tree = copy.deepcopy(self.machine_snapshot3)
+        tree["osx_app_instances"].extend(
+            {"app": {"bundle_id": f"io.zentral.app{i}",
+                     "bundle_name": f"App{i}.app",
+                     "bundle_version_str": "1.0"},
+             "bundle_path": f"/Applications/App{i}.app"}
+            for i in range(100)
+        )
+        # does not depend on the number of apps
+        with self.assertNumQueries(25):
+            ms, _ = MachineSnapshot.objects.bulk_commit(tree)
+        self.assertEqual(ms.osx_app_instances.count(), 102)
+
+    def test_bulk_create_objs_concurrently_created(self):
+        tree = copy.deepcopy(self.certificate)
+        tree1 = copy.deepcopy(self.certificate1)
+        prepare_commit_tree(tree)
+        prepare_commit_tree(tree1)
+        # concurrently created
+        existing_cert, _ = Certificate.objects.commit(copy.deepcopy(tree))
+        new_objs = [Certificate.objects._build_bulk_commit_obj(t, {}) for t in (tree, tree1)]
+        objs = {}
+        created_mt_hashes = Certificate.objects._bulk_create_objs(new_objs, objs)
+        # only the certificate created by this call
+        self.assertEqual(created_mt_hashes, {tree1["mt_hash"]})
+        self.assertEqual(objs[(Certificate, tree["mt_hash"])], existing_cert)
+        self.assertEqual(objs[(Certificate, tree1["mt_hash"])].common_name, "Yolo-ID-1")
+        self.assertEqual(Certificate.objects.count(), 2)
+
+    def test_bulk_commit_source_error(self):
+        tree = copy.deepcopy(self.machine_snapshot_source_error)
+        with self.assertRaises(MTOError,
+                               msg="Field 'source' of MachineSnapshot has "
+                                   "many_to_one: True, many_to_many: False"):
+            MachineSnapshot.objects.bulk_commit(tree)
+
     def test_duplicated_subtrees(self):
         tree = copy.deepcopy(self.machine_snapshot3)
         tree["osx_app_instances"].append(copy.deepcopy(self.osx_app_instance2))
@@ -400,7 +472,7 @@ class MachineSnapshotTestCase(TestCase):
         self.assertEqual((MACOS, None, {self.meta_business_unit.id}, {tag1.id, tag2.id}),
                          mm.cached_probe_filtering_values)
         self.assertEqual((MACOS, None, {self.meta_business_unit.id}, {tag1.id, tag2.id}),
-                         cache.get("mm-probe-fvs_{}".format(mm.get_urlsafe_serial_number())))
+                         cache.get(mm.get_cache_key("mm-probe-fvs")))
 
         # get_serialized_info_for_event
         mm = MetaMachine(self.serial_number)
@@ -600,3 +672,67 @@ class MachineSnapshotTestCase(TestCase):
         self.assertEqual(msc3.machine_snapshot, ms)
         self.assertEqual(msc3.update_diff(),
                          {"last_seen": {"added": last_seen3, "removed": last_seen}})
+
+    # unchanged tree fast path
+
+    def _commit_and_get_event_types(self, tree, last_seen, system_uptime=None):
+        tree = copy.deepcopy(tree)
+        tree["last_seen"] = last_seen
+        if system_uptime:
+            tree["system_uptime"] = system_uptime
+        return [e.event_type for e in commit_machine_snapshot_and_yield_events(tree)]
+
+    def test_unchanged_tree_fast_path(self):
+        last_seen = datetime.utcnow() - timedelta(hours=1)
+        self.assertEqual(self._commit_and_get_event_types(self.machine_snapshot2, last_seen),
+                         ["add_machine", "inventory_heartbeat"])
+        msc = MachineSnapshotCommit.objects.get(serial_number=self.serial_number)
+        last_seen2 = datetime.utcnow()
+        tree = copy.deepcopy(self.machine_snapshot2)
+        tree["last_seen"] = last_seen2
+        tree["system_uptime"] = 1234
+        with self.assertNumQueries(1):
+            events = list(commit_machine_snapshot_and_yield_events(tree))
+        self.assertEqual(len(events), 1)
+        event = events[0]
+        self.assertEqual(event.event_type, "inventory_heartbeat")
+        self.assertEqual(event.metadata.created_at, last_seen2)
+        self.assertEqual(event.payload, {"source": msc.source.serialize()})
+        # no new commit, current commit refreshed
+        self.assertEqual(MachineSnapshotCommit.objects.filter(serial_number=self.serial_number).count(), 1)
+        msc.refresh_from_db()
+        self.assertEqual(msc.version, 1)
+        self.assertEqual(msc.last_seen, last_seen2)
+        self.assertEqual(msc.system_uptime, 1234)
+        cms = CurrentMachineSnapshot.objects.get(serial_number=self.serial_number)
+        self.assertEqual(cms.last_seen, last_seen2)
+        self.assertTrue(MetaMachine(self.serial_number).has_recent_source_snapshot(self.source["module"]))
+        # same last seen, no heartbeat
+        self.assertEqual(self._commit_and_get_event_types(self.machine_snapshot2, last_seen2), [])
+        # changed tree, new commit
+        last_seen3 = datetime.utcnow()
+        self.assertEqual(self._commit_and_get_event_types(self.machine_snapshot3, last_seen3),
+                         ["add_machine_osx_app_instance", "inventory_heartbeat"])
+        msc3 = MachineSnapshotCommit.objects.get(serial_number=self.serial_number, version=2)
+        self.assertEqual(msc3.parent, msc)
+        self.assertEqual(msc3.update_diff()["last_seen"], {"added": last_seen3, "removed": last_seen2})
+
+    def test_unchanged_tree_stale_cache(self):
+        last_seen = datetime.utcnow() - timedelta(hours=1)
+        self._commit_and_get_event_types(self.machine_snapshot2, last_seen)
+        # previous tree committed without the fast path
+        tree = copy.deepcopy(self.machine_snapshot)
+        MachineSnapshotCommit.objects.commit_machine_snapshot_tree(tree)
+        last_seen2 = datetime.utcnow()
+        self.assertEqual(self._commit_and_get_event_types(self.machine_snapshot2, last_seen2),
+                         ["add_machine_osx_app_instance", "add_machine_os_version", "inventory_heartbeat"])
+        self.assertEqual(MachineSnapshotCommit.objects.filter(serial_number=self.serial_number).count(), 3)
+
+    def test_unchanged_tree_archived_machine(self):
+        last_seen = datetime.utcnow() - timedelta(hours=1)
+        self._commit_and_get_event_types(self.machine_snapshot2, last_seen)
+        MetaMachine(self.serial_number).archive()
+        self.assertEqual(self._commit_and_get_event_types(self.machine_snapshot2, datetime.utcnow()),
+                         ["inventory_heartbeat"])
+        self.assertEqual(MachineSnapshotCommit.objects.filter(serial_number=self.serial_number).count(), 2)
+        self.assertEqual(CurrentMachineSnapshot.objects.filter(serial_number=self.serial_number).count(), 1)
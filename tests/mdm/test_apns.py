@@ -1,7 +1,14 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+import socket
+import threading
+import time
 from unittest.mock import patch, Mock
 from django.test import TestCase
 from django.utils.crypto import get_random_string
+import h2.config
+import h2.connection
+import h2.events
 import httpx
 from zentral.contrib.inventory.models import MetaBusinessUnit
 from zentral.contrib.mdm.apns import (apns_client_cache, APNSClient,
@@ -10,6 +17,59 @@ from zentral.contrib.mdm.events import MDMDeviceNotificationEvent
 from .utils import force_dep_enrollment_session, force_enrolled_user, force_push_certificate
 
 
+class FakeAPNSServer(threading.Thread):
+    """Local cleartext HTTP/2 server, answering the notifications after a delay"""
+
+    def __init__(self, response_delay=0.1, status=200):
+        super().__init__(daemon=True)
+        self.response_delay = response_delay
+        self.status = status
+        self.sock = socket.create_server(("127.0.0.1", 0))
+        self.port = self.sock.getsockname()[1]
+        self.connection_count = 0
+        self.request_count = 0
+        self.max_concurrent_streams = 0
+
+    def run(self):
+        while True:
+            try:
+                client_sock, _ = self.sock.accept()
+            except OSError:
+                return
+            self.connection_count += 1
+            threading.Thread(target=self.handle, args=(client_sock,), daemon=True).start()
+
+    def handle(self, client_sock):
+        conn = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=False))
+        conn.initiate_connection()
+        client_sock.sendall(conn.data_to_send())
+        client_sock.settimeout(0.01)
+        pending_streams = {}
+        while True:
+            try:
+                data = client_sock.recv(65535)
+            except socket.timeout:
+                data = None
+            except OSError:
+                return
+            if data == b"":
+                return
+            if data:
+                for event in conn.receive_data(data):
+                    if isinstance(event, h2.events.StreamEnded):
+                        pending_streams[event.stream_id] = time.monotonic()
+                        self.request_count += 1
+                        self.max_concurrent_streams = max(self.max_concurrent_streams, len(pending_streams))
+            for stream_id, received_at in list(pending_streams.items()):
+                if time.monotonic() - received_at > self.response_delay:
+                    conn.send_headers(stream_id, [(":status", str(self.status))], end_stream=True)
+                    del pending_streams[stream_id]
+            client_sock.sendall(conn.data_to_send())
+
+    def stop(self):
+        self.sock.close()
+
+
 class MDMAPNSTestCase(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -33,6 +93,35 @@ class MDMAPNSTestCase(TestCase):
         self.assertIsInstance(client.client, httpx.Client)
         self.assertEqual(client.client.base_url, "https://api.push.apple.com")
 
+    def _get_fake_apns_server_client(self, status=200):
+        server = FakeAPNSServer(status=status)
+        server.start()
+        self.addCleanup(server.stop)
+        client = APNSClient.from_push_certificate(self.push_certificate)
+        client.client = httpx.Client(base_url=f"http://127.0.0.1:{server.port}", http1=False, http2=True,
+                                     timeout=APNSClient.timeout)
+        return server, client
+
+    def test_apns_client_concurrent_notifications_multiplexed(self):
+        server, client = self._get_fake_apns_server_client()
+        with ThreadPoolExecutor(max_workers=40) as executor:
+            results = list(executor.map(lambda i: client.send_notification(f"{i:064x}", "yolo"), range(60)))
+        self.assertEqual(results, 60 * [True])
+        self.assertEqual(server.request_count, 60)
+        # one HTTP/2 connection, with concurrent streams bounded per client
+        self.assertEqual(server.connection_count, 1)
+        self.assertGreater(server.max_concurrent_streams, 1)
+        self.assertLessEqual(server.max_concurrent_streams, APNSClient.max_concurrent_streams)
+
+    @patch("zentral.contrib.mdm.apns.time.sleep")
+    def test_apns_client_concurrent_notifications_failure(self, sleep):
+        server, client = self._get_fake_apns_server_client(status=400)
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            results = list(executor.map(lambda i: client.send_notification(f"{i:064x}", "yolo"), range(10)))
+        self.assertEqual(results, 10 * [False])
+        self.assertEqual(server.request_count, 10)
+        sleep.assert_not_called()
+
     def test_apns_client_cache_no_client(self):
         client = apns_client_cache.get_or_create(get_random_string(12), datetime(2929, 1, 1))
         self.assertIsNone(client)
@@ -6,6 +6,7 @@ from django.utils.crypto import get_random_string
 from zentral.contrib.inventory.models import MetaBusinessUnit
 from zentral.contrib.mdm.dep import sync_dep_virtual_server_devices
 from zentral.contrib.mdm.dep_client import CursorIterator
+from zentral.contrib.mdm.models import DEPDevice
 from .utils import force_dep_enrollment, force_dep_virtual_server
 
 
@@ -194,3 +195,115 @@ class TestDEPEnrollment(TestCase):
         self.assertIsNone(device.profile_uuid)
         self.assertIsNone(device.enrollment)
         self.assertEqual(device.profile_status, "empty")
+
+    def _build_device(self, serial_number, op_type="modified", op_date="2023-06-17T15:41:06Z", color="SPACE GRAY"):
+        return {'color': color,
+                'description': 'IPHONE X SPACE GRAY 64GB-ZDD',
+                'device_assigned_by': 'support@zentral.com',
+                'device_assigned_date': '2023-01-10T19:09:22Z',
+                'device_family': 'iPhone',
+                'model': 'iPhone X',
+                'op_date': op_date,
+                'op_type': op_type,
+                'os': 'iOS',
+                'profile_status': 'empty',
+                'serial_number': serial_number}
+
+    @patch("zentral.contrib.mdm.dep.DEPClient.from_dep_token")
+    def test_sync_dep_virtual_server_devices_fetch_only_changes(self, from_dep_token):
+        client = Mock()
+        from_dep_token.return_value = client
+        server = force_dep_virtual_server()
+        serial_numbers = [get_random_string(10).upper() for _ in range(3)]
+        client.fetch_devices.return_value = CursorIterator([self._build_device(sn) for sn in serial_numbers])
+        dep_devices = list(sync_dep_virtual_server_devices(server, batch_size=2))
+        self.assertEqual(sorted((d.serial_number, created) for d, created in dep_devices),
+                         sorted((sn, True) for sn in serial_numbers))
+        # same devices, one update
+        devices = [self._build_device(sn) for sn in serial_numbers]
+        devices[1]["color"] = "GOLD"
+        client.fetch_devices.return_value = CursorIterator(devices)
+        dep_devices = list(sync_dep_virtual_server_devices(server, force_fetch=True, batch_size=2))
+        self.assertEqual(len(dep_devices), 1)
+        d, d_created = dep_devices[0]
+        self.assertFalse(d_created)
+        self.assertEqual(d.serial_number, serial_numbers[1])
+        self.assertEqual(d.color, "GOLD")
+        d.refresh_from_db()
+        self.assertEqual(d.color, "GOLD")
+        self.assertEqual(d.virtual_server, server)
+
+    @patch("zentral.contrib.mdm.dep.DEPClient.from_dep_token")
+    def test_sync_dep_virtual_server_devices_sync_stalled_operations(self, from_dep_token):
+        client = Mock()
+        from_dep_token.return_value = client
+        server = force_dep_virtual_server()
+        server.token.sync_cursor = get_random_string(12)  # → sync
+        server.token.save()
+        serial_number1 = get_random_string(10).upper()
+        serial_number2 = get_random_string(10).upper()
+        client.sync_devices.return_value = CursorIterator([
+            self._build_device(serial_number1, op_type="added", op_date="2023-06-17T15:41:06Z"),
+            # newer operation in the same batch
+            self._build_device(serial_number1, op_date="2023-06-18T15:41:06Z", color="GOLD"),
+            # stalled operation in the same batch
+            self._build_device(serial_number1, op_date="2023-06-16T15:41:06Z", color="SILVER"),
+            self._build_device(serial_number2, op_date="2023-06-17T15:41:06Z"),
+        ])
+        dep_devices = sorted(sync_dep_virtual_server_devices(server), key=lambda t: t[0].serial_number)
+        self.assertEqual(
+            sorted((d.serial_number, d.color, d.last_op_type, d.last_op_date, created) for d, created in dep_devices),
+            sorted([(serial_number1, "GOLD", "modified", datetime(2023, 6, 18, 15, 41, 6), True),
+                    (serial_number2, "SPACE GRAY", "modified", datetime(2023, 6, 17, 15, 41, 6), True)])
+        )
+        # stalled operation in another batch
+        client.sync_devices.return_value = CursorIterator([
+            self._build_device(serial_number1, op_date="2023-06-17T15:41:07Z", color="SILVER"),
+            self._build_device(serial_number2, op_type="deleted", op_date="2023-06-18T15:41:06Z"),
+        ])
+        dep_devices = list(sync_dep_virtual_server_devices(server))
+        self.assertEqual(len(dep_devices), 1)
+        d, d_created = dep_devices[0]
+        self.assertFalse(d_created)
+        self.assertEqual(d.serial_number, serial_number2)
+        self.assertTrue(d.is_deleted())
+        d1 = DEPDevice.objects.get(serial_number=serial_number1)
+        self.assertEqual(d1.color, "GOLD")
+        self.assertEqual(d1.last_op_date, datetime(2023, 6, 18, 15, 41, 6))
+
+    @patch("zentral.contrib.mdm.dep.DEPClient.from_dep_token")
+    def test_sync_dep_virtual_server_devices_one_upsert_query_per_batch(self, from_dep_token):
+        client = Mock()
+        from_dep_token.return_value = client
+        server = force_dep_virtual_server()
+        server.token.sync_cursor = get_random_string(12)  # → sync
+        server.token.save()
+        client.sync_devices.return_value = CursorIterator(
+            [self._build_device(get_random_string(10).upper()) for _ in range(250)]
+        )
+        with self.assertNumQueries(4):  # enrollments, 2 upserts, token update
+            dep_devices = list(sync_dep_virtual_server_devices(server, batch_size=200))
+        self.assertEqual(len(dep_devices), 250)
+
+    @patch("zentral.contrib.mdm.dep.logger.error")
+    @patch("zentral.contrib.mdm.dep.DEPClient.from_dep_token")
+    def test_sync_dep_virtual_server_devices_unknown_profile(self, from_dep_token, logger_error):
+        client = Mock()
+        from_dep_token.return_value = client
+        server = force_dep_virtual_server()
+        server.token.sync_cursor = get_random_string(12)  # → sync
+        server.token.save()
+        profile_uuid = uuid.uuid4()
+        devices = [self._build_device(get_random_string(10).upper()) for _ in range(3)]
+        for device in devices:
+            device["profile_uuid"] = str(profile_uuid)
+        client.sync_devices.return_value = CursorIterator(devices)
+        with self.assertNumQueries(4):  # enrollments, unknown profile, upsert, token update
+            dep_devices = list(sync_dep_virtual_server_devices(server))
+        self.assertEqual(len(dep_devices), 3)
+        self.assertTrue(all(d.enrollment is None for d, _ in dep_devices))
+        # one error per device, the unknown profile is only looked up once
+        self.assertEqual(
+            [c.args for c in logger_error.call_args_list],
+            [("Unknown DEP profile %s for device %s", profile_uuid, device["serial_number"]) for device in devices]
+        )
@@ -269,6 +269,37 @@ class MDMWorkersTestCase(TestCase):
         w = DevicesAPNSWorker()
         self.assertEqual(w.notification_leaky_bucket.rate, 10)
 
+    @patch("zentral.contrib.mdm.workers.settings")
+    def test_concurrency_value_error(self, settings):
+        settings.__getitem__.return_value = ConfigDict({
+            "zentral.contrib.mdm": {"apns": {"workers": {"concurrency": "A"}}}
+        })
+        with self.assertRaises(
+            ImproperlyConfigured,
+            msg="APNS workers concurrency must be an integer"
+        ):
+            DevicesAPNSWorker()
+
+    @patch("zentral.contrib.mdm.workers.settings")
+    def test_concurrency_min(self, settings):
+        settings.__getitem__.return_value = ConfigDict({
+            "zentral.contrib.mdm": {"apns": {"workers": {"concurrency": "0"}}}
+        })
+        w = DevicesAPNSWorker()
+        self.assertEqual(w.notification_executor._max_workers, 1)
+
+    @patch("zentral.contrib.mdm.workers.settings")
+    def test_concurrency_max(self, settings):
+        settings.__getitem__.return_value = ConfigDict({
+            "zentral.contrib.mdm": {"apns": {"workers": {"concurrency": "20000000"}}}
+        })
+        w = DevicesAPNSWorker()
+        self.assertEqual(w.notification_executor._max_workers, 100)
+
+    def test_concurrency_default(self):
+        w = DevicesAPNSWorker()
+        self.assertEqual(w.notification_executor._max_workers, 20)
+
     def test_get_workers(self):
         workers = list(get_workers())
         self.assertIsInstance(workers[0], DevicesAPNSWorker)
@@ -476,6 +507,45 @@ class MDMWorkersTestCase(TestCase):
             "apns_notification_sent", "device", "no_client"
         )
 
+    @patch("zentral.contrib.mdm.workers.apns_client_cache.get_or_create")
+    @patch("zentral.core.queues.backends.kombu.EventQueues.post_event")
+    def test_devices_apns_worker_concurrent_notifications(self, post_event, get_or_create):
+        enrolled_devices = []
+        for _ in range(3):
+            session, _, _ = force_dep_enrollment_session(
+                self.mbu, authenticated=True, completed=True, push_certificate=self.push_certificate
+            )
+            enrolled_device = session.enrolled_device
+            enrolled_device.created_at -= timedelta(seconds=6)  # Old enough
+            enrolled_device.save()
+            enrolled_devices.append(enrolled_device)
+        success_device, failure_device, error_device = enrolled_devices
+
+        def send_notification(token, push_magic, priority, expiration_seconds):
+            if token == error_device.token:
+                raise ValueError("Yolo")
+            return token == success_device.token
+
+        client = Mock()
+        client.send_notification.side_effect = send_notification
+        get_or_create.return_value = client
+        w = DevicesAPNSWorker()
+        w.run(only_once=True)
+        self.assertEqual(client.send_notification.call_count, 3)
+        for enrolled_device in enrolled_devices:
+            enrolled_device.refresh_from_db()
+            self.assertIsNone(enrolled_device.notification_queued_at)
+        self.assertIsNotNone(success_device.last_notified_at)
+        self.assertIsNone(failure_device.last_notified_at)
+        self.assertIsNone(error_device.last_notified_at)
+        self.assertEqual(
+            sorted((e.metadata.machine_serial_number, e.payload["status"])
+                   for e in (c.args[0] for c in post_event.call_args_list)),
+            sorted([(success_device.serial_number, "success"),
+                    (failure_device.serial_number, "failure"),
+                    (error_device.serial_number, "failure")])
+        )
+
     # user
 
     @patch("zentral.core.queues.backends.kombu.EventQueues.post_event")
@@ -3,12 +3,14 @@ import os.path
 import plistlib
 from urllib.parse import urlparse
 import uuid
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase, override_settings
 from django.urls import reverse, NoReverseMatch
 from django.utils.crypto import get_random_string
 from server.urls import build_urlpatterns_for_zentral_apps
 from zentral.conf import settings
+from zentral.utils.text import shard as compute_shard
 from zentral.contrib.inventory.models import EnrollmentSecret, MachineTag, MetaBusinessUnit, Tag
 from zentral.contrib.monolith.models import (Enrollment,
                                              ManifestCatalog, ManifestSubManifest,
@@ -86,7 +88,7 @@ class MonolithAPIViewsTestCase(TestCase):
 
     # utility methods
 
-    def _make_munki_request(self, url, serial_number=None, authenticated=True, tags=None):
+    def _make_munki_request(self, url, serial_number=None, authenticated=True, tags=None, if_none_match=None):
         if not serial_number:
             serial_number = get_random_string(12)
         if tags:
@@ -103,6 +105,8 @@ class MonolithAPIViewsTestCase(TestCase):
         }
         if authenticated:
             kwargs["HTTP_AUTHORIZATION"] = f"Bearer {self.enrollment.secret.secret}"
+        if if_none_match:
+            kwargs["HTTP_IF_NONE_MATCH"] = if_none_match
         return self.client.get(url, **kwargs)
 
     def _force_smpi(
@@ -328,8 +332,85 @@ class MonolithAPIViewsTestCase(TestCase):
         self.assertTrue(all(p.get("zentral_monolith") is None for p in catalog))
         self.assertEqual(catalog[0]["version"], "1.2.3")
 
+    def test_get_catalog_etag_not_modified(self):
+        self._force_smpi()
+        url = reverse("monolith_public:repository_catalog", args=(self.manifest.get_catalog_munki_name(),))
+        response = self._make_munki_request(url, serial_number="12345678")
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        self.assertEqual(len(plistlib.loads(response.content)), 1)
+        response = self._make_munki_request(url, serial_number="12345678", if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(response.content, b"")
+        # other machine, same catalog
+        response = self._make_munki_request(url, if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_get_catalog_etag_changes(self):
+        pkg_info1, catalog, sub_manifest = self._force_smpi(name="ceci_n_est_pas_un_nom", version="1.2.3")
+        url = reverse("monolith_public:repository_catalog", args=(self.manifest.get_catalog_munki_name(),))
+        response = self._make_munki_request(url, serial_number="12345678")
+        etag = response["ETag"]
+        self._force_smpi(name=pkg_info1.name.name, version="1.2.4", catalog=catalog, sub_manifest=sub_manifest)
+        self.manifest.bump_version()
+        response = self._make_munki_request(url, serial_number="12345678", if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(len(plistlib.loads(response.content)), 2)
+
+    def test_get_catalog_sharded_etags(self):
+        pkg_info1, catalog, sub_manifest = self._force_smpi(name="ceci_n_est_pas_un_nom", version="1.2.3")
+        self._force_smpi(
+            name=pkg_info1.name.name,
+            version="1.2.4",
+            catalog=catalog,
+            sub_manifest=sub_manifest,
+            zentral_monolith={"shards": {"default": 50}}  # with NAME + VERSION + SN → 59, excluded
+        )
+        url = reverse("monolith_public:repository_catalog", args=(self.manifest.get_catalog_munki_name(),))
+        response = self._make_munki_request(url, serial_number="12345678")
+        self.assertEqual(len(plistlib.loads(response.content)), 1)
+        etag = response["ETag"]
+        # other machine, same tags, included in the shard → different catalog
+        serial_number = "11111111"
+        self.assertEqual(compute_shard("ceci_n_est_pas_un_nom1.2.4" + serial_number), 15)
+        response = self._make_munki_request(url, serial_number=serial_number, if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(len(plistlib.loads(response.content)), 2)
+
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_get_catalog_rebuilt_after_cache_eviction(self):
+        pkg_info1, catalog, sub_manifest = self._force_smpi(name="ceci_n_est_pas_un_nom", version="1.2.3")
+        self._force_smpi(name="un_autre_nom", version="1.2.4", catalog=catalog, sub_manifest=sub_manifest)
+        url = reverse("monolith_public:repository_catalog", args=(self.manifest.get_catalog_munki_name(),))
+        response = self._make_munki_request(url, serial_number="12345678")
+        etag = response["ETag"]
+        catalog_content = plistlib.loads(response.content)
+        self.assertEqual([p["name"] for p in catalog_content], ["ceci_n_est_pas_un_nom", "un_autre_nom"])
+        cache.clear()
+        response = self._make_munki_request(url, serial_number="12345678")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(plistlib.loads(response.content), catalog_content)
+
     # manifest
 
+    def test_manifest_etag_not_modified(self):
+        self._force_smpi()
+        url = reverse("monolith_public:repository_manifest", args=("12345678",))
+        response = self._make_munki_request(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        response = self._make_munki_request(url, if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.manifest.bump_version()
+        response = self._make_munki_request(url, if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
     def test_manifest(self):
         _, catalog, sub_manifest = self._force_smpi(
             name="ceci_n_est_pas_un_nom_aussi"
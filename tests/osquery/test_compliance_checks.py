@@ -3,7 +3,9 @@ from django.test import TestCase
 from django.utils.crypto import get_random_string
 from django.utils.text import slugify
 from zentral.core.compliance_checks.models import MachineStatus, Status
-from zentral.contrib.osquery.compliance_checks import ComplianceCheckStatusAggregator, sync_query_compliance_check
+from zentral.contrib.osquery.compliance_checks import (ComplianceCheckStatusAggregator,
+                                                       MachinesComplianceCheckStatusAggregator,
+                                                       sync_query_compliance_check)
 from zentral.contrib.osquery.events import OsqueryCheckStatusUpdated
 from zentral.contrib.osquery.models import DistributedQuery, Pack, PackQuery, Query
 
@@ -318,3 +320,57 @@ class OsqueryComplianceChecksTestCase(TestCase):
         self.assertEqual(ms2.compliance_check_version, query2.compliance_check.version)
         self.assertEqual(ms2.status, Status.FAILED.value)
         self.assertEqual(ms2.status_time, status_time2)
+
+    def test_multiple_machines_compliance_checks(self):
+        query1, pack, _ = self._force_query(force_pack=True, force_compliance_check=True)
+        query2, _, distributed_query = self._force_query(force_compliance_check=True, force_distributed_query=True)
+        query3, _, _ = self._force_query(force_pack=True)  # no compliance check
+        serial_numbers = [get_random_string(12) for _ in range(3)]
+        MachineStatus.objects.create(
+            serial_number=serial_numbers[0],
+            compliance_check=query1.compliance_check,
+            compliance_check_version=query1.compliance_check.version,
+            status=Status.OK.value,
+            status_time=datetime(2001, 1, 1)
+        )
+        cc_status_agg = MachinesComplianceCheckStatusAggregator()
+        status_time = datetime.utcnow()
+        for serial_number in serial_numbers:
+            cc_status_agg.add_machine_result(serial_number, query1.pk, query1.version, status_time,
+                                             [{"ztl_status": Status.OK.name}])
+            cc_status_agg.add_machine_result(serial_number, query2.pk, query2.version, status_time,
+                                             [{"ztl_status": Status.FAILED.name}], distributed_query.pk)
+            cc_status_agg.add_machine_result(serial_number, query3.pk, query3.version, status_time,
+                                             [{"ztl_status": Status.OK.name}])
+        # outdated
+        cc_status_agg.add_machine_result(get_random_string(12), query1.pk, query1.version - 1, status_time,
+                                         [{"ztl_status": Status.OK.name}])
+        with self.assertNumQueries(4):  # queries, pack queries, packs, statuses upsert
+            events = list(cc_status_agg.commit())
+        # no status update for query1 on the first machine
+        self.assertEqual(len(events), 5)
+        self.assertEqual(
+            sorted((e.metadata.machine_serial_number, e.payload["osquery_query"]["pk"], e.payload["status"])
+                   for e in events),
+            sorted([(sn, query1.pk, Status.OK.name) for sn in serial_numbers[1:]]
+                   + [(sn, query2.pk, Status.FAILED.name) for sn in serial_numbers])
+        )
+        for event in events:
+            self.assertIsInstance(event, OsqueryCheckStatusUpdated)
+            self.assertEqual(event.metadata.created_at, status_time)
+            if event.payload["osquery_query"]["pk"] == query1.pk:
+                self.assertEqual(event.payload["osquery_pack"], {"pk": pack.pk, "name": pack.name})
+            else:
+                self.assertEqual(event.payload["osquery_run"], {"pk": distributed_query.pk})
+        self.assertEqual(MachineStatus.objects.filter(serial_number__in=serial_numbers).count(), 6)
+        ms = MachineStatus.objects.get(serial_number=serial_numbers[0], compliance_check=query1.compliance_check)
+        self.assertEqual(ms.status_time, status_time)
+        self.assertEqual(ms.previous_status, Status.OK.value)
+
+    def test_multiple_machines_no_compliance_checks(self):
+        query, _, _ = self._force_query(force_pack=True)
+        cc_status_agg = MachinesComplianceCheckStatusAggregator()
+        cc_status_agg.add_machine_result(get_random_string(12), query.pk, query.version, datetime.utcnow(),
+                                         [{"ztl_status": Status.OK.name}])
+        with self.assertNumQueries(1):
+            self.assertEqual(list(cc_status_agg.commit()), [])
@@ -0,0 +1,142 @@
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils.crypto import get_random_string
+from django.utils.text import slugify
+from zentral.contrib.inventory.models import EnrollmentSecret, MachineTag, MetaBusinessUnit, MetaMachine, Tag
+from zentral.contrib.osquery.conf import build_osquery_conf, get_cached_osquery_conf, get_configuration_version
+from zentral.contrib.osquery.models import (Configuration, ConfigurationPack, Enrollment, FileCategory,
+                                            Pack, PackQuery, Query)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class OsqueryConfCacheTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.configuration = Configuration.objects.create(name=get_random_string(12))
+        cls.meta_business_unit = MetaBusinessUnit.objects.create(name=get_random_string(12))
+        enrollment_secret = EnrollmentSecret.objects.create(meta_business_unit=cls.meta_business_unit)
+        cls.enrollment = Enrollment.objects.create(configuration=cls.configuration,
+                                                   secret=enrollment_secret)
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    # utility methods
+
+    def force_pack(self, tag=None):
+        query = Query.objects.create(name=get_random_string(12), sql="select 1 from processes;")
+        pack_name = get_random_string(12)
+        pack = Pack.objects.create(name=pack_name, slug=slugify(pack_name))
+        pack_query = PackQuery.objects.create(pack=pack, query=query, interval=12983, slug=slugify(query.name))
+        configuration_pack = ConfigurationPack.objects.create(configuration=self.configuration, pack=pack)
+        if tag:
+            configuration_pack.tags.add(tag)
+        return query, pack, pack_query, configuration_pack
+
+    def get_enrollment(self):
+        # fresh enrollment & configuration, like in the public views
+        return Enrollment.objects.select_related("configuration").get(pk=self.enrollment.pk)
+
+    def get_conf(self, serial_number):
+        return get_cached_osquery_conf(MetaMachine(serial_number), self.get_enrollment())
+
+    # tests
+
+    def test_configuration_version(self):
+        version = get_configuration_version(self.configuration.pk)
+        self.assertEqual(get_configuration_version(self.configuration.pk), version)
+        self.configuration.save()
+        self.assertNotEqual(get_configuration_version(self.configuration.pk), version)
+
+    def test_cached_conf(self):
+        self.force_pack()
+        serial_number = get_random_string(12)
+        enrollment = self.get_enrollment()
+        conf = get_cached_osquery_conf(MetaMachine(serial_number), enrollment)
+        self.assertEqual(conf, build_osquery_conf(MetaMachine(serial_number), enrollment))
+        with self.assertNumQueries(2):  # machine tags & platform, no configuration queries
+            self.assertEqual(get_cached_osquery_conf(MetaMachine(serial_number), enrollment), conf)
+
+    def test_configuration_change(self):
+        serial_number = get_random_string(12)
+        conf = self.get_conf(serial_number)
+        self.assertIn("schedule", conf)
+        self.configuration.inventory = False
+        self.configuration.save()
+        conf = self.get_conf(serial_number)
+        self.assertNotIn("schedule", conf)
+
+    def test_pack_query_change(self):
+        _, pack, pack_query, _ = self.force_pack()
+        serial_number = get_random_string(12)
+        conf = self.get_conf(serial_number)
+        self.assertEqual(
+            [q["interval"] for q in conf["packs"][pack.configuration_key()]["queries"].values()],
+            [12983]
+        )
+        pack_query.interval = 3600
+        pack_query.save()
+        conf = self.get_conf(serial_number)
+        self.assertEqual(
+            [q["interval"] for q in conf["packs"][pack.configuration_key()]["queries"].values()],
+            [3600]
+        )
+
+    def test_query_change(self):
+        query, pack, _, _ = self.force_pack()
+        serial_number = get_random_string(12)
+        self.get_conf(serial_number)
+        query.sql = "select 2 from processes;"
+        query.version += 1
+        query.save()
+        conf = self.get_conf(serial_number)
+        self.assertEqual(
+            [q["query"] for q in conf["packs"][pack.configuration_key()]["queries"].values()],
+            ["select 2 from processes;"]
+        )
+
+    def test_pack_delete(self):
+        _, pack, _, _ = self.force_pack()
+        serial_number = get_random_string(12)
+        self.assertIn(pack.configuration_key(), self.get_conf(serial_number)["packs"])
+        pack.delete()
+        self.assertNotIn("packs", self.get_conf(serial_number))
+
+    def test_file_category_change(self):
+        file_category_name = get_random_string(12)
+        file_category = FileCategory.objects.create(name=file_category_name,
+                                                    slug=slugify(file_category_name),
+                                                    file_paths=["/home/%/.ssh/%%"])
+        serial_number = get_random_string(12)
+        self.assertNotIn("file_paths", self.get_conf(serial_number))
+        self.configuration.file_categories.add(file_category)
+        self.assertEqual(self.get_conf(serial_number)["file_paths"],
+                         {file_category.slug: ["/home/%/.ssh/%%"]})
+        file_category.file_paths = ["/root/.ssh/%%"]
+        file_category.save()
+        self.assertEqual(self.get_conf(serial_number)["file_paths"],
+                         {file_category.slug: ["/root/.ssh/%%"]})
+        file_category.delete()
+        self.assertNotIn("file_paths", self.get_conf(serial_number))
+
+    def test_machine_tags(self):
+        tag = Tag.objects.create(name=get_random_string(12))
+        _, pack, _, _ = self.force_pack(tag=tag)
+        serial_number = get_random_string(12)
+        self.assertNotIn("packs", self.get_conf(serial_number))
+        MachineTag.objects.create(serial_number=serial_number, tag=tag)
+        self.assertIn(pack.configuration_key(), self.get_conf(serial_number)["packs"])
+        # other machine without the tag
+        self.assertNotIn("packs", self.get_conf(get_random_string(12)))
+
+    def test_configuration_pack_tags_change(self):
+        tag = Tag.objects.create(name=get_random_string(12))
+        _, pack, _, configuration_pack = self.force_pack()
+        serial_number = get_random_string(12)
+        self.assertIn(pack.configuration_key(), self.get_conf(serial_number)["packs"])
+        configuration_pack.tags.add(tag)
+        self.assertNotIn("packs", self.get_conf(serial_number))
+        # the tag is deleted, the configuration pack is not scoped anymore
+        tag.delete()
+        self.assertIn(pack.configuration_key(), self.get_conf(serial_number)["packs"])
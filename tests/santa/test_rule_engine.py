@@ -462,6 +462,27 @@ class SantaRuleEngineTestCase(TestCase):
         self.assertIsNone(response_cursor)
         self.assertEqual(machine_rule_qs.filter(cursor__isnull=True).count(), 6)
 
+    def test_next_rule_batch_query_count(self):
+        for _ in range(10):
+            self.create_rule()
+        enrolled_machine = EnrolledMachine.objects.select_related("enrollment__configuration").get(
+            pk=self.enrolled_machine.pk
+        )
+        # cleanup, next rules, machine rules
+        with self.assertNumQueries(3):
+            rule_batch, response_cursor = MachineRule.objects.get_next_rule_batch(enrolled_machine, [])
+        self.assertEqual(len(rule_batch), 5)
+        # cleanup, acknowledgement, next rules, machine rules
+        with self.assertNumQueries(4):
+            rule_batch, response_cursor = MachineRule.objects.get_next_rule_batch(
+                enrolled_machine, [],
+                response_cursor
+            )
+        self.assertEqual(len(rule_batch), 5)
+        machine_rule_qs = self.enrolled_machine.machinerule_set.all()
+        self.assertEqual(machine_rule_qs.filter(cursor__isnull=True).count(), 5)
+        self.assertEqual(machine_rule_qs.filter(cursor=response_cursor).count(), 5)
+
     def test_lost_response_batch_pagination(self):
         serialized_rules = []
         for _ in range(11):
@@ -0,0 +1,82 @@
+import copy
+from datetime import datetime, timezone
+import random
+from django.test import SimpleTestCase
+from zentral.contrib.inventory.management.commands.benchmark_tree_hashing import (
+    build_machine_snapshot_tree, legacy_prepare_commit_tree
+)
+from zentral.utils.mt_models import MTOError, prepare_commit_tree
+
+
+class PrepareCommitTreeTestCase(SimpleTestCase):
+    def assert_same_as_legacy(self, tree):
+        legacy_tree = copy.deepcopy(tree)
+        legacy_prepare_commit_tree(legacy_tree)
+        prepare_commit_tree(tree)
+        self.assertEqual(tree, legacy_tree)
+        return tree
+
+    def test_same_as_legacy(self):
+        tree = self.assert_same_as_legacy({
+            "source": {"module": "tests.zentral.io", "name": "Yolo"},
+            "serial_number": "0123456789",
+            "empty_str": "",
+            "none": None,
+            "empty_list": [],
+            "empty_dict": {},
+            "int": 42,
+            "bool": True,
+            "naive_datetime": datetime(2024, 1, 2, 3, 4, 5),
+            "aware_datetime": datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc),
+            "scalars": [1, 1.5, "un", "un", datetime(2024, 1, 1), datetime(2024, 1, 1, tzinfo=timezone.utc)],
+            "subtrees": [{"name": "un", "sub": {"name": "deux", "empty": None}},
+                         {"name": "deux", "sub": {"name": "deux"}}],
+        })
+        for key in ("none", "empty_list", "empty_dict"):
+            self.assertNotIn(key, tree)
+        self.assertEqual(tree["aware_datetime"], datetime(2024, 1, 2, 3, 4, 5))
+        self.assertNotIn("empty", tree["subtrees"][0]["sub"])
+        # identical subtrees, same hashes
+        self.assertEqual(tree["subtrees"][0]["sub"]["mt_hash"], tree["subtrees"][1]["sub"]["mt_hash"])
+
+    def test_same_as_legacy_machine_snapshot_trees(self):
+        rng = random.Random(0)
+        for app_count in (0, 1, 20):
+            self.assert_same_as_legacy(build_machine_snapshot_tree(rng, app_count, 5))
+
+    def test_list_item_order(self):
+        tree1 = {"un": ["a", "b"]}
+        tree2 = {"un": ["b", "a"]}
+        prepare_commit_tree(tree1)
+        prepare_commit_tree(tree2)
+        self.assertNotEqual(tree1["mt_hash"], tree2["mt_hash"])
+
+    def test_existing_mt_hash(self):
+        tree = {"mt_hash": "yolo", "un": 1, "deux": None}
+        prepare_commit_tree(tree)
+        self.assertEqual(tree, {"mt_hash": "yolo", "un": 1, "deux": None})
+
+    def test_not_a_dict(self):
+        with self.assertRaises(MTOError) as cm:
+            prepare_commit_tree([{"un": 1}])
+        self.assertEqual(cm.exception.message, "Commit tree is not a dict")
+
+    def test_duplicated_subtree(self):
+        with self.assertRaises(MTOError) as cm:
+            prepare_commit_tree({"un": [{"deux": 2}, {"trois": 3}, {"deux": 2}]})
+        self.assertEqual(cm.exception.message, "Duplicated subtree in key un")
+
+    def test_unsupported_list_item(self):
+        with self.assertRaises(MTOError) as cm:
+            prepare_commit_tree({"un": [[1]]})
+        self.assertEqual(cm.exception.message, "Unsupported list item type")
+
+    def test_invalid_field_value(self):
+        with self.assertRaises(ValueError) as cm:
+            prepare_commit_tree({"un": 1.5})
+        self.assertEqual(cm.exception.args[0], "Invalid field value 1.5 for field un")
+
+    def test_invalid_field_name(self):
+        with self.assertRaises(ValueError) as cm:
+            prepare_commit_tree({1: "un"})
+        self.assertEqual(cm.exception.args[0], "Invalid field name 1")
@@ -4,7 +4,7 @@ from django import forms
 from django.utils.text import slugify
 from django.utils.translation import gettext_lazy as _
 from zentral.core.actions.backends.base import BaseAction, BaseActionForm
-from zentral.contrib.inventory.models import Tag, MachineTag
+from zentral.contrib.inventory.models import Tag, MachineTag, MetaMachine
 
 logger = logging.getLogger('zentral.contrib.inventory.actions.machine_tag')
 
@@ -95,6 +95,7 @@ class Action(BaseAction):
                 MachineTag.objects.get_or_create(serial_number=msn, tag=tag)
             elif action == ACTION_REMOVE_TAG:
                 MachineTag.objects.filter(serial_number=msn, tag=tag).delete()
+                MetaMachine.invalidate_cached_info_on_commit(msn)
             else:
                 raise ValueError("Unknown action '%s' in machine tag action %s of probe %s",
                                  action, self.name, probe.name)
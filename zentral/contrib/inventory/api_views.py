@@ -17,6 +17,7 @@ from .models import (CurrentMachineSnapshot,
                      MachineSnapshot,
                      MachineTag,
                      MetaBusinessUnit,
+                     MetaMachine,
                      Tag, Taxonomy)
 from .serializers import (CleanupInventorySerializer,
                           JMESPathCheckSerializer,
@@ -125,6 +126,9 @@ class UpdateMachineTags(APIView):
             removed, _ = MachineTag.objects.filter(serial_number=serial_number,
                                                    tag__name__in=self.tags_to_remove).delete()
             total_removed += removed
+        if total_removed:
+            # the queryset deletions do not send post_delete signals
+            MetaMachine.invalidate_cached_info_on_commit(serial_number)
         return total_removed, total_added
 
     def post(self, request, *args, **kwargs):
@@ -1,6 +1,7 @@
 import logging
 import threading
 import time
+from django.db import connection
 from django.utils.functional import cached_property, SimpleLazyObject
 import jmespath
 from zentral.core.compliance_checks import register_compliance_check_class
@@ -17,23 +18,31 @@ logger = logging.getLogger("zentral.contrib.inventory.compliance_checks")
 class InventoryJMESPathCheck(BaseComplianceCheck):
     model_display = "Inventory JMESPath check"
     required_view_permissions = ("inventory.view_jmespathcheck",)
-    scoped_cc_query = (
-        "select cc.model, cc.id, cc.name, cc.version "
+    tag_scoped_cc_query = (
+        "select cc.model, cc.id, jsonb_build_array(lower(jc.source_name), jc.platforms) "
         "from compliance_checks_compliancecheck as cc "
         "join inventory_jmespathcheck as jc on (jc.compliance_check_id = cc.id) "
         "left join inventory_jmespathcheck_tags as jct on (jct.jmespathcheck_id = jc.id) "
-        "where (jct.tag_id is null or jct.tag_id = any (%(tag_ids)s)) "
-        "and lower(jc.source_name) in ("
-        " select distinct lower(s.name)"
-        " from inventory_source as s"
-        " join inventory_currentmachinesnapshot as cms on (cms.source_id = s.id)"
-        " where cms.serial_number = %(serial_number)s"
-        ") and jc.platforms && array("
-        " select platform from inventory_machinesnapshot as ms"
-        " join inventory_currentmachinesnapshot as cms on (cms.machine_snapshot_id = ms.id)"
-        " where cms.serial_number = %(serial_number)s"
-        ")"
+        "where jct.tag_id is null or jct.tag_id = any (%(tag_ids)s)"
     )
+    machine_sources_platforms_query = (
+        "select lower(s.name), ms.platform "
+        "from inventory_currentmachinesnapshot as cms "
+        "join inventory_source as s on (cms.source_id = s.id) "
+        "join inventory_machinesnapshot as ms on (cms.machine_snapshot_id = ms.id) "
+        "where cms.serial_number = %s"
+    )
+
+    @classmethod
+    def filter_machine_scoped_cc_ids(cls, serial_number, scoped_ccs, machine_statuses):
+        # only the compliance checks matching the sources and platforms of the machine
+        with connection.cursor() as cursor:
+            cursor.execute(cls.machine_sources_platforms_query, [serial_number])
+            rows = cursor.fetchall()
+        source_names = {source_name for source_name, _ in rows}
+        platforms = {platform for _, platform in rows if platform}
+        return {cc_pk for cc_pk, (source_name, cc_platforms) in scoped_ccs
+                if source_name in source_names and platforms.intersection(cc_platforms)}
 
     @cached_property
     def jmespath_check(self):
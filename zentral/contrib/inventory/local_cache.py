@@ -0,0 +1,124 @@
+from collections import OrderedDict
+import logging
+import threading
+import time
+import weakref
+from django.db import connection
+from zentral.conf import settings
+from zentral.utils.pg_notifications import PostgresNotificationListener
+
+
+logger = logging.getLogger("zentral.contrib.inventory.local_cache")
+
+
+postgresql_channel = "machine_change"
+
+
+class MachineLocalCache:
+    """Bounded, process-local LRU cache for the machine info used in the event pipeline.
+
+    The cached values are shared, and must be treated as read-only.
+    The entries are invalidated using the PostgreSQL machine change notifications.
+    """
+
+    def __init__(self, max_size=10000, max_age=60, with_sync=True):
+        self.max_size = max_size
+        self.max_age = max_age
+        self.with_sync = with_sync
+        self.sync = None
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _start_sync(self):
+        if self.with_sync:
+            if self.sync is not None:
+                if self.sync.is_alive():
+                    return
+                else:
+                    logger.error("Sync thread is not alive. Last heartbeat %s.", self.sync.last_heartbeat or "-")
+            # separate thread to listen to the machine change signal
+            self.sync = MachineLocalCacheSync(self)
+            self.sync.start()
+
+    def get(self, serial_number, key):
+        self._start_sync()
+        with self._lock:
+            values = self._items.get(serial_number)
+            if values is None:
+                return
+            try:
+                ts, value = values[key]
+            except KeyError:
+                return
+            if time.monotonic() - ts > self.max_age:
+                del values[key]
+                return
+            self._items.move_to_end(serial_number)
+            return value
+
+    def set(self, serial_number, key, value):
+        with self._lock:
+            self._items.setdefault(serial_number, {})[key] = (time.monotonic(), value)
+            self._items.move_to_end(serial_number)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def invalidate(self, serial_number):
+        with self._lock:
+            self._items.pop(serial_number, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+
+class MachineLocalCacheSync(PostgresNotificationListener):
+    def __init__(self, local_cache):
+        self.local_cache = weakref.ref(local_cache)
+        super().__init__(postgresql_channel, self._process_notifications)
+
+    def _process_notifications(self, payloads):
+        local_cache = self.local_cache()
+        if local_cache is None:
+            logger.error("Could not get local cache.")
+            return False
+        if payloads is None:
+            logger.info("DB error recovery. Clear local cache.")
+            local_cache.clear()
+            return
+        for payload in payloads:
+            if payload:
+                logger.debug("Received notification on channel '%s' for machine %s", postgresql_channel, payload)
+                local_cache.invalidate(payload)
+            else:
+                logger.info("Received notification on channel '%s' for all machines", postgresql_channel)
+                local_cache.clear()
+
+
+def signal_machine_change(serial_number=None):
+    """Notify the local caches that the machine info has changed.
+
+    Without a serial number, all the local cache entries are invalidated.
+    The notification is only delivered when the current transaction is committed.
+    """
+    try:
+        cur = connection.cursor()
+        cur.execute('SELECT pg_notify(%s, %s)', [postgresql_channel, serial_number or ""])
+    except Exception as db_err:
+        logger.error("Could not signal machine change: %s", db_err)
+        connection.close_if_unusable_or_obsolete()
+
+
+def get_machine_local_cache():
+    config = settings["apps"]["zentral.contrib.inventory"].get("local_machine_cache")
+    if not config:
+        return
+    return MachineLocalCache(max_size=int(config.get("max_size", 10000)),
+                             max_age=int(config.get("max_age", 60)))
+
+
+machine_local_cache = get_machine_local_cache()
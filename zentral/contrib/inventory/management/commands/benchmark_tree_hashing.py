@@ -0,0 +1,175 @@
+import copy
+from datetime import datetime, timedelta, timezone
+import hashlib
+import random
+import time
+import uuid
+from django.core.management.base import BaseCommand
+from django.utils.timezone import is_aware, make_naive
+from zentral.utils.mt_models import Hasher, MTOError, prepare_commit_tree
+
+
+def random_hex(rng, length):
+    return "".join(rng.choice("0123456789abcdef") for _ in range(length))
+
+
+def build_certificate(rng, common_name, signed_by=None):
+    certificate = {"common_name": common_name,
+                   "organization": "Example Inc.",
+                   "organizational_unit": random_hex(rng, 10).upper(),
+                   "sha_1": random_hex(rng, 40),
+                   "sha_256": random_hex(rng, 64),
+                   "valid_from": datetime(2020, 1, 1, tzinfo=timezone.utc) + timedelta(days=rng.randrange(365)),
+                   "valid_until": datetime(2030, 1, 1, tzinfo=timezone.utc) + timedelta(days=rng.randrange(365))}
+    if signed_by:
+        certificate["signed_by"] = signed_by
+    return certificate
+
+
+def build_machine_snapshot_tree(rng, app_count, profile_count):
+    serial_number = random_hex(rng, 12).upper()
+    source = {"module": "zentral.contrib.osquery", "name": "osquery"}
+    root_ca = build_certificate(rng, "Apple Root CA")
+    intermediate_cas = [build_certificate(rng, f"Developer ID Certification Authority {i}", copy.deepcopy(root_ca))
+                        for i in range(3)]
+    tree = {
+        "source": source,
+        "reference": serial_number,
+        "serial_number": serial_number,
+        "business_unit": {"name": "Example", "reference": "example", "source": copy.deepcopy(source)},
+        "os_version": {"name": "macOS", "major": 14, "minor": rng.randrange(7), "patch": rng.randrange(3),
+                       "build": "23G93"},
+        "system_info": {"computer_name": f"mac-{serial_number}", "hardware_model": "MacBookPro18,3",
+                        "cpu_brand": "Apple M1 Pro", "cpu_physical_cores": 10, "cpu_logical_cores": 10,
+                        "physical_memory": 34359738368},
+        "network_interfaces": [{"interface": f"en{i}", "mac": ":".join(random_hex(rng, 2) for _ in range(6)),
+                                "address": f"192.168.{rng.randrange(256)}.{rng.randrange(256)}",
+                                "mask": "255.255.255.0", "broadcast": "192.168.1.255"}
+                               for i in range(4)],
+        "osx_app_instances": [
+            {"app": {"bundle_id": f"com.example.app{i}",
+                     "bundle_name": f"App{i}.app",
+                     "bundle_display_name": f"App {i}",
+                     "bundle_version": str(rng.randrange(1000)),
+                     "bundle_version_str": f"{rng.randrange(10)}.{rng.randrange(10)}.{rng.randrange(10)}"},
+             "bundle_path": f"/Applications/App{i}.app",
+             "path": f"/Applications/App{i}.app/Contents/MacOS/App{i}",
+             "sha_1": random_hex(rng, 40),
+             "sha_256": random_hex(rng, 64),
+             # the signing chains are repeated in the tree
+             "signed_by": build_certificate(rng, f"Developer ID Application: Example {i % 20}",
+                                            copy.deepcopy(rng.choice(intermediate_cas)))}
+            for i in range(app_count)
+        ],
+        "profiles": [
+            {"uuid": str(uuid.UUID(int=rng.getrandbits(128))),
+             "identifier": f"com.example.profile{i}",
+             "display_name": f"Profile {i}",
+             "description": "Example profile " * 4,
+             "organization": "Example Inc.",
+             "removal_disallowed": rng.choice([True, False]),
+             "verified": True,
+             "install_date": datetime(2023, 1, 1) + timedelta(minutes=rng.randrange(100000)),
+             "payloads": [{"uuid": str(uuid.UUID(int=rng.getrandbits(128))),
+                           "identifier": f"com.example.profile{i}.payload{j}",
+                           "display_name": f"Payload {j}",
+                           "type": rng.choice(["com.apple.security.pkcs1", "com.apple.wifi.managed",
+                                               "com.apple.TCC.configuration-profile-policy"])}
+                          for j in range(rng.randrange(1, 5))],
+             "signed_by": copy.deepcopy(rng.choice(intermediate_cas))}
+            for i in range(profile_count)
+        ],
+        "extra_facts": {"groups": ["admin", "staff", "everyone"], "uptime_days": rng.randrange(30),
+                        "disk_encryption": {"enabled": "true", "recovery_keys": ["personal", "institutional"]}},
+    }
+    return tree
+
+
+def legacy_prepare_commit_tree(tree):
+    # prepare_commit_tree before the single pass hasher
+    if not isinstance(tree, dict):
+        raise MTOError("Commit tree is not a dict")
+    if tree.get('mt_hash', None):
+        return
+    h = Hasher()
+    for k, v in list(tree.items()):
+        if h.is_empty_value(v):
+            tree.pop(k)
+        else:
+            if isinstance(v, dict):
+                legacy_prepare_commit_tree(v)
+                v = v['mt_hash']
+            elif isinstance(v, list):
+                hash_list = []
+                for item_idx, item in enumerate(v):
+                    if isinstance(item, dict):
+                        legacy_prepare_commit_tree(item)
+                        subtree_mt_hash = item['mt_hash']
+                        if subtree_mt_hash in hash_list:
+                            raise MTOError("Duplicated subtree in key {}".format(k))
+                        else:
+                            hash_list.append(subtree_mt_hash)
+                    else:
+                        if isinstance(item, int):
+                            item_to_hash = "i∅" + str(item)
+                        elif isinstance(item, float):
+                            item_to_hash = "f∅" + str(item)
+                        elif isinstance(item, datetime):
+                            if is_aware(item):
+                                item = make_naive(item)
+                            item_to_hash = "d∅" + item.isoformat()
+                        elif isinstance(item, str):
+                            item_to_hash = "s∅" + item
+                        else:
+                            raise MTOError("Unsupported list item type")
+                        item_to_hash = str(item_idx) + item_to_hash  # order is important
+                        hash_list.append(hashlib.sha1(item_to_hash.encode('utf-8')).hexdigest())
+                v = hash_list
+            elif isinstance(v, datetime) and is_aware(v):
+                tree[k] = v = make_naive(v)
+            h.add_field(k, v)
+    tree['mt_hash'] = h.hexdigest()
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the machine snapshot tree hashing, legacy hasher vs. single pass hasher'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--app-counts', type=int, nargs="+", default=[50, 500, 2000])
+        parser.add_argument('--profile-count', type=int, default=200)
+        parser.add_argument('--tree-count', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def run_benchmark(self, trees, func):
+        # deep copies made before the timing, the trees are modified in place
+        trees = copy.deepcopy(trees)
+        start = time.perf_counter()
+        for tree in trees:
+            func(tree)
+        return len(trees) / (time.perf_counter() - start), [tree["mt_hash"] for tree in trees]
+
+    def handle(self, **options):
+        rng = random.Random(options["seed"])
+        self.stdout.write(f"{options['tree_count']} trees per size, "
+                          f"{options['profile_count']} profiles per tree")
+        self.stdout.write(f"{'apps':>6} {'nodes':>7} {'legacy trees/s':>15} {'single pass trees/s':>20} "
+                          f"{'speedup':>8}")
+        for app_count in options["app_counts"]:
+            trees = [build_machine_snapshot_tree(rng, app_count, options["profile_count"])
+                     for _ in range(options["tree_count"])]
+            legacy_tps, legacy_hashes = self.run_benchmark(trees, legacy_prepare_commit_tree)
+            tps, hashes = self.run_benchmark(trees, prepare_commit_tree)
+            if legacy_hashes != hashes:
+                self.stderr.write("Hash mismatch")
+            nodes = self.count_nodes(trees[0])
+            self.stdout.write(f"{app_count:>6} {nodes:>7} {legacy_tps:>15.1f} {tps:>20.1f} "
+                              f"{tps / legacy_tps:>7.1f}x")
+
+    def count_nodes(self, tree):
+        count = 1
+        for v in tree.values():
+            if isinstance(v, dict):
+                count += self.count_nodes(v)
+            elif isinstance(v, list):
+                count += sum(self.count_nodes(i) for i in v if isinstance(i, dict))
+        return count
@@ -14,6 +14,8 @@ from django.urls import reverse
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import connection, IntegrityError, models, transaction
 from django.db.models import Count, F, Q, Max
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.crypto import get_random_string
 from django.utils.functional import cached_property
@@ -21,6 +23,7 @@ from django.utils.text import slugify
 from django.utils.timesince import timesince
 from django.utils.translation import gettext_lazy as _
 from zentral.conf import settings
+from zentral.core.compliance_checks.cache import bump_scoped_cc_version
 from zentral.core.compliance_checks.utils import get_machine_compliance_check_statuses
 from zentral.core.incidents.models import MachineIncident, Status
 from zentral.utils.model_extras import find_all_related_objects
@@ -32,6 +35,7 @@ from .conf import (has_deb_packages,
                    PLATFORM_CHOICES, PLATFORM_CHOICES_DICT,
                    TYPE_CHOICES, TYPE_CHOICES_DICT)
 from .exceptions import EnrollmentSecretVerificationFailed
+from .local_cache import machine_local_cache, signal_machine_change
 
 logger = logging.getLogger('zentral.contrib.inventory.models')
 
@@ -666,7 +670,11 @@ class MachineSnapshot(AbstractMTObject):
 
 
 class MachineSnapshotCommitManager(models.Manager):
-    def commit_machine_snapshot_tree(self, tree):
+    def prepare_machine_snapshot_tree(self, tree):
+        """Pop the commit attributes, and prepare the machine snapshot tree
+
+        Returns the last seen and system uptime of the commit.
+        """
         last_seen = tree.pop('last_seen', None)
         if not last_seen:
             last_seen = datetime.utcnow()
@@ -675,7 +683,52 @@ class MachineSnapshotCommitManager(models.Manager):
         system_uptime = tree.pop('system_uptime', None)
         update_ms_tree_platform(tree)
         update_ms_tree_type(tree)
-        machine_snapshot, _ = MachineSnapshot.objects.commit(tree)
+        prepare_commit_tree(tree)
+        return last_seen, system_uptime
+
+    def refresh_current_machine_snapshot_commit(self, msc_pk, machine_snapshot, last_seen, system_uptime):
+        """Refresh the last seen and system uptime of the current machine snapshot commit, in place
+
+        Only applied if the commit is still the latest one for the machine snapshot source,
+        and if its machine snapshot is still the current one.
+        Returns a (applied, previous last seen) tuple.
+        """
+        query = (
+            "with updated_cms as ("
+            " update inventory_currentmachinesnapshot set last_seen = %(last_seen)s"
+            " where serial_number = %(serial_number)s and source_id = %(source_id)s"
+            " and machine_snapshot_id = %(machine_snapshot_id)s"
+            " returning id"
+            ") update inventory_machinesnapshotcommit as msc "
+            "set last_seen = %(last_seen)s, system_uptime = %(system_uptime)s "
+            "from inventory_machinesnapshotcommit as pmsc "
+            "where msc.id = %(msc_pk)s and pmsc.id = msc.id "
+            "and msc.machine_snapshot_id = %(machine_snapshot_id)s "
+            "and exists (select 1 from updated_cms) "
+            "and not exists ("
+            " select 1 from inventory_machinesnapshotcommit as nmsc"
+            " where nmsc.serial_number = msc.serial_number and nmsc.source_id = msc.source_id"
+            " and nmsc.version > msc.version"
+            ") returning pmsc.last_seen"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(query, {"last_seen": last_seen,
+                                   "system_uptime": system_uptime,
+                                   "serial_number": machine_snapshot.serial_number,
+                                   "source_id": machine_snapshot.source_id,
+                                   "machine_snapshot_id": machine_snapshot.pk,
+                                   "msc_pk": msc_pk})
+            row = cursor.fetchone()
+        if row is None:
+            return False, None
+        return True, row[0]
+
+    def commit_machine_snapshot_tree(self, tree):
+        last_seen, system_uptime = self.prepare_machine_snapshot_tree(tree)
+        return self.commit_prepared_machine_snapshot_tree(tree, last_seen, system_uptime)
+
+    def commit_prepared_machine_snapshot_tree(self, tree, last_seen, system_uptime):
+        machine_snapshot, _ = MachineSnapshot.objects.bulk_commit(tree)
         serial_number = machine_snapshot.serial_number
         source = machine_snapshot.source
         new_version = new_parent = None
@@ -686,12 +739,15 @@ class MachineSnapshotCommitManager(models.Manager):
                                                                source=source).order_by('-version')[0]
                 except IndexError:
                     new_version = 1
+                    MetaMachine.invalidate_cached_info_on_commit(serial_number)
                 else:
                     if msc.machine_snapshot != machine_snapshot \
                        or msc.last_seen != last_seen \
                        or msc.system_uptime != system_uptime:
                         new_version = msc.version + 1
                         new_parent = msc
+                    if msc.machine_snapshot != machine_snapshot:
+                        MetaMachine.invalidate_cached_info_on_commit(serial_number)
                 new_msc = None
                 if new_version:
                     new_msc = MachineSnapshotCommit.objects.create(serial_number=serial_number,
@@ -923,6 +979,10 @@ class MetaBusinessUnitTag(models.Model):
     tag = models.ForeignKey(Tag, on_delete=models.CASCADE)
 
 
+# version of the shared cached machine info, bumped when all the machines are affected
+MACHINE_INFO_VERSION_CACHE_KEY = "mm-version"
+
+
 class MetaMachine:
     """Simplified access to the ms."""
     def __init__(self, serial_number, snapshots=None):
@@ -1115,6 +1175,7 @@ class MetaMachine:
             tag_names_to_delete = existing_tag_names - tag_names
             if tag_names_to_delete:
                 existing_machine_tags.filter(tag__name__in=tag_names_to_delete).delete()
+                MetaMachine.invalidate_cached_info_on_commit(self.serial_number)
             # add missing tags
             for tag_name in tag_names - existing_tag_names:
                 try:
@@ -1280,15 +1341,41 @@ class MetaMachine:
                 tag_ids.add(agg["id"])
         return (platform_fv, type_fv, mbu_ids, tag_ids)
 
+    @staticmethod
+    def _get_cached_info_version():
+        """Returns the current version of the shared cached machine info
+
+        The version is a random token, kept until a change affecting all the machines.
+        """
+        version = cache.get(MACHINE_INFO_VERSION_CACHE_KEY)
+        if version is None:
+            version = get_random_string(12)
+            if not cache.add(MACHINE_INFO_VERSION_CACHE_KEY, version, None):
+                # concurrently set
+                version = cache.get(MACHINE_INFO_VERSION_CACHE_KEY, version)
+        return version
+
+    def get_cache_key(self, cache_key_prefix):
+        return "{}_{}_{}".format(cache_key_prefix, self._get_cached_info_version(), self.get_urlsafe_serial_number())
+
+    def _get_cached_value(self, cache_key_prefix, func):
+        if machine_local_cache is not None:
+            value = machine_local_cache.get(self.serial_number, cache_key_prefix)
+            if value is not None:
+                return value
+        cache_key = self.get_cache_key(cache_key_prefix)
+        value = cache.get(cache_key)
+        if value is None:
+            value = func()
+            cache.set(cache_key, value, 60)  # TODO: Hard coded timeout value
+        if machine_local_cache is not None:
+            machine_local_cache.set(self.serial_number, cache_key_prefix, value)
+        return value
+
     @cached_property
     def cached_probe_filtering_values(self):
         """Cached version of get_probe_filtering_values"""
-        cache_key = "mm-probe-fvs_{}".format(self.get_urlsafe_serial_number())
-        filtering_values = cache.get(cache_key)
-        if filtering_values is None:
-            filtering_values = self.get_probe_filtering_values()
-            cache.set(cache_key, filtering_values, 60)  # TODO: Hard coded timeout value
-        return filtering_values
+        return self._get_cached_value("mm-probe-fvs", self.get_probe_filtering_values)
 
     def get_legacy_serialized_info_for_event(self):
         """Serialize the machine information to be included in the events.
@@ -1362,12 +1449,50 @@ class MetaMachine:
     @cached_property
     def cached_serialized_info_for_event(self):
         """Cached version of get_serialized_info_for_event"""
-        cache_key = "mm-si_{}".format(self.get_urlsafe_serial_number())
-        serialized_info = cache.get(cache_key)
-        if serialized_info is None:
-            serialized_info = self.get_serialized_info_for_event()
-            cache.set(cache_key, serialized_info, 60)  # TODO: Hard coded timeout value
-        return serialized_info
+        return self._get_cached_value("mm-si", self.get_serialized_info_for_event)
+
+    @classmethod
+    def invalidate_cached_info(cls, serial_number=None):
+        """Invalidate the cached machine info
+
+        Without a serial number, the shared cached info of all the machines
+        is invalidated by dropping its version, and the local caches are cleared.
+        Must be called after the changes are committed.
+        """
+        if serial_number:
+            mm = cls(serial_number)
+            cache.delete_many([mm.get_cache_key(cache_key_prefix)
+                               for cache_key_prefix in ("mm-probe-fvs", "mm-si")])
+        else:
+            cache.delete(MACHINE_INFO_VERSION_CACHE_KEY)
+        if machine_local_cache is not None:
+            signal_machine_change(serial_number)
+
+    @classmethod
+    def invalidate_cached_info_on_commit(cls, serial_number=None):
+        transaction.on_commit(lambda: cls.invalidate_cached_info(serial_number))
+
+
+# machine info cache invalidation
+
+
+# no post_delete receiver, to keep the fast queryset deletions.
+# the machine tag deletions are notified by the callers.
+@receiver(post_save, sender=MachineTag)
+def machine_tag_change_signal_handler(sender, instance, **kwargs):
+    MetaMachine.invalidate_cached_info_on_commit(instance.serial_number)
+
+
+@receiver(post_save, sender=BusinessUnit)
+@receiver(post_delete, sender=BusinessUnit)
+@receiver(post_save, sender=MetaBusinessUnit)
+@receiver(post_delete, sender=MetaBusinessUnit)
+@receiver(post_save, sender=MetaBusinessUnitTag)
+@receiver(post_delete, sender=MetaBusinessUnitTag)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def machines_change_signal_handler(sender, instance, **kwargs):
+    MetaMachine.invalidate_cached_info_on_commit()
 
 
 class MACAddressBlockAssignmentOrganization(models.Model):
@@ -1674,3 +1799,20 @@ class JMESPathCheck(models.Model):
             "tags": sorted(str(tag) for tag in self.tags.select_related("taxonomy", "meta_business_unit").all()),
             "jmespath_expression": self.jmespath_expression,
         }
+
+
+# scoped compliance checks cache invalidation
+
+
+@receiver(post_save, sender=JMESPathCheck)
+@receiver(post_delete, sender=JMESPathCheck)
+# the m2m relationships are removed without m2m_changed signals
+@receiver(post_delete, sender=Tag)
+def jmespath_check_change_signal_handler(sender, instance, **kwargs):
+    bump_scoped_cc_version()
+
+
+@receiver(m2m_changed, sender=JMESPathCheck.tags.through)
+def jmespath_check_tags_change_signal_handler(sender, instance, action, **kwargs):
+    if action.startswith("post_"):
+        bump_scoped_cc_version()
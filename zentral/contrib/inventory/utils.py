@@ -1,6 +1,7 @@
 from collections import OrderedDict
 import csv
 from datetime import datetime, timedelta
+import hashlib
 import ipaddress
 from itertools import chain
 import json
@@ -12,6 +13,7 @@ import urllib.parse
 import zipfile
 from dateutil import parser
 from django import forms
+from django.core.cache import cache
 from django.core.files.storage import default_storage
 from django.core.serializers.json import DjangoJSONEncoder
 from django.db import connection, transaction
@@ -2328,17 +2330,63 @@ def inventory_events_from_machine_snapshot_commit(machine_snapshot_commit):
         yield ("inventory_heartbeat", added_last_seen, {'source': source})
 
 
+# unchanged machine snapshot fast path
+
+
+CURRENT_MACHINE_SNAPSHOT_CACHE_TIMEOUT = 86400
+
+
+def _get_current_machine_snapshot_cache_key(serial_number, source_mt_hash):
+    key_hash = hashlib.sha1(f"{serial_number}|{source_mt_hash}".encode("utf-8")).hexdigest()
+    return f"inventory_cms_{key_hash}"
+
+
+def _commit_machine_snapshot_tree(tree):
+    """Commit a machine snapshot tree, with a fast path for the unchanged trees
+
+    The current machine snapshot is cached per serial number and source.
+    If the tree hash is the same, only the last seen & system uptime of the current commit are refreshed.
+    Returns the machine snapshot, the last seen value, and the inventory events.
+    """
+    last_seen, system_uptime = MachineSnapshotCommit.objects.prepare_machine_snapshot_tree(tree)
+    cache_key = _get_current_machine_snapshot_cache_key(tree.get("serial_number"),
+                                                        tree.get("source", {}).get("mt_hash"))
+    current = cache.get(cache_key)
+    if current and current["mt_hash"] == tree["mt_hash"]:
+        machine_snapshot = current["machine_snapshot"]
+        applied, previous_last_seen = MachineSnapshotCommit.objects.refresh_current_machine_snapshot_commit(
+            current["msc_pk"], machine_snapshot, last_seen, system_uptime
+        )
+        if applied:
+            inventory_events = []
+            if previous_last_seen != last_seen:
+                inventory_events.append(("inventory_heartbeat", last_seen, {"source": current["source"]}))
+            return machine_snapshot, last_seen, inventory_events
+    msc, machine_snapshot, last_seen = MachineSnapshotCommit.objects.commit_prepared_machine_snapshot_tree(
+        tree, last_seen, system_uptime
+    )
+    inventory_events = []
+    if msc:
+        inventory_events = inventory_events_from_machine_snapshot_commit(msc)
+        cache.set(cache_key,
+                  {"mt_hash": machine_snapshot.mt_hash,
+                   "msc_pk": msc.pk,
+                   "machine_snapshot": machine_snapshot,
+                   "source": msc.source.serialize()},
+                  CURRENT_MACHINE_SNAPSHOT_CACHE_TIMEOUT)
+    return machine_snapshot, last_seen, inventory_events
+
+
 def commit_machine_snapshot_and_trigger_events(tree):
     try:
-        msc, machine_snapshot, last_seen = MachineSnapshotCommit.objects.commit_machine_snapshot_tree(tree)
+        machine_snapshot, last_seen, inventory_events = _commit_machine_snapshot_tree(tree)
     except Exception:
         logger.exception("Could not commit machine snapshot")
         save_dead_letter(tree, "machine snapshot commit error")
     else:
         # inventory events
-        if msc:
-            for event in iter_inventory_events(msc.serial_number, inventory_events_from_machine_snapshot_commit(msc)):
-                event.post()
+        for event in iter_inventory_events(machine_snapshot.serial_number, inventory_events):
+            event.post()
         # compliance checks
         for event in jmespath_checks_cache.process_tree(tree, last_seen):
             event.post()
@@ -2347,13 +2395,12 @@ def commit_machine_snapshot_and_trigger_events(tree):
 
 def commit_machine_snapshot_and_yield_events(tree):
     try:
-        msc, _, last_seen = MachineSnapshotCommit.objects.commit_machine_snapshot_tree(tree)
+        machine_snapshot, last_seen, inventory_events = _commit_machine_snapshot_tree(tree)
     except Exception:
         logger.exception("Could not commit machine snapshot")
     else:
         # inventory events
-        if msc:
-            yield from iter_inventory_events(msc.serial_number, inventory_events_from_machine_snapshot_commit(msc))
+        yield from iter_inventory_events(machine_snapshot.serial_number, inventory_events)
         # compliance checks
         yield from jmespath_checks_cache.process_tree(tree, last_seen)
 
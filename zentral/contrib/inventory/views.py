@@ -517,7 +517,7 @@ class MachineHeartbeatsView(PermissionRequiredMixin, TemplateView):
         ctx["machine"] = machine = MetaMachine.from_urlsafe_serial_number(kwargs["urlsafe_serial_number"])
         prepared_heartbeats = []
         try:
-            last_machine_heartbeats = frontend_store.get_last_machine_heartbeats(
+            last_machine_heartbeats = frontend_store.get_cached_last_machine_heartbeats(
                 machine.serial_number,
                 from_dt=datetime.utcnow() - timedelta(days=self.time_range_days)
             )
@@ -901,6 +901,7 @@ class RemoveMachineTagView(PermissionRequiredMixin, View):
         machine = MetaMachine.from_urlsafe_serial_number(kwargs["urlsafe_serial_number"])
         MachineTag.objects.filter(tag__id=kwargs['tag_id'],
                                   serial_number=machine.serial_number).delete()
+        MetaMachine.invalidate_cached_info_on_commit(machine.serial_number)
         return HttpResponseRedirect(reverse('inventory:machine_tags', args=(machine.get_urlsafe_serial_number(),)))
 
 
@@ -19,10 +19,13 @@ class APNSClient:
     apns_production_base_url = "https://api.push.apple.com"
     timeout = 5
     max_retries = 2
+    # max number of concurrent requests, multiplexed on the HTTP/2 connection
+    max_concurrent_streams = 20
 
     def __init__(self, topic, not_after, cert, privkey):
         self.topic = topic
         self.not_after = not_after
+        self._streams_semaphore = threading.BoundedSemaphore(self.max_concurrent_streams)
         ssl_context = create_client_ssl_context(cert, privkey)
         self.client = httpx.Client(
             base_url=self.apns_production_base_url,
@@ -58,7 +61,8 @@ class APNSClient:
 
         for retry_num in range(self.max_retries + 1):
             try:
-                r = self.client.post(url, json=payload, headers=headers)
+                with self._streams_semaphore:
+                    r = self.client.post(url, json=payload, headers=headers)
             except Exception:
                 logger.exception(f"{log_tmpl}: error", self.topic, token, priority, expiration_seconds)
             else:
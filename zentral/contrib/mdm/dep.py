@@ -8,8 +8,10 @@ from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.x509.oid import NameOID
 from dateutil import parser
+from django.db import connection
 from django.urls import reverse
 from django.utils import timezone
+import psycopg2.extras
 from zentral.conf import settings
 from zentral.utils.certificates import split_certificate_chain
 from .crypto import decrypt_cms_payload_with_pem_privkey
@@ -166,7 +168,10 @@ def dep_device_update_dict(device, known_enrollments=None):
                     try:
                         enrollment = DEPEnrollment.objects.get(uuid=val)
                     except DEPEnrollment.DoesNotExist:
-                        logger.error("Unknown DEP profile %s", val)
+                        pass
+                if enrollment is None:
+                    # the unknown profiles can be cached. logged for each device.
+                    logger.error("Unknown DEP profile %s for device %s", val, device.get("serial_number"))
                 update_d["enrollment"] = enrollment
             update_d[attr] = val
 
@@ -185,7 +190,75 @@ def dep_device_update_dict(device, known_enrollments=None):
     return update_d
 
 
-def sync_dep_virtual_server_devices(dep_virtual_server, force_fetch=False):
+def _update_or_create_dep_device(row):
+    row = row.copy()
+    serial_number = row.pop("serial_number")
+    last_op_date = row.get("last_op_date")
+    if last_op_date and DEPDevice.objects.filter(serial_number=serial_number, last_op_date__gt=last_op_date).exists():
+        # already applied a newer operation. skip stalled one.
+        return
+    return DEPDevice.objects.update_or_create(serial_number=serial_number, defaults=row)
+
+
+def _upsert_dep_devices(rows):
+    """Insert or update the DEP devices, with one statement per set of attributes
+
+    The unchanged devices, and the devices with a newer operation already applied, are skipped.
+    Returns a list of (DEPDevice, created) tuples.
+    """
+    now = timezone.now()
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(sorted(row)), []).append(row)
+    fields = DEPDevice._meta.concrete_fields
+    required_attrs = {f.attname for f in fields
+                      if not (f.null or f.primary_key or f.has_default() or f.attname in ("created_at", "updated_at"))}
+    returning = ", ".join(f.column for f in fields)
+    results = []
+    for attrs, group_rows in groups.items():
+        if not required_attrs.issubset(attrs):
+            # the NOT NULL constraints are checked before the conflicts.
+            # incomplete rows can only update existing devices.
+            for row in group_rows:
+                result = _update_or_create_dep_device(row)
+                if result:
+                    results.append(result)
+            continue
+        attr_fields = [DEPDevice._meta.get_field(attr) for attr in attrs]
+        columns = [f.column for f in attr_fields if f.column != "serial_number"]
+        query = (
+            "insert into mdm_depdevice ({}, created_at, updated_at) values %s "
+            "on conflict (serial_number) do update set {}, updated_at = excluded.updated_at "
+            "where ({}) is distinct from ({})"
+        ).format(
+            ", ".join(f.column for f in attr_fields),
+            ", ".join(f"{c} = excluded.{c}" for c in columns),
+            ", ".join(f"mdm_depdevice.{c}" for c in columns),
+            ", ".join(f"excluded.{c}" for c in columns),
+        )
+        if "last_op_date" in columns:
+            # do not apply stalled operations
+            query += (" and (mdm_depdevice.last_op_date is null "
+                      "or mdm_depdevice.last_op_date <= excluded.last_op_date)")
+        query += f" returning {returning}, (xmax = 0) as created"
+        with connection.cursor() as cursor:
+            result = psycopg2.extras.execute_values(
+                cursor, query,
+                (tuple(row[attr] for attr in attrs) + (now, now) for row in group_rows),
+                page_size=len(group_rows),
+                fetch=True
+            )
+        for values in result:
+            dep_device = DEPDevice.from_db(connection.alias, [f.attname for f in fields], values[:-1])
+            results.append((dep_device, values[-1]))
+    return results
+
+
+def sync_dep_virtual_server_devices(dep_virtual_server, force_fetch=False, batch_size=500):
+    """Sync the DEP virtual server devices
+
+    The devices are upserted in batches. Only the created or updated devices are yielded.
+    """
     dep_token = dep_virtual_server.token
     client = DEPClient.from_dep_token(dep_token)
     if force_fetch or not dep_token.sync_cursor:
@@ -199,11 +272,13 @@ def sync_dep_virtual_server_devices(dep_virtual_server, force_fetch=False):
 
     found_serial_numbers = []
     unassigned_serial_numbers = []
+    rows = {}
 
     for device in devices:
         serial_number = device["serial_number"]
         found_serial_numbers.append(serial_number)
-        defaults = {"virtual_server": dep_virtual_server}
+        row = {"serial_number": serial_number,
+               "virtual_server_id": dep_virtual_server.pk}
 
         # default assignment
         if (
@@ -215,24 +290,30 @@ def sync_dep_virtual_server_devices(dep_virtual_server, force_fetch=False):
 
         # sync
         if not fetch:
-            op_type = device["op_type"]
             op_date = parser.parse(device["op_date"])
             if timezone.is_aware(op_date):
                 op_date = timezone.make_naive(op_date)
-            try:
-                dep_device = DEPDevice.objects.get(serial_number=serial_number)
-            except DEPDevice.DoesNotExist:
-                dep_device = None
-            if dep_device and dep_device.last_op_date and dep_device.last_op_date > op_date:
-                # already applied a newer operation. skip stalled one.
+            previous_row = rows.get(serial_number)
+            if previous_row and previous_row["last_op_date"] > op_date:
+                # newer operation already in the batch. skip stalled one.
                 continue
-            else:
-                defaults["last_op_type"] = op_type
-                defaults["last_op_date"] = op_date
-
-        defaults.update(dep_device_update_dict(device, known_enrollments))
-
-        yield DEPDevice.objects.update_or_create(serial_number=serial_number, defaults=defaults)
+            row["last_op_type"] = device["op_type"]
+            row["last_op_date"] = op_date
+
+        update_d = dep_device_update_dict(device, known_enrollments)
+        enrollment = update_d.pop("enrollment")
+        if update_d["profile_uuid"]:
+            # cache the profile lookups
+            known_enrollments[update_d["profile_uuid"]] = enrollment
+        update_d["enrollment_id"] = enrollment.pk if enrollment else None
+        row.update(update_d)
+        rows[serial_number] = row
+
+        if len(rows) >= batch_size:
+            yield from _upsert_dep_devices(rows.values())
+            rows = {}
+    if rows:
+        yield from _upsert_dep_devices(rows.values())
     dep_token.sync_cursor = devices.cursor
     dep_token.last_synced_at = timezone.now()
     dep_token.save()
@@ -1,6 +1,6 @@
 import logging
 from django.db import connection
-from zentral.contrib.inventory.models import PrincipalUserSource
+from zentral.contrib.inventory.models import MetaMachine, PrincipalUserSource
 from zentral.contrib.inventory.utils import commit_machine_snapshot_and_trigger_events
 from zentral.contrib.mdm.models import Blueprint, Command, DeviceCommand, Platform
 
@@ -227,3 +227,4 @@ def realm_tagging_change_receiver(sender, **kwargs):
     logger.info("Realm tagging change signal received from %s", sender)
     for op in update_realm_tags(realm):
         logger.info("Tag %s, Serial number %s, Operation %s", op["tag_id"], op["serial_number"], op["op"])
+        MetaMachine.invalidate_cached_info_on_commit(op["serial_number"])
@@ -13,7 +13,7 @@ from django.http import FileResponse, Http404, HttpResponse, HttpResponseRedirec
 from django.shortcuts import get_object_or_404
 from django.utils.functional import cached_property
 from django.views.generic import View
-from zentral.contrib.inventory.models import MachineTag, MetaBusinessUnit
+from zentral.contrib.inventory.models import MachineTag, MetaBusinessUnit, MetaMachine
 from zentral.contrib.mdm.artifacts import Target
 from zentral.contrib.mdm.commands.install_profile import build_payload
 from zentral.contrib.mdm.commands.base import get_command
@@ -286,6 +286,9 @@ class CheckinView(MDMView):
             # remove the other ones that are automatically managed
             if tags_to_remove:
                 MachineTag.objects.filter(serial_number=self.serial_number, tag__in=tags_to_remove).delete()
+            if tags_to_add or tags_to_remove:
+                # the bulk operations do not send the post_save or post_delete signals
+                MetaMachine.invalidate_cached_info_on_commit(self.serial_number)
 
         # update enrollment session
         self.enrollment_session.set_authenticated_status(enrolled_device)
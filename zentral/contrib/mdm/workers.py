@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import logging
 from django.db import connection
@@ -56,6 +57,16 @@ class BaseAPNSWorker:
             raise ImproperlyConfigured("APNS workers capacity and rate must be floats")
         self.notification_leaky_bucket = LeakyBucket(lb_capacity, lb_rate)
 
+        # the notifications are sent concurrently, multiplexed on the APNS clients HTTP/2 connections.
+        # → thread pool for the notifications
+        try:
+            # default concurrency: 20 (min 1, max 100)
+            concurrency = min(max(1, int(workers_conf.get("concurrency", 20))), 100)
+        except (TypeError, ValueError):
+            raise ImproperlyConfigured("APNS workers concurrency must be an integer")
+        self.notification_executor = ThreadPoolExecutor(max_workers=concurrency,
+                                                        thread_name_prefix=f"{self.name} notification")
+
         # we also need to rate limit the DB queries, to avoid querying the DB
         # in a closed short loop if no targets are acquired and the notification
         # rate limit is not used.
@@ -101,8 +112,20 @@ class BaseAPNSWorker:
                 a_id if self.target_type == "user" else None,
             )
 
+    def send_notification(self, client, token, push_magic):
+        try:
+            return client.send_notification(
+                token, push_magic,
+                priority=self.apns_priority,
+                expiration_seconds=self.apns_expiration_seconds
+            )
+        except Exception:
+            logger.exception("Could not send notification for topic %s", client.topic)
+            return False
+
     def run_once(self):
         updates = []
+        notifications = []
         for pk, a_id, serial_number, udid, token, push_magic, topic, not_after in self.acquire_next_targets():
             client = apns_client_cache.get_or_create(topic, not_after)
             if not client:
@@ -111,17 +134,18 @@ class BaseAPNSWorker:
             else:
                 # rate limit the notifications
                 self.notification_leaky_bucket.consume()
-                success = client.send_notification(
-                    token, push_magic,
-                    priority=self.apns_priority,
-                    expiration_seconds=self.apns_expiration_seconds
+                notifications.append(
+                    ((pk, a_id, serial_number, udid),
+                     self.notification_executor.submit(self.send_notification, client, token, push_magic))
                 )
-                if success:
-                    self.inc_counter("success")
-                    updates.append((pk, a_id, serial_number, udid, datetime.utcnow()))
-                else:
-                    self.inc_counter("failure")
-                    updates.append((pk, a_id, serial_number, udid, None))
+        # collect the results
+        for (pk, a_id, serial_number, udid), future in notifications:
+            if future.result():
+                self.inc_counter("success")
+                updates.append((pk, a_id, serial_number, udid, datetime.utcnow()))
+            else:
+                self.inc_counter("failure")
+                updates.append((pk, a_id, serial_number, udid, None))
         self.process_target_updates(updates)
 
     def run(self, metrics_exporter=None, only_once=False):
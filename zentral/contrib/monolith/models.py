@@ -1033,7 +1033,8 @@ class Manifest(models.Model):
         for pkginfo in (PkgInfo.objects.distinct()
                                        .select_related("name")
                                        .filter(archived_at__isnull=True,
-                                               catalogs__in=self.catalogs(tags))):
+                                               catalogs__in=self.catalogs(tags))
+                                       .order_by("name__name", "version", "pk")):
             pkginfo_list.append(pkginfo.get_pkg_info())
 
         # the enrollment packages
@@ -1045,7 +1046,7 @@ class Manifest(models.Model):
             pkginfo_list.append(enrollment_package.get_pkg_info())
 
         # add all the enrollment packages, for the builders not in scope, to allow removal
-        not_in_scope_mep_qs = self.manifestenrollmentpackage_set.all()
+        not_in_scope_mep_qs = self.manifestenrollmentpackage_set.order_by("id")
         if in_scope_mep_builders:
             not_in_scope_mep_qs = not_in_scope_mep_qs.exclude(builder__in=in_scope_mep_builders)
         for not_in_scope_mep in not_in_scope_mep_qs:
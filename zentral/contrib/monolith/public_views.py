@@ -1,11 +1,14 @@
+import hashlib
 import logging
 import plistlib
 import random
 from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
 from django.core.files.storage import default_storage
-from django.http import FileResponse, HttpResponse, HttpResponseForbidden, HttpResponseNotFound, HttpResponseRedirect
+from django.http import (FileResponse, HttpResponse, HttpResponseForbidden, HttpResponseNotFound,
+                         HttpResponseNotModified, HttpResponseRedirect)
 from django.utils.functional import cached_property
+from django.utils.http import parse_etags, quote_etag
 from django.views.generic import View
 from zentral.contrib.inventory.exceptions import EnrollmentSecretVerificationFailed
 from zentral.contrib.inventory.models import MachineTag, MetaMachine
@@ -15,7 +18,7 @@ from zentral.utils.storage import file_storage_has_signed_urls
 from .conf import monolith_conf
 from .events import post_monolith_enrollment_event, post_monolith_munki_request
 from .models import MunkiNameError, parse_munki_name, CacheServer, EnrolledMachine, ManifestEnrollmentPackage
-from .utils import filter_catalog_data, filter_sub_manifest_data
+from .utils import build_catalog_filter, filter_sub_manifest_data, get_catalog_filter_indexes
 
 
 logger = logging.getLogger('zentral.contrib.monolith.public_views')
@@ -117,6 +120,14 @@ class MRNameView(MRBaseView):
             items.append(key)
         return ".".join(str(i) for i in items)
 
+    def make_plist_response(self, etag, get_content):
+        if etag in parse_etags(self.request.META.get("HTTP_IF_NONE_MATCH", "")):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(get_content(), content_type="application/xml")
+        response["ETag"] = etag
+        return response
+
     def get(self, request, *args, **kwargs):
         self.name = self.get_name(kwargs)
         event_payload = {"type": self.event_payload_type,
@@ -148,23 +159,41 @@ class MRNameView(MRBaseView):
 class MRCatalogView(MRNameView):
     event_payload_type = "catalog"
 
+    def get_catalog_data_and_filter(self, cache_key, event_payload):
+        # the tag based filter references the pkginfos by position.
+        # it is cached with the catalog data, to always be consistent with it.
+        cached_value = cache.get(cache_key)
+        if isinstance(cached_value, tuple):
+            event_payload["cache"]["hit"] = True
+            return cached_value
+        catalog_data = self.manifest.build_catalog(self.tags)
+        catalog_filter = build_catalog_filter(catalog_data, [t.name for t in self.tags])
+        cached_value = (catalog_data, catalog_filter)
+        cache.set(cache_key, cached_value, timeout=None)
+        return cached_value
+
+    def get_catalog_content(self, catalog_data, included_indexes, content_cache_key):
+        content = cache.get(content_cache_key)
+        if content is None:
+            content = plistlib.dumps([catalog_data[index] for index in included_indexes])
+            cache.set(content_cache_key, content, timeout=604800)  # 7 days
+        return content
+
     def do_get(self, model, key, cache_key, event_payload):
         if model == "manifest_catalog" and key == self.manifest.pk:
-            catalog_data = cache.get(cache_key)
-            if not isinstance(catalog_data, list):
-                catalog_data = self.manifest.build_catalog(self.tags)
-                cache.set(cache_key, catalog_data, timeout=None)
-            else:
-                event_payload["cache"]["hit"] = True
-            return HttpResponse(
-                plistlib.dumps(
-                    filter_catalog_data(
-                        catalog_data,
-                        self.machine_serial_number,
-                        [t.name for t in self.tags]
-                    )
-                ),
-                content_type="application/xml"
+            # tag based filtering, shared by all the machines with the same tags
+            catalog_data, catalog_filter = self.get_catalog_data_and_filter(cache_key, event_payload)
+            # shard based filtering
+            included_indexes = get_catalog_filter_indexes(catalog_filter, self.machine_serial_number)
+            # the content digest is computed using the included pkginfos, not their positions
+            content_hash = hashlib.sha1(cache_key.encode("utf-8"))
+            for index in included_indexes:
+                pkginfo = catalog_data[index]
+                content_hash.update(f"\n{pkginfo['name']}\n{pkginfo['version']}".encode("utf-8"))
+            content_digest = content_hash.hexdigest()
+            return self.make_plist_response(
+                quote_etag(content_digest),
+                lambda: self.get_catalog_content(catalog_data, included_indexes, f"monolith.catalog.{content_digest}")
             )
 
 
@@ -180,15 +209,23 @@ class MRManifestView(MRNameView):
             key = self.manifest.pk
         return model, key
 
+    def get_manifest_content(self, cache_key, event_payload):
+        manifest_data = cache.get(cache_key)
+        if manifest_data is None:
+            manifest_data = self.manifest.serialize(self.tags)
+            cache.set(cache_key, manifest_data, timeout=None)
+        else:
+            event_payload["cache"]["hit"] = True
+        return manifest_data
+
     def do_get(self, model, key, cache_key, event_payload):
         manifest_data = None
         if model == "manifest":
-            manifest_data = cache.get(cache_key)
-            if manifest_data is None:
-                manifest_data = self.manifest.serialize(self.tags)
-                cache.set(cache_key, manifest_data, timeout=None)
-            else:
-                event_payload["cache"]["hit"] = True
+            # the manifest version and the machine tags are in the cache key
+            return self.make_plist_response(
+                quote_etag(hashlib.sha1(cache_key.encode("utf-8")).hexdigest()),
+                lambda: self.get_manifest_content(cache_key, event_payload)
+            )
         elif model == "sub_manifest":
             sm_id = key
             event_payload["sub_manifest"] = {"id": sm_id}
@@ -121,14 +121,18 @@ def build_configuration_profile(enrollment):
     return f"zentral_monolith_configuration.enrollment_{enrollment.pk}.mobileconfig", content
 
 
-def test_monolith_object_inclusion(key, options, serial_number, tag_names):
+def get_monolith_object_shard(options, tag_names):
+    """Returns the shard and modulo of a monolith object for a tag set
+
+    Returns None if the object is excluded.
+    """
     shard = 100
     modulo = 100
     if options:
         excluded_tag_names = options.get("excluded_tags")
         if excluded_tag_names and any(etn in tag_names for etn in excluded_tag_names):
             # one excluded tag match, skip
-            return False
+            return None
         # not excluded, evaluate the shard
         shards = options.get("shards")
         if shards:
@@ -141,6 +145,14 @@ def test_monolith_object_inclusion(key, options, serial_number, tag_names):
                 except ValueError:
                     # no tag match
                     shard = default
+    return shard, modulo
+
+
+def test_monolith_object_inclusion(key, options, serial_number, tag_names):
+    shard_and_modulo = get_monolith_object_shard(options, tag_names)
+    if shard_and_modulo is None:
+        return False
+    shard, modulo = shard_and_modulo
     return (
         shard >= modulo or
         compute_shard(key + serial_number, modulo=modulo) < shard
@@ -156,12 +168,37 @@ def test_pkginfo_catalog_inclusion(pkginfo, serial_number, tag_names):
     )
 
 
-def filter_catalog_data(catalog_data, serial_number, tag_names):
-    filtered_catalog_data = []
-    for pkginfo in catalog_data:
-        if test_pkginfo_catalog_inclusion(pkginfo, serial_number, tag_names):
-            filtered_catalog_data.append(pkginfo)
-    return filtered_catalog_data
+def build_catalog_filter(catalog_data, tag_names):
+    """Evaluate the tag based inclusion of the catalog pkginfos
+
+    Returns the indexes of the pkginfos included for all the machines with these tags,
+    and the index, key, shard and modulo of the pkginfos included only for some of them.
+    """
+    included_indexes = []
+    sharded_pkginfos = []
+    for index, pkginfo in enumerate(catalog_data):
+        shard_and_modulo = get_monolith_object_shard(pkginfo.get("zentral_monolith"), tag_names)
+        if shard_and_modulo is None:
+            continue
+        shard, modulo = shard_and_modulo
+        if shard >= modulo:
+            included_indexes.append(index)
+        elif shard > 0:
+            sharded_pkginfos.append((index, pkginfo["name"] + pkginfo["version"], shard, modulo))
+    return included_indexes, sharded_pkginfos
+
+
+def get_catalog_filter_indexes(catalog_filter, serial_number):
+    """Returns the sorted indexes of the catalog pkginfos included for a machine"""
+    included_indexes, sharded_pkginfos = catalog_filter
+    if not sharded_pkginfos:
+        return included_indexes
+    return sorted(
+        included_indexes +
+        [index
+         for index, key, shard, modulo in sharded_pkginfos
+         if compute_shard(key + serial_number, modulo=modulo) < shard]
+    )
 
 
 def filter_sub_manifest_data_dict(smd, serial_number, tag_names):
@@ -57,14 +57,17 @@ def serialize_script_check_for_job(script_check):
 class MunkiScriptCheck(BaseComplianceCheck):
     model_display = "Script check"
     required_view_permissions = ("munki.view_scriptcheck",)
-    scoped_cc_query = (
-        "select cc.model, cc.id, cc.name, cc.version "
+    tag_scoped_cc_query = (
+        "select cc.model, cc.id, null::jsonb "
         "from compliance_checks_compliancecheck as cc "
-        "join munki_scriptcheck as sc on (sc.compliance_check_id = cc.id) "
-        "join compliance_checks_machinestatus as ms on (ms.compliance_check_id = cc.id) "
-        "where ms.serial_number = %(serial_number)s"
+        "join munki_scriptcheck as sc on (sc.compliance_check_id = cc.id)"
     )
 
+    @classmethod
+    def filter_machine_scoped_cc_ids(cls, serial_number, scoped_ccs, machine_statuses):
+        # only the compliance checks with a status for the machine
+        return {cc_pk for cc_pk, _ in scoped_ccs if cc_pk in machine_statuses}
+
     @cached_property
     def script_check(self):
         try:
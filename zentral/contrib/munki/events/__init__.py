@@ -2,6 +2,7 @@ import logging
 import uuid
 from dateutil import parser
 from zentral.core.events.base import BaseEvent, EventMetadata, EventRequest, register_event_type
+from zentral.core.queues import queues
 
 logger = logging.getLogger('zentral.contrib.munki.events')
 
@@ -149,48 +150,49 @@ def post_munki_request_event(msn, user_agent, ip, **kwargs):
 
 
 def post_munki_events(msn, user_agent, ip, data):
-    for report in data:
-        events = report.pop('events')
-        event_uuid = uuid.uuid4()
-        for event_index, (created_at, payload) in enumerate(events):
-            # event type
-            try:
-                failed = int(payload["status"]) != 0
-            except (KeyError, ValueError):
-                failed = True
-            payload_type = payload.get("type")
-            if payload_type == "install":
-                if failed:
-                    event_cls = MunkiInstallFailedEvent
+    with queues.batch_posting():
+        for report in data:
+            events = report.pop('events')
+            event_uuid = uuid.uuid4()
+            for event_index, (created_at, payload) in enumerate(events):
+                # event type
+                try:
+                    failed = int(payload["status"]) != 0
+                except (KeyError, ValueError):
+                    failed = True
+                payload_type = payload.get("type")
+                if payload_type == "install":
+                    if failed:
+                        event_cls = MunkiInstallFailedEvent
+                    else:
+                        event_cls = MunkiInstallEvent
+                elif payload_type == "removal":
+                    if failed:
+                        event_cls = MunkiRemovalFailedEvent
+                    else:
+                        event_cls = MunkiRemovalEvent
+                elif payload_type == "warning":
+                    event_cls = MunkiWarningEvent
+                elif payload_type == "error":
+                    event_cls = MunkiErrorEvent
+                elif payload_type == "start":
+                    event_cls = MunkiStartEvent
                 else:
-                    event_cls = MunkiInstallEvent
-            elif payload_type == "removal":
-                if failed:
-                    event_cls = MunkiRemovalFailedEvent
-                else:
-                    event_cls = MunkiRemovalEvent
-            elif payload_type == "warning":
-                event_cls = MunkiWarningEvent
-            elif payload_type == "error":
-                event_cls = MunkiErrorEvent
-            elif payload_type == "start":
-                event_cls = MunkiStartEvent
-            else:
-                logger.error("Unknown munki event payload type %s", payload_type)
-                continue
-
-            # build event
-            metadata = EventMetadata(
-                uuid=event_uuid,
-                index=event_index,
-                machine_serial_number=msn,
-                request=EventRequest(user_agent, ip),
-                created_at=parser.parse(created_at),
-                incident_updates=payload.pop("incident_updates", []),
-            )
-            payload.update(report)
-            event = event_cls(metadata, payload)
-            event.post()
+                    logger.error("Unknown munki event payload type %s", payload_type)
+                    continue
+
+                # build event
+                metadata = EventMetadata(
+                    uuid=event_uuid,
+                    index=event_index,
+                    machine_serial_number=msn,
+                    request=EventRequest(user_agent, ip),
+                    created_at=parser.parse(created_at),
+                    incident_updates=payload.pop("incident_updates", []),
+                )
+                payload.update(report)
+                event = event_cls(metadata, payload)
+                event.post()
 
 
 def post_munki_enrollment_event(msn, user_agent, ip, data):
@@ -4,9 +4,12 @@ from django.contrib.postgres.fields import ArrayField
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
 from django.db.models import F, Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
 from zentral.contrib.inventory.models import BaseEnrollment, Tag
+from zentral.core.compliance_checks.cache import bump_scoped_cc_version
 from zentral.utils.os_version import make_comparable_os_version
 
 
@@ -265,3 +268,11 @@ class ScriptCheck(models.Model):
     def delete(self, *args, **kwargs):
         self.compliance_check.delete()
         return super().delete(*args, **kwargs)
+
+
+# the script check compliance checks are in the cached scoped compliance checks
+# only once the script check points to them
+@receiver(post_save, sender=ScriptCheck)
+@receiver(post_delete, sender=ScriptCheck)
+def script_check_change_signal_handler(sender, instance, **kwargs):
+    bump_scoped_cc_version()
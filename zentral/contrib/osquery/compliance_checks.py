@@ -3,7 +3,7 @@ from django.utils.functional import cached_property
 from zentral.core.compliance_checks import register_compliance_check_class
 from zentral.core.compliance_checks.compliance_checks import BaseComplianceCheck
 from zentral.core.compliance_checks.models import ComplianceCheck, Status
-from zentral.core.compliance_checks.utils import update_machine_statuses
+from zentral.core.compliance_checks.utils import update_machines_statuses
 from zentral.core.events import event_cls_from_type
 from .models import Query
 
@@ -14,14 +14,17 @@ logger = logging.getLogger("zentral.contrib.osquery.compliance_checks")
 class OsqueryCheck(BaseComplianceCheck):
     model_display = "Osquery check"
     required_view_permissions = ("osquery.view_query",)
-    scoped_cc_query = (
-        "select cc.model, cc.id, cc.name, cc.version "
+    tag_scoped_cc_query = (
+        "select cc.model, cc.id, null::jsonb "
         "from compliance_checks_compliancecheck as cc "
-        "join osquery_query as q on (q.compliance_check_id = cc.id) "
-        "join compliance_checks_machinestatus as ms on (ms.compliance_check_id = cc.id) "
-        "where ms.serial_number = %(serial_number)s"
+        "join osquery_query as q on (q.compliance_check_id = cc.id)"
     )
 
+    @classmethod
+    def filter_machine_scoped_cc_ids(cls, serial_number, scoped_ccs, machine_statuses):
+        # only the compliance checks with a status for the machine
+        return {cc_pk for cc_pk, _ in scoped_ccs if cc_pk in machine_statuses}
+
     @cached_property
     def query(self):
         try:
@@ -65,52 +68,67 @@ def sync_query_compliance_check(query, on):
     return created, updated, deleted
 
 
-class ComplianceCheckStatusAggregator:
-    def __init__(self, serial_number):
-        self.serial_number = serial_number
+class MachinesComplianceCheckStatusAggregator:
+    """Aggregate the compliance check results of one or many machines
+
+    The queries are resolved once, and the machine statuses written with a single upsert.
+    """
+
+    def __init__(self):
         self.cc_statuses = {}
 
-    def add_result(self, query_pk, query_version, status_time, results, distributed_query_pk=None):
+    def add_machine_result(self, serial_number, query_pk, query_version, status_time, results,
+                           distributed_query_pk=None):
         try:
             status = max(Status[r["ztl_status"].upper()] for r in results)
         except Exception:
             status = Status.UNKNOWN
+        key = (serial_number, query_pk)
         update_key = False
         try:
-            _, _, stored_status_time, _ = self.cc_statuses[query_pk]
+            _, _, stored_status_time, _ = self.cc_statuses[key]
         except KeyError:
             update_key = True
         else:
             if status_time and stored_status_time:
                 update_key = status_time > stored_status_time
         if update_key:
-            self.cc_statuses[query_pk] = (query_version, status, status_time, distributed_query_pk)
+            self.cc_statuses[key] = (query_version, status, status_time, distributed_query_pk)
 
     def commit(self):
         if not self.cc_statuses:
             return
-        compliance_check_statuses = []
+        queries = {
+            query.pk: query
+            for query in (Query.objects.select_related("compliance_check")
+                                       .prefetch_related("packquery__pack")
+                                       .filter(pk__in={query_pk for _, query_pk in self.cc_statuses},
+                                               compliance_check__isnull=False))
+        }
+        machine_compliance_check_statuses = []
         checks = {}
-        for query in (Query.objects.select_related("compliance_check")
-                                   .prefetch_related("packquery__pack")
-                                   .filter(pk__in=self.cc_statuses.keys(),
-                                           compliance_check__isnull=False)):
-            query_version, status, status_time, distributed_query_pk = self.cc_statuses[query.pk]
+        for key, (query_version, status, status_time, distributed_query_pk) in self.cc_statuses.items():
+            serial_number, query_pk = key
+            query = queries.get(query_pk)
+            if query is None:
+                continue
             if query.version != query_version:
                 # outdated status
                 continue
-            compliance_check_statuses.append((query.compliance_check, status, status_time))
-            checks[query.compliance_check.pk] = (query, status_time, distributed_query_pk)
-        status_updates = update_machine_statuses(self.serial_number, compliance_check_statuses)
+            machine_compliance_check_statuses.append((serial_number, query.compliance_check, status, status_time))
+            checks[(serial_number, query.compliance_check.pk)] = (query, status_time, distributed_query_pk)
+        if not machine_compliance_check_statuses:
+            return
+        status_updates = update_machines_statuses(machine_compliance_check_statuses)
         event_cls = event_cls_from_type("osquery_check_status_updated")  # import cycle with osquery.events
-        for compliance_check_pk, status_value, previous_status_value in status_updates:
+        for serial_number, compliance_check_pk, status_value, previous_status_value in status_updates:
             if status_value == previous_status_value:
                 # status not updated, no event
                 continue
-            query, status_time, distributed_query_pk = checks[compliance_check_pk]
+            query, status_time, distributed_query_pk = checks[(serial_number, compliance_check_pk)]
             yield event_cls.build_from_query_serial_number_and_statuses(
                 query, distributed_query_pk,
-                self.serial_number,
+                serial_number,
                 Status(status_value), status_time,
                 Status(previous_status_value) if previous_status_value is not None else None,
             )
@@ -118,3 +136,15 @@ class ComplianceCheckStatusAggregator:
     def commit_and_post_events(self):
         for event in self.commit():
             event.post()
+
+
+class ComplianceCheckStatusAggregator(MachinesComplianceCheckStatusAggregator):
+    """Aggregate the compliance check results of a single machine"""
+
+    def __init__(self, serial_number):
+        super().__init__()
+        self.serial_number = serial_number
+
+    def add_result(self, query_pk, query_version, status_time, results, distributed_query_pk=None):
+        self.add_machine_result(self.serial_number, query_pk, query_version, status_time, results,
+                                distributed_query_pk)
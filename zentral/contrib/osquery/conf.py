@@ -1,6 +1,11 @@
+import hashlib
+import json
 import logging
 from zentral.contrib.inventory.conf import LINUX, MACOS, WINDOWS
+from django.core.cache import cache
+from django.db import transaction
 from django.db.models import Q
+from django.utils.crypto import get_random_string
 
 
 logger = logging.getLogger('zentral.contrib.osquery.conf')
@@ -199,3 +204,69 @@ def build_osquery_conf(machine, enrollment):
         conf.setdefault("packs", {})[pack.configuration_key()] = pack.serialize()
 
     return conf
+
+
+# cached configurations
+
+
+CONF_CACHE_TIMEOUT = 3600
+
+
+def _get_configuration_version_cache_key(configuration_pk):
+    return f"osquery_conf_version_{configuration_pk}"
+
+
+def get_configuration_version(configuration_pk):
+    """Returns the current content version of a configuration
+
+    The version is a random token, kept until the configuration or one of its components changes.
+    """
+    cache_key = _get_configuration_version_cache_key(configuration_pk)
+    version = cache.get(cache_key)
+    if version is None:
+        version = get_random_string(12)
+        if not cache.add(cache_key, version, None):
+            # concurrently set
+            version = cache.get(cache_key, version)
+    return version
+
+
+def bump_configuration_versions(configuration_pks):
+    """Invalidate the cached osquery configurations
+
+    The versions are dropped immediately and after the current transaction is committed,
+    to avoid caching configurations built with stale data during the transaction.
+    """
+    cache_keys = [_get_configuration_version_cache_key(pk) for pk in configuration_pks]
+    if not cache_keys:
+        return
+    cache.delete_many(cache_keys)
+    transaction.on_commit(lambda: cache.delete_many(cache_keys))
+
+
+def _get_machine_conf_inputs(machine, configuration):
+    inputs = {"tags": sorted(t.pk for t in machine.tags)}
+    if configuration.inventory:
+        inputs["platform"] = machine.platform
+        if configuration.inventory_apps and machine.platform not in (MACOS, WINDOWS):
+            inputs["has_deb_packages"] = machine.has_deb_packages
+    return inputs
+
+
+def get_osquery_conf_cache_key(machine, configuration):
+    inputs = _get_machine_conf_inputs(machine, configuration)
+    inputs_hash = hashlib.sha1(json.dumps(inputs, sort_keys=True).encode("utf-8")).hexdigest()
+    return "osquery_conf_{}_{}_{}".format(configuration.pk, get_configuration_version(configuration.pk), inputs_hash)
+
+
+def get_cached_osquery_conf(machine, enrollment):
+    """Cached version of build_osquery_conf
+
+    The configurations are cached per configuration version and machine inputs (platform, tags).
+    """
+    cache_key = get_osquery_conf_cache_key(machine, enrollment.configuration)
+    conf = cache.get(cache_key)
+    if conf is None:
+        conf = build_osquery_conf(machine, enrollment)
+        cache.set(cache_key, conf, CONF_CACHE_TIMEOUT)
+    return conf
@@ -2,6 +2,7 @@ from datetime import datetime
 import logging
 import uuid
 from zentral.core.events.base import BaseEvent, EventMetadata, EventRequest, register_event_type
+from zentral.core.queues import queues
 from zentral.contrib.osquery.compliance_checks import ComplianceCheckStatusAggregator
 from zentral.contrib.osquery.models import parse_result_name, EnrolledMachine, PackQuery, QueryType
 from zentral.contrib.osquery.tags import TagUpdateAggregator
@@ -238,31 +239,32 @@ def post_results(msn, user_agent, ip, results):
         request = None
     cc_status_agg = ComplianceCheckStatusAggregator(msn)
     tag_update_agg = TagUpdateAggregator(msn)
-    for index, result in enumerate(_iter_cleaned_up_records(results)):
-        try:
-            event_time = _get_record_created_at(result)
-        except Exception:
-            logger.exception("Could not extract osquery result time")
-            event_time = None
-        metadata = EventMetadata(uuid=event_uuid, index=index,
-                                 machine_serial_number=msn,
-                                 request=request,
-                                 created_at=event_time)
-        event = OsqueryResultEvent(metadata, result)
-        try:
-            _, query_type, query_pk, query_version, event_routing_key = event.parse_result_name()
-        except ValueError:
-            logger.exception("Could not parse result name")
-            query_pk = query_version = event_routing_key = None
-        if event_routing_key:
-            event.metadata.routing_key = event_routing_key
-        event.post()
-        snapshot = event.payload.get("snapshot")
-        if snapshot is not None and query_pk is not None and query_version is not None:
-            if query_type == QueryType.COMPLIANCE_CHECK:
-                cc_status_agg.add_result(query_pk, query_version, event_time, snapshot)
-            elif query_type == QueryType.TAG:
-                tag_update_agg.add_result(query_pk, query_version, event_time, snapshot)
+    with queues.batch_posting():
+        for index, result in enumerate(_iter_cleaned_up_records(results)):
+            try:
+                event_time = _get_record_created_at(result)
+            except Exception:
+                logger.exception("Could not extract osquery result time")
+                event_time = None
+            metadata = EventMetadata(uuid=event_uuid, index=index,
+                                     machine_serial_number=msn,
+                                     request=request,
+                                     created_at=event_time)
+            event = OsqueryResultEvent(metadata, result)
+            try:
+                _, query_type, query_pk, query_version, event_routing_key = event.parse_result_name()
+            except ValueError:
+                logger.exception("Could not parse result name")
+                query_pk = query_version = event_routing_key = None
+            if event_routing_key:
+                event.metadata.routing_key = event_routing_key
+            event.post()
+            snapshot = event.payload.get("snapshot")
+            if snapshot is not None and query_pk is not None and query_version is not None:
+                if query_type == QueryType.COMPLIANCE_CHECK:
+                    cc_status_agg.add_result(query_pk, query_version, event_time, snapshot)
+                elif query_type == QueryType.TAG:
+                    tag_update_agg.add_result(query_pk, query_version, event_time, snapshot)
     cc_status_agg.commit_and_post_events()
     tag_update_agg.commit()
 
@@ -5,13 +5,17 @@ from django.contrib.postgres.fields import ArrayField
 from django.core.validators import MinValueValidator, MaxValueValidator, RegexValidator
 from django.db import models, connection
 from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.functional import cached_property
 from zentral.conf import settings
 from zentral.contrib.inventory.models import BaseEnrollment, Tag
+from zentral.core.compliance_checks.cache import bump_scoped_cc_version
 from zentral.utils.sql import tables_in_query, format_sql
 from zentral.utils.text import shard
+from .conf import bump_configuration_versions
 from .specs import cli_only_flags
 
 
@@ -485,6 +489,91 @@ class ConfigurationPack(models.Model):
         return "{}#cp{}".format(self.configuration.get_absolute_url(), self.pk)
 
 
+# Configuration cache invalidation
+
+
+def bump_all_configuration_versions():
+    bump_configuration_versions(Configuration.objects.values_list("pk", flat=True))
+
+
+@receiver(post_save, sender=Configuration)
+@receiver(post_delete, sender=Configuration)
+def configuration_change_signal_handler(sender, instance, **kwargs):
+    bump_configuration_versions([instance.pk])
+
+
+@receiver(post_save, sender=ConfigurationPack)
+@receiver(post_delete, sender=ConfigurationPack)
+def configuration_pack_change_signal_handler(sender, instance, **kwargs):
+    bump_configuration_versions([instance.configuration_id])
+
+
+@receiver(m2m_changed, sender=Configuration.file_categories.through)
+@receiver(m2m_changed, sender=Configuration.automatic_table_constructions.through)
+@receiver(m2m_changed, sender=ConfigurationPack.tags.through)
+def configuration_m2m_change_signal_handler(sender, instance, action, reverse, **kwargs):
+    if not action.startswith("post_"):
+        return
+    if reverse:
+        bump_all_configuration_versions()
+    elif isinstance(instance, ConfigurationPack):
+        bump_configuration_versions([instance.configuration_id])
+    else:
+        bump_configuration_versions([instance.pk])
+
+
+@receiver(post_save, sender=Pack)
+def pack_change_signal_handler(sender, instance, **kwargs):
+    # the deletions are handled by the configuration pack signal handler
+    bump_configuration_versions(
+        Configuration.objects.filter(configurationpack__pack=instance).values_list("pk", flat=True)
+    )
+
+
+@receiver(post_save, sender=PackQuery)
+@receiver(post_delete, sender=PackQuery)
+def pack_query_change_signal_handler(sender, instance, **kwargs):
+    bump_configuration_versions(
+        Configuration.objects.filter(configurationpack__pack__pk=instance.pack_id).values_list("pk", flat=True)
+    )
+
+
+@receiver(post_save, sender=Query)
+def query_change_signal_handler(sender, instance, **kwargs):
+    # the deletions are handled by the pack query signal handler
+    bump_configuration_versions(
+        Configuration.objects.filter(configurationpack__pack__packquery__query=instance).values_list("pk", flat=True)
+    )
+
+
+# the osquery compliance checks are in the cached scoped compliance checks
+# only once the query points to them
+@receiver(post_save, sender=Query)
+@receiver(post_delete, sender=Query)
+def query_compliance_check_change_signal_handler(sender, instance, **kwargs):
+    if instance.compliance_check_id:
+        bump_scoped_cc_version()
+
+
+@receiver(post_save, sender=FileCategory)
+def file_category_change_signal_handler(sender, instance, **kwargs):
+    bump_configuration_versions(instance.configuration_set.values_list("pk", flat=True))
+
+
+@receiver(post_save, sender=AutomaticTableConstruction)
+def atc_change_signal_handler(sender, instance, **kwargs):
+    bump_configuration_versions(instance.configuration_set.values_list("pk", flat=True))
+
+
+# the m2m relationships or foreign keys are removed without m2m_changed or post_save signals
+@receiver(post_delete, sender=FileCategory)
+@receiver(post_delete, sender=AutomaticTableConstruction)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender="compliance_checks.ComplianceCheck")
+def configuration_dependency_delete_signal_handler(sender, instance, **kwargs):
+    bump_all_configuration_versions()
+
+
 # Enrollment
 
 
@@ -15,7 +15,7 @@ from zentral.contrib.inventory.models import MachineSnapshot, MetaMachine, Machi
 from zentral.contrib.inventory.utils import (commit_machine_snapshot_and_trigger_events,
                                              verify_enrollment_secret)
 from zentral.contrib.osquery.compliance_checks import ComplianceCheckStatusAggregator
-from zentral.contrib.osquery.conf import build_osquery_conf, INVENTORY_QUERY_NAME
+from zentral.contrib.osquery.conf import get_cached_osquery_conf, INVENTORY_QUERY_NAME
 from zentral.contrib.osquery.events import (post_enrollment_event,
                                             post_file_carve_events,
                                             post_request_event, post_results, post_status_logs)
@@ -186,7 +186,7 @@ class ConfigView(BaseNodeView):
     request_type = "config"
 
     def do_node_post(self):
-        return build_osquery_conf(self.machine, self.enrollment)
+        return get_cached_osquery_conf(self.machine, self.enrollment)
 
 
 class StartFileCarvingView(BaseNodeView):
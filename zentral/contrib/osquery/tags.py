@@ -1,5 +1,5 @@
 import logging
-from zentral.contrib.inventory.models import MachineTag
+from zentral.contrib.inventory.models import MachineTag, MetaMachine
 from .models import Query
 
 
@@ -50,3 +50,6 @@ class TagUpdateAggregator:
                 [MachineTag(serial_number=self.serial_number, tag=tag) for tag in tags_to_add],
                 ignore_conflicts=True
             )
+        if tags_to_remove or tags_to_add:
+            # the bulk operations do not send the post_save or post_delete signals
+            MetaMachine.invalidate_cached_info_on_commit(self.serial_number)
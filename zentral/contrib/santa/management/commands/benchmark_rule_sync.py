@@ -0,0 +1,76 @@
+import statistics
+import time
+import uuid
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils.crypto import get_random_string
+from zentral.contrib.inventory.models import EnrollmentSecret, MetaBusinessUnit
+from zentral.contrib.santa.models import Configuration, EnrolledMachine, Enrollment, MachineRule, Rule, Target
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the Santa rule download. All the objects are created in a rolled back transaction.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rule-counts', type=int, nargs="+", default=[1000, 10000, 25000])
+        parser.add_argument('--batch-size', type=int, default=Configuration.DEFAULT_BATCH_SIZE)
+
+    def build_configuration(self, rule_count, batch_size):
+        configuration = Configuration.objects.create(name=get_random_string(12), batch_size=batch_size)
+        targets = Target.objects.bulk_create(
+            Target(type=Target.BINARY, identifier=get_random_string(64, allowed_chars='abcdef0123456789'))
+            for _ in range(rule_count)
+        )
+        Rule.objects.bulk_create(
+            Rule(configuration=configuration, target=target, policy=Rule.ALLOWLIST)
+            for target in targets
+        )
+        # the rows are not visible to autovacuum, and the query plans depend on the statistics
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE santa_target, santa_rule, santa_rule_tags, santa_rule_excluded_tags, "
+                           "santa_bundle, santa_bundle_binary_targets, santa_machinerule")
+        return configuration
+
+    def build_enrolled_machine(self, configuration):
+        meta_business_unit = MetaBusinessUnit.objects.create(name=get_random_string(12))
+        enrollment_secret = EnrollmentSecret.objects.create(meta_business_unit=meta_business_unit)
+        enrollment = Enrollment.objects.create(configuration=configuration, secret=enrollment_secret)
+        return EnrolledMachine.objects.create(enrollment=enrollment,
+                                              hardware_uuid=uuid.uuid4(),
+                                              serial_number=get_random_string(12),
+                                              client_mode=Configuration.MONITOR_MODE,
+                                              santa_version="2022.1")
+
+    def sync(self, enrolled_machine):
+        latencies = []
+        rule_count = 0
+        cursor = None
+        while True:
+            start = time.perf_counter()
+            with transaction.atomic():
+                rules, cursor = MachineRule.objects.get_next_rule_batch(enrolled_machine, [], cursor)
+            latencies.append(time.perf_counter() - start)
+            rule_count += len(rules)
+            if not cursor:
+                break
+        return rule_count, latencies
+
+    def write_sync_results(self, label, rule_count, latencies):
+        total = sum(latencies)
+        if len(latencies) > 1:
+            p95 = statistics.quantiles(latencies, n=20)[-1]
+        else:
+            p95 = latencies[0]
+        self.stdout.write(f"{label:>8} {rule_count:>8} {len(latencies):>8} {total:>9.2f}s "
+                          f"{1000 * statistics.mean(latencies):>9.1f}ms {1000 * p95:>9.1f}ms")
+
+    def handle(self, **options):
+        self.stdout.write(f"batch size {options['batch_size']}")
+        self.stdout.write(f"{'sync':>8} {'rules':>8} {'requests':>8} {'total':>10} {'mean':>11} {'p95':>11}")
+        for rule_count in options["rule_counts"]:
+            with transaction.atomic():
+                configuration = self.build_configuration(rule_count, options["batch_size"])
+                enrolled_machine = self.build_enrolled_machine(configuration)
+                self.write_sync_results("first", *self.sync(enrolled_machine))
+                self.write_sync_results("next", *self.sync(enrolled_machine))
+                transaction.set_rollback(True)
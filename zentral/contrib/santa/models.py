@@ -9,6 +9,7 @@ from django.db.models import Count, Q
 from django.urls import reverse
 from django.utils.crypto import get_random_string
 from django.utils.functional import cached_property
+import psycopg2.extras
 from zentral.core.incidents.models import Severity
 from zentral.contrib.inventory.models import BaseEnrollment, Certificate, File, Tag
 from zentral.utils.text import shard
@@ -964,36 +965,46 @@ class MachineRuleManager(models.Manager):
                     rule_info_d[key] = val
             yield rule_info_d
 
+    def _update_machine_rules(self, enrolled_machine, machine_rules, cursor):
+        query = (
+            "insert into santa_machinerule (enrolled_machine_id, target_id, policy, version, cursor) "
+            "values %s "
+            "on conflict (enrolled_machine_id, target_id) do update "
+            "set policy = excluded.policy, version = excluded.version, cursor = excluded.cursor"
+        )
+        with connection.cursor() as db_cursor:
+            psycopg2.extras.execute_values(
+                db_cursor, query,
+                ((enrolled_machine.pk, target_id, policy, version, cursor)
+                 for target_id, policy, version in machine_rules)
+            )
+
     def get_next_rule_batch(self, enrolled_machine, tags, cursor=None):
         qs = self.filter(enrolled_machine=enrolled_machine).select_for_update()
 
         # fresh start from last known OK state
         # remove all unacknowlegded machine rules, except the REMOVE ones
         # this will ultimately refresh all the rules that haven't been acknowleged
-        qs_cleanup = qs.exclude(policy=MachineRule.REMOVE).filter(cursor__isnull=False)
+        cleanup_q = ~Q(policy=MachineRule.REMOVE)
         if cursor:
             # do not delete request cursor rules. We will acknowlege them
-            qs_cleanup = qs_cleanup.exclude(cursor=cursor)
-        qs_cleanup.delete()
+            cleanup_q &= ~Q(cursor=cursor)
+            # remove the REMOVE machine rules from the last batch
+            cleanup_q |= Q(policy=MachineRule.REMOVE, cursor=cursor)
+        qs.filter(cleanup_q, cursor__isnull=False).delete()
 
-        # acknowlege the cursor rules
+        # acknowlege the other machine rules from the last batch
         if cursor:
-            qs = qs.filter(cursor=cursor)
-            # remove the REMOVE machine rules from the last batch
-            qs.filter(policy=MachineRule.REMOVE).delete()
-            # acknowlege the other machine rules from the last batch
-            qs.update(cursor=None)
+            qs.filter(cursor=cursor).update(cursor=None)
 
         # translate attributes for older santa agents
         # TODO remove eventually
 
         # return next batch
         rules = []
-        new_cursor = None
+        machine_rules = []
         use_sha256_attr = enrolled_machine.get_comparable_santa_version() < (2022, 1)
         for rule in self._iter_new_rules(enrolled_machine, tags):
-            if new_cursor is None:
-                new_cursor = get_random_string(8)
             target_id = rule.pop("target_id")
             policy = rule.pop("policy")  # need a translation
             rule["policy"] = translate_rule_policy(policy)
@@ -1002,17 +1013,13 @@ class MachineRuleManager(models.Manager):
                 rule.pop("custom_msg", None)
             if use_sha256_attr and rule["rule_type"] not in (Target.CDHASH, Target.SIGNING_ID, Target.TEAM_ID):
                 rule["sha256"] = rule.pop("identifier")
-            self.update_or_create(enrolled_machine=enrolled_machine,
-                                  target=Target(pk=target_id),
-                                  defaults={
-                                      "policy": policy,
-                                      "version": version,
-                                      "cursor": new_cursor,
-                                  })
+            machine_rules.append((target_id, policy, version))
             rules.append(rule)
         response_cursor = None
         if len(rules):
-            response_cursor = new_cursor
+            response_cursor = get_random_string(8)
+            # one statement for the whole batch
+            self._update_machine_rules(enrolled_machine, machine_rules, response_cursor)
         return rules, response_cursor
 
 
@@ -1,9 +1,12 @@
 from django import forms
+from django.core.exceptions import ImproperlyConfigured
 
 
 class BaseActionForm(forms.Form):
     def __init__(self, *args, **kwargs):
         self.config_d = kwargs.pop("config_d")
+        # timeout of the network calls made to build the form
+        self.timeout = kwargs.pop("timeout", 10)
         super(BaseActionForm, self).__init__(*args, **kwargs)
 
     def get_action_config_d(self):
@@ -16,14 +19,32 @@ class BaseAction(object):
 
     def __init__(self, config_d):
         self.name = config_d.pop("action_name")
+        # trigger dispatch options
+        # the timeout is applied to the network calls of the triggers
+        # default timeout: 10s (min 1s, max 120s)
+        self.timeout = self._get_int_option(config_d, "timeout", 10, 1, 120)
+        # default concurrency: 4 (min 1, max 20)
+        self.concurrency = self._get_int_option(config_d, "concurrency", 4, 1, 20)
+        # queued triggers, when all the threads are busy. default: 100 (min 0, max 10000)
+        self.queue_size = self._get_int_option(config_d, "queue_size", 100, 0, 10000)
+        # default max retries: 3 (min 0, max 10)
+        self.max_retries = self._get_int_option(config_d, "max_retries", 3, 0, 10)
+        # initial retry delay, doubled after each attempt. default: 30s (min 1s, max 3600s)
+        self.retry_delay = self._get_int_option(config_d, "retry_delay", 30, 1, 3600)
         self.config_d = config_d
 
+    def _get_int_option(self, config_d, key, default, min_value, max_value):
+        try:
+            return min(max(min_value, int(config_d.pop(key, default))), max_value)
+        except (TypeError, ValueError):
+            raise ImproperlyConfigured(f"Action {self.name} {key} must be an integer")
+
     def can_be_updated(self):
         return self.action_form_class != BaseActionForm
 
     def get_action_form(self, action_config_d=None):
         args = []
-        kwargs = {"config_d": self.config_d}
+        kwargs = {"config_d": self.config_d, "timeout": self.timeout}
         if action_config_d is not None:
             args.append(action_config_d)
         return self.action_form_class(*args, **kwargs)
@@ -17,27 +17,17 @@ class Action(BaseAction):
         self.password = config_d.get("smtp_password")
         self.email_from = config_d.get('from', settings.DEFAULT_FROM_EMAIL)
         self.recipients = [e for e in config_d.get("recipients", []) if e and isinstance(e, str)]
-        self.conn = None
 
     def _open(self):
-        if self.conn:
-            return
-        conn = SMTP(self.host, self.port)
+        # one connection per trigger, the triggers can run concurrently
+        conn = SMTP(self.host, self.port, timeout=self.timeout)
         conn.ehlo()
         if self.use_tls:
             conn.starttls()
             conn.ehlo()
         if self.user and self.password:
             conn.login(self.user, self.password)
-        self.conn = conn
-
-    def _close(self):
-        if self.conn is None:
-            return
-        try:
-            self.conn.quit()
-        finally:
-            self.conn = None
+        return conn
 
     def trigger(self, event, probe, action_config_d):
         if not self.recipients:
@@ -47,8 +37,10 @@ class Action(BaseAction):
         msg['From'] = self.email_from
         msg['To'] = ",".join(self.recipients)
         try:
-            self._open()
-            self.conn.sendmail(self.email_from, self.recipients, msg.as_string())
-            self._close()
+            conn = self._open()
+            try:
+                conn.sendmail(self.email_from, self.recipients, msg.as_string())
+            finally:
+                conn.quit()
         except SMTPException:
             logger.exception("SMTP exception")
@@ -60,7 +60,7 @@ class Action(BaseAction):
             args['tags'] = tags
         args.update(action_config_d)
         r = requests.post(self.url, headers={'Content-Type': 'application/json'},
-                          data=json.dumps(args), auth=self.auth)
+                          data=json.dumps(args), auth=self.auth, timeout=self.timeout)
         if not r.ok:
             logger.error(r.text)
         r.raise_for_status()
@@ -7,5 +7,5 @@ class Action(BaseAction):
         payload = {'text': '\n\n'.join([event.get_notification_subject(probe),
                                         event.get_notification_body(probe)])}
         url = self.config_d['webhook']
-        r = requests.post(url, json=payload)
+        r = requests.post(url, json=payload, timeout=self.timeout)
         r.raise_for_status()
@@ -15,5 +15,6 @@ class Action(BaseAction):
         r = requests.post(url,
                           auth=auth,
                           headers=headers,
-                          data=json.dumps(event.serialize()))
+                          data=json.dumps(event.serialize()),
+                          timeout=self.timeout)
         r.raise_for_status()
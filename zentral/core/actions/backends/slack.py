@@ -12,6 +12,7 @@ class Action(BaseAction):
             self.url,
             headers={'Accept': 'application/json'},
             json={'text': '\n\n'.join([event.get_notification_subject(probe),
-                                       event.get_notification_body(probe)])}
+                                       event.get_notification_body(probe)])},
+            timeout=self.timeout
         )
         r.raise_for_status()
@@ -0,0 +1,132 @@
+from concurrent.futures import ThreadPoolExecutor
+import heapq
+import itertools
+import logging
+import threading
+import time
+from django.db import close_old_connections
+
+
+logger = logging.getLogger("zentral.core.actions.dispatcher")
+
+
+class ActionDispatcher:
+    """Trigger the probe actions asynchronously.
+
+    Each action gets its own bounded thread pool, sized by the action concurrency,
+    so that a slow destination cannot block the event processing or the other actions.
+    The triggers that cannot be queued, or that fail, are kept in a local retry spool.
+    The spool is only kept in memory, and the spooled triggers are dropped on shutdown.
+    """
+
+    saturation_retry_delay = 1  # seconds
+    max_spool_size = 10000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executors = {}
+        self._spool = []
+        self._spool_counter = itertools.count()
+        self._spool_condition = threading.Condition(self._lock)
+        self._retry_thread = None
+        self._shutdown = False
+
+    def _get_executor(self, action):
+        limits = (action.concurrency, action.queue_size)
+        try:
+            executor_limits, executor, slots = self._executors[action.name]
+        except KeyError:
+            pass
+        else:
+            if executor_limits == limits:
+                return executor, slots
+            # action reconfigured. the submitted triggers are still executed.
+            logger.info("Action %s reconfigured. Replace executor.", action.name)
+            executor.shutdown(wait=False)
+        executor = ThreadPoolExecutor(max_workers=action.concurrency,
+                                      thread_name_prefix=f"action {action.name}")
+        # running + queued triggers
+        slots = threading.BoundedSemaphore(action.concurrency + action.queue_size)
+        self._executors[action.name] = limits, executor, slots
+        return executor, slots
+
+    def dispatch(self, action, event, probe, action_config_d, attempt=0):
+        with self._lock:
+            executor, slots = self._get_executor(action)
+        if not slots.acquire(blocking=False):
+            logger.warning("Action %s saturated. Spool trigger.", action.name)
+            self._spool_trigger(self.saturation_retry_delay, action, event, probe, action_config_d, attempt)
+            return False
+        try:
+            future = executor.submit(self._trigger, action, event, probe, action_config_d, attempt)
+        except RuntimeError:
+            slots.release()
+            logger.error("Action %s executor shut down. Drop trigger.", action.name)
+            return False
+        future.add_done_callback(lambda f: slots.release())
+        return True
+
+    def _trigger(self, action, event, probe, action_config_d, attempt):
+        try:
+            action.trigger(event, probe, action_config_d)
+        except Exception:
+            if attempt < action.max_retries:
+                logger.exception("Could not trigger action %s. Attempt %s/%s. Spool trigger.",
+                                 action.name, attempt + 1, action.max_retries + 1)
+                self._spool_trigger(action.retry_delay * 2 ** attempt,
+                                    action, event, probe, action_config_d, attempt + 1)
+            else:
+                logger.exception("Could not trigger action %s. Attempt %s/%s. Drop trigger.",
+                                 action.name, attempt + 1, action.max_retries + 1)
+        finally:
+            # the triggers can query the DB, and the executor threads are long lived
+            close_old_connections()
+
+    # retry spool
+
+    def _spool_trigger(self, delay, *args):
+        with self._spool_condition:
+            if self._shutdown:
+                logger.error("Action dispatcher shut down. Drop %s trigger.", args[0].name)
+                return
+            if len(self._spool) >= self.max_spool_size:
+                logger.error("Action retry spool full. Drop %s trigger.", args[0].name)
+                return
+            heapq.heappush(self._spool, (time.monotonic() + delay, next(self._spool_counter), args))
+            if self._retry_thread is None:
+                self._retry_thread = threading.Thread(target=self._retry_spooled_triggers,
+                                                      name="action retry spool", daemon=True)
+                self._retry_thread.start()
+            self._spool_condition.notify()
+
+    def _retry_spooled_triggers(self):
+        while True:
+            with self._spool_condition:
+                while True:
+                    if self._shutdown:
+                        return
+                    if self._spool:
+                        timeout = self._spool[0][0] - time.monotonic()
+                        if timeout <= 0:
+                            _, _, args = heapq.heappop(self._spool)
+                            break
+                    else:
+                        timeout = None
+                    self._spool_condition.wait(timeout)
+            self.dispatch(*args)
+
+    def spool_size(self):
+        with self._lock:
+            return len(self._spool)
+
+    def shutdown(self, wait=True):
+        with self._spool_condition:
+            self._shutdown = True
+            self._spool_condition.notify()
+            executors = list(self._executors.values())
+        for _, executor, _ in executors:
+            executor.shutdown(wait=wait)
+        with self._spool_condition:
+            if self._spool:
+                logger.error("Action dispatcher shut down. Drop %s spooled trigger(s).", len(self._spool))
+                self._spool = []
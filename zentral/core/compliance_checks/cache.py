@@ -0,0 +1,40 @@
+import hashlib
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.crypto import get_random_string
+
+
+# cached scoped compliance checks
+
+
+SCOPED_CC_CACHE_TIMEOUT = 3600
+SCOPED_CC_VERSION_CACHE_KEY = "compliance_checks_scoped_cc_version"
+
+
+def get_scoped_cc_version():
+    """Returns the current version of the compliance check scopes
+
+    The version is a random token, kept until a compliance check or its scope changes.
+    """
+    version = cache.get(SCOPED_CC_VERSION_CACHE_KEY)
+    if version is None:
+        version = get_random_string(12)
+        if not cache.add(SCOPED_CC_VERSION_CACHE_KEY, version, None):
+            # concurrently set
+            version = cache.get(SCOPED_CC_VERSION_CACHE_KEY, version)
+    return version
+
+
+def bump_scoped_cc_version():
+    """Invalidate the cached scoped compliance checks
+
+    The version is dropped immediately and after the current transaction is committed,
+    to avoid caching scoped compliance checks built with stale data during the transaction.
+    """
+    cache.delete(SCOPED_CC_VERSION_CACHE_KEY)
+    transaction.on_commit(lambda: cache.delete(SCOPED_CC_VERSION_CACHE_KEY))
+
+
+def get_scoped_cc_cache_key(tag_ids):
+    tag_ids_hash = hashlib.sha1(",".join(str(tag_id) for tag_id in tag_ids).encode("utf-8")).hexdigest()
+    return f"compliance_checks_scoped_cc_{get_scoped_cc_version()}_{tag_ids_hash}"
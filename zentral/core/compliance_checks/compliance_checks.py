@@ -4,6 +4,18 @@ from . import register_compliance_check_class
 class BaseComplianceCheck:
     model_display = "Compliance check"
     required_view_permissions = ()
+    # machine independent part of the scope, cached per tag set.
+    # must return the model, the id, and the scope data of the compliance checks.
+    tag_scoped_cc_query = None
+
+    @classmethod
+    def filter_machine_scoped_cc_ids(cls, serial_number, scoped_ccs, machine_statuses):
+        """Returns the ids of the tag scoped compliance checks that are in scope for the machine
+
+        scoped_ccs: list of (compliance check id, scope data) tuples, from the tag_scoped_cc_query
+        machine_statuses: compliance check ids of the machine statuses
+        """
+        return {cc_pk for cc_pk, _ in scoped_ccs}
 
     @classmethod
     def get_model(cls):
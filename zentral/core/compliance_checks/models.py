@@ -2,8 +2,11 @@ from enum import Enum
 import functools
 import logging
 from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils.functional import cached_property
 from . import compliance_check_class_from_model
+from .cache import bump_scoped_cc_version
 
 
 logger = logging.getLogger('zentral.core.compliance_checks.models')
@@ -38,6 +41,15 @@ class ComplianceCheck(models.Model):
         return cls(self)
 
 
+# scoped compliance checks cache invalidation
+
+
+@receiver(post_save, sender=ComplianceCheck)
+@receiver(post_delete, sender=ComplianceCheck)
+def compliance_check_change_signal_handler(sender, instance, **kwargs):
+    bump_scoped_cc_version()
+
+
 @functools.total_ordering
 class Status(Enum):
     OK = 0
@@ -1,12 +1,24 @@
 from datetime import datetime
+import json
+from django.core.cache import cache
 from django.db import connection
 import psycopg2.extras
-from . import compliance_check_classes
+from . import compliance_check_class_from_model, compliance_check_classes
+from .cache import get_scoped_cc_cache_key, SCOPED_CC_CACHE_TIMEOUT
 from .compliance_checks import BaseComplianceCheck
 from .models import Status
 
 
-def update_machine_statuses(serial_number, compliance_check_statuses):
+MACHINE_STATUSES_PAGE_SIZE = 1000
+
+
+def update_machines_statuses(machine_compliance_check_statuses):
+    """Upsert the compliance check statuses of one or many machines
+
+    machine_compliance_check_statuses: iterable of (serial number, compliance check, status, status time)
+    tuples. Only one status per machine and compliance check is allowed.
+    Returns the (serial number, compliance check pk, status, previous status) of the updated statuses.
+    """
     query = (
         'insert into compliance_checks_machinestatus '
         '("compliance_check_id", "compliance_check_version", "serial_number", "status", "status_time") '
@@ -16,7 +28,7 @@ def update_machine_statuses(serial_number, compliance_check_statuses):
         'status = excluded.status, status_time = excluded.status_time,'
         'previous_status = compliance_checks_machinestatus.status '
         'where excluded.status_time > compliance_checks_machinestatus.status_time '
-        'returning compliance_check_id, status, previous_status'
+        'returning serial_number, compliance_check_id, status, previous_status'
     )
     with connection.cursor() as cursor:
         now = datetime.utcnow()  # default status time
@@ -27,45 +39,84 @@ def update_machine_statuses(serial_number, compliance_check_statuses):
               serial_number,
               status.value,
               status_time or now)
-             for compliance_check, status, status_time in compliance_check_statuses),
+             for serial_number, compliance_check, status, status_time in machine_compliance_check_statuses),
+            page_size=MACHINE_STATUSES_PAGE_SIZE,
             fetch=True
         )
         return result
 
 
+def update_machine_statuses(serial_number, compliance_check_statuses):
+    return [
+        (compliance_check_pk, status, previous_status)
+        for _, compliance_check_pk, status, previous_status in update_machines_statuses(
+            (serial_number, compliance_check, status, status_time)
+            for compliance_check, status, status_time in compliance_check_statuses
+        )
+    ]
+
+
+def get_tag_scoped_compliance_checks(tag_ids):
+    """Returns the tag scoped compliance checks, grouped by model
+
+    The scoped compliance checks only depend on the tags, and are cached per tag set
+    until a compliance check or its scope changes.
+    """
+    tag_ids = sorted(set(tag_ids))
+    cache_key = get_scoped_cc_cache_key(tag_ids)
+    tag_scoped_ccs = cache.get(cache_key)
+    if tag_scoped_ccs is None:
+        tag_scoped_ccs = {}
+        tag_scoped_cc_queries = [
+            cc_cls.tag_scoped_cc_query for cc_cls in compliance_check_classes.values()
+            if cc_cls != BaseComplianceCheck and cc_cls.tag_scoped_cc_query
+        ]
+        if tag_scoped_cc_queries:
+            with connection.cursor() as cursor:
+                # union will eliminate duplicates
+                cursor.execute(" UNION ".join(tag_scoped_cc_queries), {"tag_ids": tag_ids or None})
+                for cc_model, cc_pk, scope in cursor.fetchall():
+                    if scope is not None:
+                        scope = json.loads(scope)
+                    tag_scoped_ccs.setdefault(cc_model, []).append((cc_pk, scope))
+        cache.set(cache_key, tag_scoped_ccs, SCOPED_CC_CACHE_TIMEOUT)
+    return tag_scoped_ccs
+
+
 def get_machine_compliance_check_statuses(serial_number, tags):
     compliance_check_statuses = []
-    non_default_compliance_check_classes = [
-        cc_cls for cc_cls in compliance_check_classes.values()
-        if cc_cls != BaseComplianceCheck
-    ]
-    non_default_compliance_check_class_count = len(non_default_compliance_check_classes)
-    if non_default_compliance_check_class_count < 1:
+    tag_scoped_ccs = get_tag_scoped_compliance_checks(t.id for t in tags or [])
+    if not tag_scoped_ccs:
         return compliance_check_statuses
-    scoped_cc_queries = " UNION ".join(cc_cls.scoped_cc_query for cc_cls in non_default_compliance_check_classes)
-    if non_default_compliance_check_class_count < 2:
-        # union will eliminate duplicates, but without union, a group by is needed
-        scoped_cc_queries += " group by cc.model, cc.id, cc.name, cc.version"
     query = (
-        f"with scoped_cc as ({scoped_cc_queries}) "
         "select cc.model, cc.id, cc.name, "
         "case when ms.compliance_check_version = cc.version then ms.status else null end as status,"
-        "case when ms.compliance_check_version = cc.version then ms.status_time else null end as status_time "
-        "from scoped_cc as cc "
-        "left join compliance_checks_machinestatus as ms on (cc.id = ms.compliance_check_id) "
-        "where ms.serial_number is null or ms.serial_number = %(serial_number)s "
+        "case when ms.compliance_check_version = cc.version then ms.status_time else null end as status_time,"
+        "ms.id is not null as has_machine_status "
+        "from compliance_checks_compliancecheck as cc "
+        "left join compliance_checks_machinestatus as ms "
+        "on (ms.compliance_check_id = cc.id and ms.serial_number = %(serial_number)s) "
+        "where cc.id = any(%(cc_pks)s) "
         "order by cc.name"
     )
     with connection.cursor() as cursor:
         cursor.execute(
             query,
             {"serial_number": serial_number,
-             "tag_ids": [t.id for t in tags] if tags else None}
+             "cc_pks": [cc_pk for scoped_ccs in tag_scoped_ccs.values() for cc_pk, _ in scoped_ccs]}
         )
-        for cc_model, cc_pk, cc_name, status, status_time in cursor.fetchall():
-            if status is None:
-                status = Status.PENDING
-            else:
-                status = Status(status)
-            compliance_check_statuses.append((cc_model, cc_pk, cc_name, status, status_time))
+        rows = cursor.fetchall()
+    machine_statuses = {row[1] for row in rows if row[5]}
+    machine_scoped_cc_pks = set()
+    for cc_model, scoped_ccs in tag_scoped_ccs.items():
+        cc_cls = compliance_check_class_from_model(cc_model)
+        machine_scoped_cc_pks.update(cc_cls.filter_machine_scoped_cc_ids(serial_number, scoped_ccs, machine_statuses))
+    for cc_model, cc_pk, cc_name, status, status_time, _ in rows:
+        if cc_pk not in machine_scoped_cc_pks:
+            continue
+        if status is None:
+            status = Status.PENDING
+        else:
+            status = Status(status)
+        compliance_check_statuses.append((cc_model, cc_pk, cc_name, status, status_time))
     return compliance_check_statuses
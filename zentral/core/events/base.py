@@ -240,7 +240,38 @@ class EventRequest(object):
         self.geo = EventRequestGeo.build_from_city(city)
 
 
+# datetime.isoformat() output for the naive UTC datetimes, serialized as is
+CANONICAL_CREATED_AT_RE = re.compile(r"\A\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(?:\.\d{6})?\Z")
+
+
+def parse_created_at(value):
+    try:
+        # fast path for the datetime.isoformat() output
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return parser.parse(value)
+
+
 class EventMetadata(object):
+    __slots__ = (
+        "_deserialized",
+        "uuid",
+        "index",
+        "_created_at",
+        "_raw_created_at",
+        "machine_serial_number",
+        "machine",
+        "observer",
+        "request",
+        "probes",
+        "incident_updates",
+        "tags",
+        "routing_key",
+        "objects",
+        "event",
+        "_all_tags",
+    )
+
     def __init__(self, **kwargs):
         self._deserialized = kwargs.pop("_deserialized", False)
         self.uuid = kwargs.pop('uuid', uuid.uuid4())
@@ -248,10 +279,6 @@ class EventMetadata(object):
             self.uuid = uuid.UUID(self.uuid)
         self.index = int(kwargs.pop('index', 0))
         self.created_at = kwargs.pop('created_at', None)
-        if self.created_at is None:
-            self.created_at = datetime.utcnow()
-        elif isinstance(self.created_at, str):
-            self.created_at = parser.parse(self.created_at)
         self.machine_serial_number = kwargs.pop('machine_serial_number', None)
         if self.machine_serial_number:
             self.machine = MetaMachine(self.machine_serial_number)
@@ -264,6 +291,25 @@ class EventMetadata(object):
         self.tags = kwargs.pop('tags', [])
         self.routing_key = kwargs.pop('routing_key', None)
         self.objects = kwargs.pop('objects', {})
+        self._all_tags = None
+
+    @property
+    def created_at(self):
+        if self._created_at is None:
+            # parsed on first use
+            self._created_at = parse_created_at(self._raw_created_at)
+        return self._created_at
+
+    @created_at.setter
+    def created_at(self, value):
+        if value is None:
+            value = datetime.utcnow()
+        if isinstance(value, str):
+            self._created_at = None
+            self._raw_created_at = value
+        else:
+            self._created_at = value
+            self._raw_created_at = None
 
     def set_event(self, event):
         self.event = weakref.proxy(event)
@@ -278,9 +324,11 @@ class EventMetadata(object):
     def namespace(self):
         return self.event.namespace or self.event_type
 
-    @cached_property
+    @property
     def all_tags(self):
-        return set(self.tags + self.event.tags)
+        if self._all_tags is None:
+            self._all_tags = set(self.tags + self.event.tags)
+        return self._all_tags
 
     @classmethod
     def deserialize(cls, event_d_metadata):
@@ -298,7 +346,12 @@ class EventMetadata(object):
         return cls(**kwargs)
 
     def serialize(self, machine_metadata=True):
-        d = {'created_at': self.created_at.isoformat(),
+        if self._created_at is None and CANONICAL_CREATED_AT_RE.match(self._raw_created_at):
+            # not parsed, and already in the isoformat() form
+            created_at = self._raw_created_at
+        else:
+            created_at = self.created_at.isoformat()
+        d = {'created_at': created_at,
              'id': str(self.uuid),
              'index': self.index,
              'type': self.event_type,
@@ -351,11 +404,13 @@ class EventMetadata(object):
                 if extra_obj_args not in obj_args_list:
                     obj_args_list.append(extra_obj_args)
 
-    def iter_loaded_probes(self):
+    def iter_loaded_probes(self, probes_dict=None):
+        if probes_dict is None:
+            probes_dict = all_probes_dict
         for serialized_probe in self.probes:
             probe_pk = serialized_probe["pk"]
             try:
-                yield all_probes_dict[probe_pk]
+                yield probes_dict[probe_pk]
             except KeyError:
                 logger.error("Event %s/%s: unknown probe %s", self.uuid, self.index, probe_pk)
 
@@ -395,8 +450,9 @@ class BaseEvent(object):
 
     @classmethod
     def post_machine_request_payloads(cls, msn, user_agent, ip, payloads, get_created_at=None, observer=None):
-        for event in cls.build_from_machine_request_payloads(msn, user_agent, ip, payloads, get_created_at, observer):
-            event.post()
+        queues.post_events(
+            cls.build_from_machine_request_payloads(msn, user_agent, ip, payloads, get_created_at, observer)
+        )
 
     def __init__(self, metadata, payload):
         self.metadata = metadata
@@ -406,6 +462,11 @@ class BaseEvent(object):
     def _key(self):
         return (self.event_type, self.metadata.uuid, self.metadata.index)
 
+    @cached_property
+    def payload_values_cache(self):
+        """flattened payload values memoized during the probe matching"""
+        return {}
+
     def __eq__(self, other):
         return self._key() == other._key()
 
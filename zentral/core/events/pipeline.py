@@ -2,8 +2,9 @@ import logging
 import geoip2.database
 from . import event_from_event_d
 from zentral.conf import settings
-from zentral.core.probes.conf import all_probes
-from zentral.core.incidents.utils import apply_incident_updates
+from zentral.core.actions.dispatcher import ActionDispatcher
+from zentral.core.probes.conf import all_probes_matcher
+from zentral.core.incidents.utils import apply_incident_updates_batch
 
 
 logger = logging.getLogger('zentral.core.events.pipeline')
@@ -28,7 +29,7 @@ def get_city(ip):
         pass
 
 
-def enrich_event(event):
+def _enrich_event(event, probes_matcher):
     if isinstance(event, dict):
         event = event_from_event_d(event)
 
@@ -39,24 +40,48 @@ def enrich_event(event):
             event.metadata.request.set_geo_from_city(city)
 
     # probe matching
-    for probe in all_probes.event_filtered(event):
+    for probe in probes_matcher.event_filtered(event):
         event.metadata.add_probe(probe)
 
-    # incident status updates
-    for incident_event in apply_incident_updates(event):
-        for probe in all_probes.event_filtered(incident_event):
-            incident_event.metadata.add_probe(probe, with_incident_updates=False)
-        yield incident_event
+    return event
 
-    yield event
 
+def enrich_events(events, probes_matcher=None):
+    """Enrich a batch of events
 
-def process_event(event):
+    The incident updates are coalesced across the batch.
+    Returns the list of enriched events for each of the events.
+    The events are matched against all the active probes, unless a probes matcher is given.
+    """
+    if probes_matcher is None:
+        probes_matcher = all_probes_matcher
+    events = [_enrich_event(event, probes_matcher) for event in events]
+    enriched_events = []
+    for event, incident_events in zip(events, apply_incident_updates_batch(events)):
+        # incident status updates
+        for incident_event in incident_events:
+            for probe in probes_matcher.event_filtered(incident_event):
+                incident_event.metadata.add_probe(probe, with_incident_updates=False)
+        enriched_events.append(incident_events + [event])
+    return enriched_events
+
+
+def enrich_event(event, probes_matcher=None):
+    yield from enrich_events([event], probes_matcher)[0]
+
+
+action_dispatcher = ActionDispatcher()
+
+
+def process_event(event, probes_dict=None):
     if isinstance(event, dict):
         event = event_from_event_d(event)
-    for probe in event.metadata.iter_loaded_probes():
+    for probe in event.metadata.iter_loaded_probes(probes_dict):
         for action, action_config_d in probe.actions:
-            try:
-                action.trigger(event, probe, action_config_d)
-            except Exception:
-                logger.exception("Could not trigger action %s", action.name)
+            # asynchronous, the event processing must not wait for the action destinations
+            action_dispatcher.dispatch(action, event, probe, action_config_d)
+
+
+def stop_process_event():
+    # wait for the running action triggers. the spooled retries are dropped.
+    action_dispatcher.shutdown()
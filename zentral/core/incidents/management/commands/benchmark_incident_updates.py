@@ -0,0 +1,71 @@
+from concurrent.futures import ThreadPoolExecutor
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils.crypto import get_random_string
+from zentral.core.events.base import BaseEvent, EventMetadata
+from zentral.core.incidents.models import Incident, IncidentUpdate, Severity
+from zentral.core.incidents.utils import apply_incident_updates, apply_incident_updates_batch
+
+
+class Command(BaseCommand):
+    help = ('Benchmark the incident updates of a fleet of machines flipping the same check at once, '
+            'event by event vs. coalesced batches')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--machine-count', type=int, default=10000)
+        parser.add_argument('--batch-sizes', type=int, nargs="+", default=[100, 1000])
+        parser.add_argument('--workers', type=int, default=4,
+                            help="number of concurrent enrich workers")
+
+    def build_events(self, incident_type, key, serial_numbers, severity):
+        return [BaseEvent(EventMetadata(machine_serial_number=serial_number,
+                                        incident_updates=[IncidentUpdate(incident_type, key, severity)]), {})
+                for serial_number in serial_numbers]
+
+    def apply_worker_events(self, events, batch_size):
+        event_count = 0
+        query_count = [0]
+
+        def count_queries(execute, *args, **kwargs):
+            query_count[0] += 1
+            return execute(*args, **kwargs)
+
+        try:
+            with connection.execute_wrapper(count_queries):
+                if batch_size < 2:
+                    for event in events:
+                        event_count += len(apply_incident_updates(event))
+                else:
+                    for i in range(0, len(events), batch_size):
+                        event_count += sum(len(e) for e in apply_incident_updates_batch(events[i:i + batch_size]))
+        finally:
+            connection.close()
+        return event_count, query_count[0]
+
+    def run_benchmark(self, events, batch_size, worker_count):
+        worker_events = [events[i::worker_count] for i in range(worker_count)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=worker_count) as executor:
+            results = list(executor.map(lambda e: self.apply_worker_events(e, batch_size), worker_events))
+        duration = time.perf_counter() - start
+        return (len(events) / duration,
+                sum(event_count for event_count, _ in results),
+                sum(query_count for _, query_count in results))
+
+    def handle(self, **options):
+        machine_count = options["machine_count"]
+        worker_count = options["workers"]
+        serial_numbers = [get_random_string(12) for _ in range(machine_count)]
+        self.stdout.write(f"{machine_count} machines, {worker_count} worker(s)")
+        self.stdout.write(f"{'check':>8} {'batch':>6} {'ev/s':>10} {'incident events':>16} {'queries':>8}")
+        incident_type = "base"
+        for batch_size in [1] + options["batch_sizes"]:
+            key = {"benchmark": get_random_string(12)}
+            try:
+                for label, severity in (("failed", Severity.MAJOR), ("ok", Severity.NONE)):
+                    events = self.build_events(incident_type, key, serial_numbers, severity)
+                    eps, event_count, query_count = self.run_benchmark(events, batch_size, worker_count)
+                    self.stdout.write(f"{label:>8} {batch_size:>6} {eps:>10.0f} {event_count:>16} {query_count:>8}")
+            finally:
+                Incident.objects.filter(incident_type=incident_type, key=key).delete()
@@ -1,4 +1,5 @@
 from datetime import datetime
+import json
 import logging
 import uuid
 from django.db import IntegrityError, transaction
@@ -165,32 +166,173 @@ def apply_incident_update(incident_update, serial_number):
                 yield event_args
 
 
-def apply_incident_updates(original_event):
-    events = []
-    incident_updates = original_event.metadata.incident_updates
-    if not incident_updates:
+def _iter_incident_update_rounds(updates):
+    # split the updates of an incident in rounds, with at most one update per machine in each round.
+    # the updates of a machine are applied in order.
+    pending_updates = updates
+    while pending_updates:
+        round_updates = []
+        next_updates = []
+        serial_numbers = set()
+        for update in pending_updates:
+            _, _, serial_number = update
+            if serial_number in serial_numbers:
+                next_updates.append(update)
+            else:
+                serial_numbers.add(serial_number)
+                round_updates.append(update)
+        yield round_updates
+        pending_updates = next_updates
+
+
+def _open_incident_round(updates):
+    # get or create the open incident once, with the max severity
+    _, max_incident_update, _ = max_update = max(updates, key=lambda u: u[1].severity.value)
+    incident, event_args = open_incident(max_incident_update)
+    if event_args:
+        yield (max_update[0],) + event_args
+    # machine incidents, set based
+    serial_number_indexes = {serial_number: index for index, _, serial_number in updates if serial_number}
+    if not serial_number_indexes:
+        return
+    existing_serial_numbers = set(
+        MachineIncident.objects.filter(incident=incident,
+                                       serial_number__in=serial_number_indexes.keys(),
+                                       status__in=Status.open_values())
+                               .values_list("serial_number", flat=True)
+    )
+    status_time = datetime.utcnow()
+    machine_incidents = MachineIncident.objects.bulk_create([
+        MachineIncident(incident=incident,
+                        serial_number=serial_number,
+                        status=Status.OPEN.value,
+                        status_time=status_time)
+        for serial_number in serial_number_indexes
+        if serial_number not in existing_serial_numbers
+    ])
+    for machine_incident in machine_incidents:
+        yield (serial_number_indexes[machine_incident.serial_number],
+               MachineIncidentCreatedEvent, machine_incident.serialize_for_event())
+
+
+def _close_incident_round(incident_type, key, updates):
+    serial_number_indexes = {serial_number: index for index, _, serial_number in updates if serial_number}
+    if serial_number_indexes:
+        # close the machine incidents if status == Status.OPEN, set based
+        # do not automatically close them if open but not status == status.OPEN (manual intervention)
+        machine_incidents = list(
+            MachineIncident.objects.select_for_update().select_related("incident").filter(
+                incident__incident_type=incident_type,
+                incident__key=key,
+                serial_number__in=serial_number_indexes.keys(),
+                status=Status.OPEN.value,
+            )
+        )
+        updated_at = datetime.utcnow()
+        incidents = {}
+        for machine_incident in machine_incidents:
+            previous_status = {
+                "status": machine_incident.status,
+                "status_time": machine_incident.status_time
+            }
+            machine_incident.status = Status.CLOSED.value
+            machine_incident.updated_at = updated_at
+            event_payload = machine_incident.serialize_for_event()
+            event_payload["machine_incident"]["previous_status"] = previous_status
+            index = serial_number_indexes[machine_incident.serial_number]
+            yield (index, MachineIncidentStatusUpdatedEvent, event_payload)
+            # the incident closing is linked to the last event closing one of its machine incidents
+            incident_index = incidents.setdefault(machine_incident.incident_id, [machine_incident.incident, index])
+            incident_index[1] = max(incident_index[1], index)
+        if machine_incidents:
+            MachineIncident.objects.filter(pk__in=[mi.pk for mi in machine_incidents]).update(
+                status=Status.CLOSED.value, updated_at=updated_at
+            )
+
+        # close the incidents if status == Status.OPEN
+        # do not automatically close them if open but not status == Status.OPEN (manual intervention)
+        for incident, index in incidents.values():
+            if incident.status not in Status.open_values():
+                logger.error("Closed open machine incidents on a closed incident:%s !!!", incident.pk)
+            elif incident.status == Status.OPEN.value:
+                if incident.machineincident_set.filter(status__in=Status.open_values()).count():
+                    # other open machine incident in the incident, we cannot close it
+                    continue
+                previous_status = {
+                    "status": incident.status,
+                    "status_time": incident.status_time
+                }
+                incident.status = Status.CLOSED.value
+                incident.status_time = datetime.utcnow()
+                incident.save()
+                event_payload = incident.serialize_for_event()
+                event_payload["previous_status"] = previous_status
+                yield (index, IncidentStatusUpdatedEvent, event_payload)
+    for index, incident_update, serial_number in updates:
+        if not serial_number:
+            for event_cls, event_payload in close_open_incident(incident_update):
+                yield (index, event_cls, event_payload)
+
+
+def _apply_coalesced_incident_updates(incident_type, key, updates):
+    for round_updates in _iter_incident_update_rounds(updates):
+        # the incident is opened before the other machine incidents are closed,
+        # to keep it open if at least one of the machines still needs it.
+        open_updates = []
+        close_updates = []
+        for update in round_updates:
+            if update[1].severity == Severity.NONE:
+                close_updates.append(update)
+            else:
+                open_updates.append(update)
+        if open_updates:
+            yield from _open_incident_round(open_updates)
+        if close_updates:
+            yield from _close_incident_round(incident_type, key, close_updates)
+
+
+def apply_incident_updates_batch(original_events):
+    """Apply the incident updates of a batch of events
+
+    The updates are coalesced by incident type and key, and applied with set based queries,
+    in a single transaction, to be able to re-apply all of them if one of the groups fails.
+    Returns the list of incident events for each of the original events.
+    """
+    events = [[] for _ in original_events]
+    coalesced_updates = {}
+    for index, original_event in enumerate(original_events):
+        serial_number = original_event.metadata.machine_serial_number
+        for incident_update in original_event.metadata.incident_updates:
+            coalesced_key = (incident_update.incident_type, json.dumps(incident_update.key, sort_keys=True))
+            coalesced_updates.setdefault(coalesced_key, []).append((index, incident_update, serial_number))
+    if not coalesced_updates:
         return events
-    serial_number = original_event.metadata.machine_serial_number
-    event_uuid = uuid.uuid4()
-    event_index = 0
+    event_uuids = {}
     with transaction.atomic():
-        for incident_update in incident_updates:
-            for event_cls, event_payload in apply_incident_update(incident_update, serial_number):
+        for (incident_type, _), updates in coalesced_updates.items():
+            key = updates[0][1].key
+            for index, event_cls, event_payload in _apply_coalesced_incident_updates(incident_type, key, updates):
+                original_event = original_events[index]
+                if index not in event_uuids:
+                    event_uuids[index] = uuid.uuid4()
                 event_metadata = EventMetadata(
-                    uuid=event_uuid,
-                    index=event_index,
-                    machine_serial_number=serial_number,
+                    uuid=event_uuids[index],
+                    index=len(events[index]),
+                    machine_serial_number=original_event.metadata.machine_serial_number,
                     # copy the original event payload linked objects into the incident events metadata
                     objects=original_event.get_linked_objects_keys()
                 )
                 event = event_cls(event_metadata, event_payload)
-                events.append(event)
-                event_index += 1
+                events[index].append(event)
                 # copy the incident event payload linked objects into the original event metadata
                 original_event.metadata.add_objects(event.get_linked_objects_keys())
     return events
 
 
+def apply_incident_updates(original_event):
+    return apply_incident_updates_batch([original_event])[0]
+
+
 def update_incident_status(incident, new_status, request):
     incident = Incident.objects.select_for_update().get(pk=incident.pk)
     if new_status not in incident.get_next_statuses():
@@ -137,24 +137,51 @@ class MetadataFiltersSerializer(serializers.Serializer):
         raise serializers.ValidationError("No event types or tags")
 
 
-def get_flattened_payload_values(payload, attrs):
-    if isinstance(payload, list):
-        for nested_payload in payload:
-            yield from get_flattened_payload_values(nested_payload, list(attrs))
-    elif isinstance(payload, dict):
-        attr = attrs.pop(0)
-        val = payload.get(attr)
-        if val is None:
-            return
-        if not attrs:
-            if isinstance(val, (set, list)):
-                yield from (str(v) for v in val)
+class PayloadAttributePath(object):
+    """Compiled dotted payload filter attribute.
+
+    The flattened values are collected iteratively, and the attribute is only split once,
+    not for each event.
+    """
+
+    __slots__ = ("attribute", "attrs", "last_idx")
+
+    def __init__(self, attribute):
+        self.attribute = attribute
+        self.attrs = tuple(attribute.split("."))
+        self.last_idx = len(self.attrs) - 1
+
+    def get_values(self, payload):
+        values = set()
+        attrs = self.attrs
+        last_idx = self.last_idx
+        stack = [(payload, 0)]
+        while stack:
+            obj, idx = stack.pop()
+            if isinstance(obj, list):
+                stack.extend((nested_obj, idx) for nested_obj in obj)
+            elif isinstance(obj, dict):
+                val = obj.get(attrs[idx])
+                if val is None:
+                    continue
+                if idx == last_idx:
+                    if isinstance(val, (set, list)):
+                        values.update(str(v) for v in val)
+                    else:
+                        values.add(str(val))
+                else:
+                    stack.append((val, idx + 1))
             else:
-                yield str(val)
-        else:
-            yield from get_flattened_payload_values(val, attrs)
-    else:
-        logger.warning("Wrong payload filter attribute %s", attrs)
+                logger.warning("Wrong payload filter attribute %s", list(attrs[idx:]))
+        return frozenset(values)
+
+    def get_cached_values(self, payload, payload_values_cache):
+        """Flattened values memoized per event, shared by all the probes testing the same attribute."""
+        try:
+            return payload_values_cache[self.attribute]
+        except KeyError:
+            values = payload_values_cache[self.attribute] = self.get_values(payload)
+            return values
 
 
 class PayloadFilter(object):
@@ -178,10 +205,15 @@ class PayloadFilter(object):
                 continue
             self.items.append((attribute, operator, values))
         self.items.sort()
+        self.compiled_items = [(PayloadAttributePath(attribute), operator, values)
+                               for attribute, operator, values in self.items]
 
-    def test_event_payload(self, payload):
-        for payload_attribute, operator, filter_value_set in self.items:
-            payload_value_set = set(get_flattened_payload_values(payload, payload_attribute.split(".")))
+    def test_event_payload(self, payload, payload_values_cache=None):
+        for payload_attribute_path, operator, filter_value_set in self.compiled_items:
+            if payload_values_cache is None:
+                payload_value_set = payload_attribute_path.get_values(payload)
+            else:
+                payload_value_set = payload_attribute_path.get_cached_values(payload, payload_values_cache)
             common_values = filter_value_set & payload_value_set
             if (operator == self.IN and not common_values) or (operator == self.NOT_IN and common_values):
                 # AND: all items of a payload filter must match
@@ -357,11 +389,11 @@ class BaseProbe(object):
                 return True
         return False
 
-    def _test_event_payload(self, payload):
+    def _test_event_payload(self, payload, payload_values_cache=None):
         if not self.payload_filters:
             return True
         for payload_filter in self.payload_filters:
-            if payload_filter.test_event_payload(payload):
+            if payload_filter.test_event_payload(payload, payload_values_cache):
                 # no need to check the other filters (OR)
                 return True
         return False
@@ -382,7 +414,7 @@ class BaseProbe(object):
                 return False
         elif not self._test_event_metadata(metadata):
             return False
-        if not self._test_event_payload(event.payload):
+        if self.payload_filters and not self._test_event_payload(event.payload, event.payload_values_cache):
             return False
         return True
 
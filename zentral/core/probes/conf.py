@@ -86,6 +86,67 @@ class ProbesDict(ProbeView):
             return self._probes.get(*args, **kwargs)
 
 
+class ProbeMatcher(ProbeView):
+    """Index the probes by event types and event tags.
+
+    Only the probes indexed under the event type or one of the event tags,
+    and the probes without metadata filters, are tested against an event.
+    The probes are always tested in the parent order.
+    """
+
+    def __init__(self, parent=None, with_sync=False):
+        super().__init__(parent, with_sync=with_sync)
+        self._unindexed_probe_idxs = None
+        self._event_type_probe_idxs = None
+        self._event_tag_probe_idxs = None
+
+    def _index_probe(self, probe_idx, probe):
+        if not probe.metadata_filters:
+            self._unindexed_probe_idxs.append(probe_idx)
+            return
+        for metadata_filter in probe.metadata_filters:
+            if metadata_filter.event_types:
+                # the event type is a necessary condition for this filter.
+                # no need to index the event tags.
+                for event_type in metadata_filter.event_types:
+                    self._event_type_probe_idxs.setdefault(event_type, set()).add(probe_idx)
+            elif metadata_filter.event_tags:
+                for event_tag in metadata_filter.event_tags:
+                    self._event_tag_probe_idxs.setdefault(event_tag, set()).add(probe_idx)
+            else:
+                # empty metadata filter, matches all events
+                self._unindexed_probe_idxs.append(probe_idx)
+                return
+
+    def _load(self):
+        self._start_sync()
+        if self._probes is None:
+            self._probes = []
+            self._unindexed_probe_idxs = []
+            self._event_type_probe_idxs = {}
+            self._event_tag_probe_idxs = {}
+            for probe in self.iter_parent_probes():
+                if not probe.loaded:
+                    # never matches
+                    continue
+                self._index_probe(len(self._probes), probe)
+                self._probes.append(probe)
+
+    def event_filtered(self, event):
+        with self._lock:
+            self._load()
+            probes = self._probes
+            probe_idxs = set(self._unindexed_probe_idxs)
+            probe_idxs.update(self._event_type_probe_idxs.get(event.event_type, ()))
+            if self._event_tag_probe_idxs:
+                for event_tag in event.metadata.all_tags:
+                    probe_idxs.update(self._event_tag_probe_idxs.get(event_tag, ()))
+        for probe_idx in sorted(probe_idxs):
+            probe = probes[probe_idx]
+            if probe.test_event(event):
+                yield probe
+
+
 class ProbeList(ProbeView):
     def __init__(self, parent=None, filter_func=None, with_sync=False):
         super(ProbeList, self).__init__(parent, with_sync=with_sync)
@@ -116,6 +177,11 @@ class ProbeList(ProbeView):
         self._children.add(child)
         return child
 
+    def matcher(self):
+        child = ProbeMatcher(self)
+        self._children.add(child)
+        return child
+
     def event_filtered(self, event):
         def _filter(probe):
             return probe.test_event(event)
@@ -128,3 +194,4 @@ zentral_probes_sync = os.environ.get("ZENTRAL_PROBES_SYNC", "1") == "1"
 
 all_probes = ProbeList(with_sync=zentral_probes_sync)
 all_probes_dict = all_probes.dict(item_func=lambda p: [(p.pk, p)], unique_key=True)
+all_probes_matcher = all_probes.matcher()
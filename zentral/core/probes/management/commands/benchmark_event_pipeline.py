@@ -0,0 +1,278 @@
+from collections import deque
+import json
+import random
+import statistics
+import time
+import tracemalloc
+from django.core.management.base import BaseCommand
+from zentral.core.events import event_types
+from zentral.core.events.base import EventMetadata, EventRequest
+from zentral.core.events.pipeline import enrich_event, process_event
+from zentral.core.probes.conf import ProbeList
+from zentral.core.probes.models import ProbeSource
+from zentral.core.stores.backends.base import BaseEventStore
+
+
+class BenchmarkPreprocessor:
+    """Stand-in for the app preprocessors. Builds the events from the synthetic raw events."""
+    routing_key = "zentral_benchmark"
+
+    def process_raw_event(self, raw_event):
+        event_cls = event_types[raw_event["event_type"]]
+        request_d = raw_event["request"]
+        metadata = EventMetadata(machine_serial_number=raw_event["serial_number"],
+                                 request=EventRequest(request_d["user_agent"], request_d["ip"]))
+        yield event_cls(metadata, raw_event["payload"])
+
+
+class BenchmarkQueue:
+    """Stand-in for the queues. The messages are JSON serialized, like with the kombu workers."""
+
+    def __init__(self):
+        self.messages = deque()
+
+    def publish(self, body):
+        self.messages.append(json.dumps(body))
+
+    def __iter__(self):
+        while self.messages:
+            yield json.loads(self.messages.popleft())
+
+    def __len__(self):
+        return len(self.messages)
+
+
+class BenchmarkEventStore(BaseEventStore):
+    """Stand-in for the event stores. The serialized events are kept in memory."""
+    max_batch_size = 10000
+
+    def __init__(self, config_d):
+        super().__init__(config_d)
+        self.documents = []
+
+    def _serialize_event(self, event):
+        if not isinstance(event, dict):
+            event_d = event.serialize()
+        else:
+            event_d = event
+        metadata = event_d["_zentral"]
+        return json.dumps(event_d).encode("utf-8"), metadata["id"], metadata["index"]
+
+    def store(self, event):
+        self.wait_and_configure_if_necessary()
+        data, _, _ = self._serialize_event(event)
+        self.documents.append(data)
+
+    def bulk_store(self, events):
+        self.wait_and_configure_if_necessary()
+        if self.batch_size < 2:
+            raise RuntimeError("bulk_store is not available when batch_size < 2")
+        event_keys = []
+        for event in events:
+            data, event_id, event_index = self._serialize_event(event)
+            self.documents.append(data)
+            event_keys.append((event_id, event_index))
+        yield from event_keys
+
+
+class Command(BaseCommand):
+    help = ('Benchmark the event pipeline stages (preprocess, enrich, process, store, bulk_store) '
+            'in-process, with synthetic events, local queues and an in-memory store')
+
+    stages = ("preprocess", "enrich", "process", "store", "bulk_store")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--event-count', type=int, default=5000)
+        parser.add_argument('--probe-counts', type=int, nargs="+", default=[10, 100, 1000])
+        parser.add_argument('--payload-sizes', type=int, nargs="+", default=[256, 4096],
+                            help="approximate size of the serialized event payloads, in bytes")
+        parser.add_argument('--machine-counts', type=int, nargs="+", default=[100, 10000])
+        parser.add_argument('--tag-probe-ratio', type=float, default=0.1,
+                            help="ratio of probes with event tags metadata filters")
+        parser.add_argument('--payload-probe-ratio', type=float, default=0.1,
+                            help="ratio of probes with payload filters")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="store batch size used for the bulk_store stage")
+        parser.add_argument('--stages', nargs="+", choices=self.stages, default=list(self.stages))
+        parser.add_argument('--skip-memory', action='store_true',
+                            help="do not run the stages a second time to measure the peak memory")
+        parser.add_argument('--seed', type=int, default=0)
+
+    # corpus
+
+    def get_event_type_list(self):
+        # only the event types that can be built and serialized with a synthetic payload
+        event_type_list = []
+        for event_type, event_cls in sorted(event_types.items()):
+            try:
+                event_cls(EventMetadata(machine_serial_number="0123456789"), {"items": []}).serialize()
+            except Exception:
+                continue
+            event_type_list.append(event_type)
+        return event_type_list
+
+    def build_payload(self, payload_size, rng):
+        item_count = max(1, payload_size // 48)
+        return {"items": [{"key": f"key{rng.randrange(item_count)}",
+                           "value": rng.getrandbits(64)} for _ in range(item_count)]}
+
+    def build_raw_events(self, count, event_type_list, payload_size, machine_count, rng):
+        serial_numbers = [f"ZBENCH{i:08d}" for i in range(machine_count)]
+        return [{"event_type": rng.choice(event_type_list),
+                 "serial_number": rng.choice(serial_numbers),
+                 "request": {"user_agent": "zentral/benchmark",
+                             "ip": f"10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(256)}"},
+                 "payload": self.build_payload(payload_size, rng)}
+                for _ in range(count)]
+
+    def build_probes(self, count, event_type_list, event_tag_list, options, rng):
+        probes = []
+        for pk in range(1, count + 1):
+            r = rng.random()
+            body = {"filters": {"metadata": [{"event_types": rng.sample(event_type_list, 2)}]}}
+            if r < options["tag_probe_ratio"]:
+                body = {"filters": {"metadata": [{"event_tags": [rng.choice(event_tag_list)]}]}}
+            elif r < options["tag_probe_ratio"] + options["payload_probe_ratio"]:
+                body["filters"]["payload"] = [[{"attribute": "items.key",
+                                                "operator": "IN",
+                                                "values": [f"key{rng.randrange(8)}"]}]]
+            probe_source = ProbeSource(pk=pk, model="BaseProbe", name=f"probe {pk}",
+                                       status=ProbeSource.ACTIVE, body=body)
+            probes.append(probe_source.load())
+        return probes
+
+    # stages
+    # each stage consumes the messages of its input queue, and returns the latencies
+
+    def run_preprocess(self, input_queue, output_queue):
+        preprocessor = BenchmarkPreprocessor()
+        latencies = []
+        for raw_event in input_queue:
+            start = time.perf_counter()
+            for event in preprocessor.process_raw_event(raw_event):
+                output_queue.publish(event.serialize(machine_metadata=False))
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    def run_enrich(self, input_queue, output_queue):
+        latencies = []
+        for body in input_queue:
+            start = time.perf_counter()
+            for event in enrich_event(body, self.probes_matcher):
+                output_queue.publish(event.serialize(machine_metadata=True))
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    def run_process(self, input_queue, _):
+        latencies = []
+        for body in input_queue:
+            start = time.perf_counter()
+            process_event(body, self.probes_dict)
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    def run_store(self, input_queue, _):
+        event_store = BenchmarkEventStore({"store_name": "benchmark"})
+        latencies = []
+        for body in input_queue:
+            start = time.perf_counter()
+            if event_store.is_serialized_event_included(body):
+                event_store.store(body)
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    def run_bulk_store(self, input_queue, _):
+        event_store = BenchmarkEventStore({"store_name": "benchmark", "batch_size": self.batch_size})
+        latencies = []
+        batch = []
+
+        def store_batch():
+            start = time.perf_counter()
+            stored_event_count = sum(1 for _ in event_store.bulk_store(batch))
+            # per event latency
+            latencies.extend([(time.perf_counter() - start) / len(batch)] * stored_event_count)
+            batch.clear()
+
+        for body in input_queue:
+            if event_store.is_serialized_event_included(body):
+                batch.append(body)
+            if len(batch) >= event_store.batch_size:
+                store_batch()
+        if batch:
+            store_batch()
+        return latencies
+
+    def run_stage(self, stage, input_messages, measure_memory):
+        stage_input = BenchmarkQueue()
+        stage_input.messages.extend(input_messages)
+        output_queue = BenchmarkQueue()
+        peak_memory = None
+        if measure_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        latencies = getattr(self, f"run_{stage}")(stage_input, output_queue)
+        duration = time.perf_counter() - start
+        if measure_memory:
+            _, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        return latencies, duration, peak_memory, list(output_queue.messages)
+
+    def write_stage_results(self, label, stage, latencies, duration, peak_memory):
+        if len(latencies) > 1:
+            percentiles = statistics.quantiles(latencies, n=100)
+            p50, p99 = percentiles[49], percentiles[98]
+        elif latencies:
+            p50 = p99 = latencies[0]
+        else:
+            p50 = p99 = 0
+        eps = len(latencies) / duration if duration else 0
+        peak_memory = "-" if peak_memory is None else f"{peak_memory / 2**20:.1f}MiB"
+        self.stdout.write(f"{label} {stage:>10} {len(latencies):>8} {eps:>10.0f} "
+                          f"{1000 * p50:>8.3f}ms {1000 * p99:>8.3f}ms {peak_memory:>10}")
+
+    def run_stages(self, label, raw_events, options):
+        # preprocess → enrich → process & stores, like the workers
+        enrich_input = enriched_events = None
+        for stage in self.stages:
+            if stage == "preprocess":
+                stage_input = raw_events
+            elif stage == "enrich":
+                stage_input = enrich_input
+            else:
+                stage_input = enriched_events
+                if stage not in options["stages"]:
+                    continue
+            latencies, duration, peak_memory, output = self.run_stage(stage, stage_input, False)
+            if stage == "preprocess":
+                enrich_input = output
+            elif stage == "enrich":
+                enriched_events = output
+            if stage not in options["stages"]:
+                continue
+            if not options["skip_memory"]:
+                _, _, peak_memory, _ = self.run_stage(stage, stage_input, True)
+            self.write_stage_results(label, stage, latencies, duration, peak_memory)
+
+    def handle(self, **options):
+        self.batch_size = options["batch_size"]
+        rng = random.Random(options["seed"])
+        event_type_list = self.get_event_type_list()
+        event_tag_list = sorted({tag for event_type in event_type_list for tag in event_types[event_type].tags})
+        self.stdout.write(f"{len(event_type_list)} event types, {len(event_tag_list)} event tags, "
+                          f"{options['event_count']} events, bulk_store batch size {self.batch_size}")
+        self.stdout.write(f"{'probes':>7} {'payload':>8} {'machines':>8} {'stage':>10} {'events':>8} "
+                          f"{'ev/s':>10} {'p50':>10} {'p99':>10} {'peak mem':>10}")
+        for probe_count in options["probe_counts"]:
+            probes = ProbeList(self.build_probes(probe_count, event_type_list, event_tag_list, options, rng))
+            # used instead of the probe views of the pipeline
+            self.probes_matcher = probes.matcher()
+            self.probes_dict = probes.dict(item_func=lambda p: [(p.pk, p)], unique_key=True)
+            for payload_size in options["payload_sizes"]:
+                for machine_count in options["machine_counts"]:
+                    raw_events = [
+                        json.dumps(raw_event)
+                        for raw_event in self.build_raw_events(options["event_count"], event_type_list,
+                                                               payload_size, machine_count, rng)
+                    ]
+                    label = f"{probe_count:>7} {payload_size:>8} {machine_count:>8}"
+                    self.run_stages(label, raw_events, options)
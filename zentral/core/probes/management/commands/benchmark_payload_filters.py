@@ -0,0 +1,171 @@
+import logging
+import random
+import time
+from django.core.management.base import BaseCommand
+from zentral.core.probes.base import PayloadFilter
+
+
+logger = logging.getLogger("zentral.core.probes.management.commands.benchmark_payload_filters")
+
+
+def get_flattened_payload_values(payload, attrs):
+    # recursive flattening, before the compiled attribute paths
+    if isinstance(payload, list):
+        for nested_payload in payload:
+            yield from get_flattened_payload_values(nested_payload, list(attrs))
+    elif isinstance(payload, dict):
+        attr = attrs.pop(0)
+        val = payload.get(attr)
+        if val is None:
+            return
+        if not attrs:
+            if isinstance(val, (set, list)):
+                yield from (str(v) for v in val)
+            else:
+                yield str(val)
+        else:
+            yield from get_flattened_payload_values(val, attrs)
+    else:
+        logger.warning("Wrong payload filter attribute %s", attrs)
+
+
+def random_hex(rng, length):
+    return "".join(rng.choice("0123456789abcdef") for _ in range(length))
+
+
+def build_santa_payload(rng):
+    team_id = random_hex(rng, 10).upper()
+    return {
+        "current_sessions": [f"user{i}@console" for i in range(rng.randrange(3))],
+        "decision": rng.choice(["ALLOW_BINARY", "ALLOW_UNKNOWN", "BLOCK_BINARY", "BLOCK_UNKNOWN"]),
+        "executing_user": rng.choice(["root", "user0", "user1"]),
+        "file_bundle_id": f"com.example.app{rng.randrange(100)}",
+        "file_bundle_name": "App",
+        "file_bundle_version": "1.0",
+        "file_name": f"bin{rng.randrange(100)}",
+        "file_path": "/Applications/App.app/Contents/MacOS",
+        "file_sha256": random_hex(rng, 64),
+        "logged_in_users": ["user0"],
+        "parent_name": "launchd",
+        "pid": rng.randrange(10000),
+        "ppid": 1,
+        "signing_id": f"{team_id}:com.example.app{rng.randrange(100)}",
+        "team_id": team_id,
+        "signing_chain": [
+            {"cn": f"Developer ID Application: Example {rng.randrange(10)}",
+             "ou": team_id, "org": "Example", "sha256": random_hex(rng, 64),
+             "valid_from": 1172268176, "valid_until": 1421272976},
+            {"cn": "Developer ID Certification Authority", "ou": "Apple Certification Authority",
+             "org": "Apple Inc.", "sha256": random_hex(rng, 64),
+             "valid_from": 1171487959, "valid_until": 1423948759},
+            {"cn": "Apple Root CA", "ou": "Apple Certification Authority",
+             "org": "Apple Inc.", "sha256": random_hex(rng, 64),
+             "valid_from": 1146001236, "valid_until": 2054670036},
+        ],
+    }
+
+
+def build_osquery_payload(rng, row_count):
+    return {
+        "name": f"pack/{rng.randrange(10)}/query{rng.randrange(20)}",
+        "action": "snapshot",
+        "hostIdentifier": random_hex(rng, 32),
+        "unixTime": 1700000000 + rng.randrange(100000),
+        "decorations": {"host_uuid": random_hex(rng, 32), "username": rng.choice(["root", "user0"])},
+        "snapshot": [
+            {"path": f"/usr/local/bin/tool{rng.randrange(1000)}",
+             "name": f"tool{rng.randrange(1000)}",
+             "uid": str(rng.randrange(600)),
+             "cmdline": f"tool --option {rng.randrange(100)}",
+             "children": [{"pid": str(rng.randrange(10000)), "name": f"child{rng.randrange(100)}"}
+                          for _ in range(3)]}
+            for _ in range(row_count)
+        ],
+    }
+
+
+SANTA_ATTRIBUTES = (("decision", lambda rng: rng.choice(["BLOCK_BINARY", "BLOCK_UNKNOWN"])),
+                    ("file_bundle_id", lambda rng: f"com.example.app{rng.randrange(100)}"),
+                    ("signing_chain.cn", lambda rng: f"Developer ID Application: Example {rng.randrange(10)}"),
+                    ("signing_chain.org", lambda rng: "Apple Inc."),
+                    ("signing_chain.sha256", lambda rng: random_hex(rng, 64)),
+                    ("executing_user", lambda rng: "root"))
+
+
+OSQUERY_ATTRIBUTES = (("name", lambda rng: f"pack/{rng.randrange(10)}/query{rng.randrange(20)}"),
+                      ("decorations.username", lambda rng: "root"),
+                      ("snapshot.path", lambda rng: f"/usr/local/bin/tool{rng.randrange(1000)}"),
+                      ("snapshot.uid", lambda rng: "0"),
+                      ("snapshot.children.name", lambda rng: f"child{rng.randrange(100)}"))
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the probe payload filters, legacy flattening vs. compiled attribute paths'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--probe-counts', type=int, nargs="+", default=[10, 100, 1000])
+        parser.add_argument('--event-count', type=int, default=2000)
+        parser.add_argument('--osquery-rows', type=int, default=50,
+                            help="number of rows in the osquery snapshot results")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def build_payload_filters(self, count, attributes, rng):
+        payload_filters = []
+        for _ in range(count):
+            payload_filters.append(PayloadFilter([
+                {"attribute": attribute,
+                 "operator": rng.choice([PayloadFilter.IN, PayloadFilter.IN, PayloadFilter.NOT_IN]),
+                 "values": [value_func(rng) for _ in range(rng.randrange(1, 4))]}
+                for attribute, value_func in rng.sample(attributes, rng.randrange(1, 3))
+            ]))
+        return payload_filters
+
+    @staticmethod
+    def legacy_test_event_payload(payload_filter, payload):
+        # PayloadFilter.test_event_payload before the compiled attribute paths
+        for payload_attribute, operator, filter_value_set in payload_filter.items:
+            payload_value_set = set(get_flattened_payload_values(payload, payload_attribute.split(".")))
+            common_values = filter_value_set & payload_value_set
+            if ((operator == PayloadFilter.IN and not common_values)
+                    or (operator == PayloadFilter.NOT_IN and common_values)):
+                return False
+        return True
+
+    def run_benchmark(self, payload_filters, payloads, mode):
+        match_count = 0
+        start = time.perf_counter()
+        for payload in payloads:
+            if mode == "legacy":
+                for payload_filter in payload_filters:
+                    match_count += self.legacy_test_event_payload(payload_filter, payload)
+            elif mode == "compiled":
+                for payload_filter in payload_filters:
+                    match_count += payload_filter.test_event_payload(payload)
+            else:
+                # one cache per event, shared by all the probes
+                payload_values_cache = {}
+                for payload_filter in payload_filters:
+                    match_count += payload_filter.test_event_payload(payload, payload_values_cache)
+        return len(payloads) / (time.perf_counter() - start), match_count
+
+    def handle(self, **options):
+        rng = random.Random(options["seed"])
+        corpora = (
+            ("santa", SANTA_ATTRIBUTES, [build_santa_payload(rng) for _ in range(options["event_count"])]),
+            ("osquery", OSQUERY_ATTRIBUTES, [build_osquery_payload(rng, options["osquery_rows"])
+                                             for _ in range(options["event_count"])]),
+        )
+        self.stdout.write(f"{options['event_count']} events per payload type, "
+                          f"{options['osquery_rows']} rows per osquery result")
+        self.stdout.write(f"{'payload':>8} {'probes':>7} {'legacy ev/s':>12} {'compiled ev/s':>14} "
+                          f"{'memoized ev/s':>14} {'speedup':>8} {'matches':>8}")
+        for label, attributes, payloads in corpora:
+            for probe_count in options["probe_counts"]:
+                payload_filters = self.build_payload_filters(probe_count, attributes, rng)
+                legacy_eps, legacy_matches = self.run_benchmark(payload_filters, payloads, "legacy")
+                compiled_eps, compiled_matches = self.run_benchmark(payload_filters, payloads, "compiled")
+                memoized_eps, memoized_matches = self.run_benchmark(payload_filters, payloads, "memoized")
+                if not legacy_matches == compiled_matches == memoized_matches:
+                    self.stderr.write(f"Match count mismatch: {legacy_matches} {compiled_matches} {memoized_matches}")
+                self.stdout.write(f"{label:>8} {probe_count:>7} {legacy_eps:>12.0f} {compiled_eps:>14.0f} "
+                                  f"{memoized_eps:>14.0f} {memoized_eps / legacy_eps:>7.1f}x {memoized_matches:>8}")
@@ -0,0 +1,64 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from zentral.core.events import event_types
+from zentral.core.events.base import EventMetadata
+from zentral.core.probes.conf import ProbeList, ProbeMatcher
+from zentral.core.probes.models import ProbeSource
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the event → probes matching, linear scan vs. indexed matcher'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--probe-counts', type=int, nargs="+", default=[10, 100, 500, 1000])
+        parser.add_argument('--event-count', type=int, default=5000)
+        parser.add_argument('--tag-probe-ratio', type=float, default=0.1,
+                            help="ratio of probes with event tags metadata filters")
+        parser.add_argument('--unfiltered-probe-ratio', type=float, default=0.01,
+                            help="ratio of probes without metadata filters")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def build_probes(self, count, event_type_list, event_tag_list, options, rng):
+        probes = []
+        for pk in range(1, count + 1):
+            r = rng.random()
+            if r < options["unfiltered_probe_ratio"]:
+                body = {}
+            elif r < options["unfiltered_probe_ratio"] + options["tag_probe_ratio"]:
+                body = {"filters": {"metadata": [{"event_tags": [rng.choice(event_tag_list)]}]}}
+            else:
+                body = {"filters": {"metadata": [{"event_types": rng.sample(event_type_list, 2)}]}}
+            probe_source = ProbeSource(pk=pk, model="BaseProbe", name=f"probe {pk}",
+                                       status=ProbeSource.ACTIVE, body=body)
+            probes.append(probe_source.load())
+        return probes
+
+    def build_events(self, count, rng):
+        event_classes = list(event_types.values())
+        return [rng.choice(event_classes)(EventMetadata(), {}) for _ in range(count)]
+
+    def run_benchmark(self, probe_view, events):
+        match_count = 0
+        start = time.perf_counter()
+        for event in events:
+            for _ in probe_view.event_filtered(event):
+                match_count += 1
+        return len(events) / (time.perf_counter() - start), match_count
+
+    def handle(self, **options):
+        rng = random.Random(options["seed"])
+        event_type_list = sorted(event_types.keys())
+        event_tag_list = sorted({tag for event_cls in event_types.values() for tag in event_cls.tags})
+        events = self.build_events(options["event_count"], rng)
+        self.stdout.write(f"{len(event_type_list)} event types, {len(event_tag_list)} event tags, "
+                          f"{len(events)} events")
+        self.stdout.write(f"{'probes':>8} {'linear ev/s':>12} {'indexed ev/s':>13} {'speedup':>8} {'matches':>8}")
+        for probe_count in options["probe_counts"]:
+            probes = self.build_probes(probe_count, event_type_list, event_tag_list, options, rng)
+            linear_eps, linear_matches = self.run_benchmark(ProbeList(probes), events)
+            indexed_eps, indexed_matches = self.run_benchmark(ProbeMatcher(probes), events)
+            if linear_matches != indexed_matches:
+                self.stderr.write(f"Match count mismatch: {linear_matches} != {indexed_matches}")
+            self.stdout.write(f"{probe_count:>8} {linear_eps:>12.0f} {indexed_eps:>13.0f} "
+                              f"{indexed_eps / linear_eps:>7.1f}x {indexed_matches:>8}")
@@ -150,7 +150,7 @@ class ProcessWorker(WorkerMixin, Consumer):
         ("processed_events", "event_type"),
     )
 
-    def __init__(self, event_queues, process_event):
+    def __init__(self, event_queues, process_event, stop_process_event=None):
         super().__init__(
             event_queues.setup_queue(
                 "process-enriched-events",
@@ -159,11 +159,16 @@ class ProcessWorker(WorkerMixin, Consumer):
             event_queues.client_kwargs
         )
         self._process_event = process_event
+        self._stop_process_event = stop_process_event
 
     def run(self, *args, **kwargs):
         self.log_info("run")
         super().setup_metrics_exporter(*args, **kwargs)
-        super().run(*args, **kwargs)
+        try:
+            super().run(*args, **kwargs)
+        finally:
+            if self._stop_process_event:
+                self._stop_process_event()
 
     def process_event(self, routing_key, event_d):
         self.log_debug("process event")
@@ -493,11 +498,11 @@ class EventQueues(BaseEventQueues):
     def get_preprocess_worker(self):
         return PreprocessWorker(self)
 
-    def get_enrich_worker(self, enrich_event):
+    def get_enrich_worker(self, enrich_event, enrich_events=None):
         return EnrichWorker(self, enrich_event)
 
-    def get_process_worker(self, process_event):
-        return ProcessWorker(self, process_event)
+    def get_process_worker(self, process_event, stop_process_event=None):
+        return ProcessWorker(self, process_event, stop_process_event)
 
     def get_store_worker(self, event_store):
         if event_store.batch_size > 1:
@@ -1,3 +1,6 @@
+from contextlib import contextmanager
+
+
 class BaseEventQueues:
     def __init__(self, config_d):
         pass
@@ -7,10 +10,10 @@ class BaseEventQueues:
     def get_preprocess_worker(self):
         raise NotImplementedError
 
-    def get_enrich_worker(self, enrich_event):
+    def get_enrich_worker(self, enrich_event, enrich_events=None):
         raise NotImplementedError
 
-    def get_process_worker(self, process_event):
+    def get_process_worker(self, process_event, stop_process_event=None):
         raise NotImplementedError
 
     def get_store_worker(self, event_store):
@@ -24,6 +27,19 @@ class BaseEventQueues:
     def post_event(self, event):
         raise NotImplementedError
 
+    @contextmanager
+    def batch_posting(self):
+        """Context manager to group the events posted in the current thread
+
+        The backends can override it to publish the events in batches.
+        """
+        yield
+
+    def post_events(self, events):
+        with self.batch_posting():
+            for event in events:
+                self.post_event(event)
+
     # stop
 
     def stop(self):
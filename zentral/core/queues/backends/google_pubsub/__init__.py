@@ -96,9 +96,17 @@ class ProcessWorker(Consumer):
         ("processed_events", "event_type"),
     )
 
-    def __init__(self, enriched_events_topic, credentials, process_event):
+    def __init__(self, enriched_events_topic, credentials, process_event, stop_process_event=None):
         super().__init__(enriched_events_topic, credentials)
         self.process_event = process_event
+        self.stop_process_event = stop_process_event
+
+    def run(self, *args, **kwargs):
+        try:
+            return super().run(*args, **kwargs)
+        finally:
+            if self.stop_process_event:
+                self.stop_process_event()
 
     def callback(self, message):
         event_dict = json.loads(message.data)
@@ -408,11 +416,11 @@ class EventQueues(BaseEventQueues):
     def get_preprocess_worker(self):
         return PreprocessWorker(self.raw_events_topic, self.events_topic, self.credentials)
 
-    def get_enrich_worker(self, enrich_event):
+    def get_enrich_worker(self, enrich_event, enrich_events=None):
         return EnrichWorker(self.events_topic, self.enriched_events_topic, self.credentials, enrich_event)
 
-    def get_process_worker(self, process_event):
-        return ProcessWorker(self.enriched_events_topic, self.credentials, process_event)
+    def get_process_worker(self, process_event, stop_process_event=None):
+        return ProcessWorker(self.enriched_events_topic, self.credentials, process_event, stop_process_event)
 
     def get_store_worker(self, event_store):
         if event_store.batch_size > 1:
@@ -1,10 +1,18 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from importlib import import_module
 import logging
+import queue
+import threading
 import time
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections
 from zentral.conf import settings
-from kombu import Connection, Consumer, Exchange, Queue
+from amqp.exceptions import MessageNacked
+from kombu import Connection, Consumer, Exchange, Producer, Queue
 from kombu.mixins import ConsumerMixin, ConsumerProducerMixin
-from kombu.pools import producers
+from kombu.pools import connections, producers
 from zentral.core.queues.backends.base import BaseEventQueues
 from zentral.core.queues.exceptions import RetryLater
 from zentral.utils.json import save_dead_letter
@@ -25,9 +33,35 @@ process_events_queue = Queue('process_events',
                              durable=True)
 
 
+retry_events_exchange = Exchange('retry_events', type='direct', durable=True)
+
+
+def get_retry_queue(queue_name, retry_delay):
+    # the messages expire after the retry delay, and are dead-lettered back to the original queue
+    retry_queue_name = f"{queue_name}_retry_{retry_delay}s"
+    return Queue(retry_queue_name,
+                 exchange=retry_events_exchange,
+                 routing_key=retry_queue_name,
+                 durable=True,
+                 queue_arguments={"x-message-ttl": retry_delay * 1000,
+                                  "x-dead-letter-exchange": "",
+                                  "x-dead-letter-routing-key": queue_name})
+
+
 class BaseWorker:
     name = "UNDEFINED"
     counters = []
+    prefetch_count = None
+
+    def configure_prefetch_count(self, worker_config, default=None, minimum=1):
+        # default: no prefetch limit (min 1, max 10000)
+        prefetch_count = worker_config.get("prefetch_count", default)
+        if prefetch_count is not None:
+            try:
+                prefetch_count = min(max(minimum, int(prefetch_count)), max(minimum, 10000))
+            except (TypeError, ValueError):
+                raise ImproperlyConfigured(f"{self.name} prefetch_count must be an integer")
+        self.prefetch_count = prefetch_count
 
     def setup_metrics_exporter(self, *args, **kwargs):
         self.metrics_exporter = kwargs.pop("metrics_exporter", None)
@@ -53,15 +87,235 @@ class BaseWorker:
         self.log(msg, logging.ERROR, *args)
 
 
-class PreprocessWorker(ConsumerProducerMixin, BaseWorker):
+class PipelineWorker(ConsumerProducerMixin, BaseWorker):
+    """Base class for the preprocess, enrich and process workers
+
+    The messages are handled in the consumer thread, or in a thread pool if the concurrency is > 1.
+    In both cases, the resulting events are published, and the messages acknowledged, in the consumer thread.
+    The messages that cannot be handled are published to a retry queue, and dead-lettered back
+    to their original queue after the retry delay.
+    If the worker supports it, the messages can be handled in batches (see handle_messages).
+    """
+    processed_counter = "UNDEFINED"
+    retry_header = "x-zentral-retries"
+    # consumer loop interval when the messages are handled in the thread pool
+    concurrent_safety_interval = 0.1  # seconds
+    max_batch_size = 1
+    max_batch_age_seconds = 1
+
+    def __init__(self, connection, worker_config=None):
+        self.connection = connection
+        self.configure(worker_config or {})
+        self.executor = None
+        self.batch = []
+        self.batch_start_ts = None
+        self.handled_messages = queue.Queue()
+        # incremented when the connection is revived, to drop the results bound to the previous channel
+        self.channel_generation = 0
+
+    def configure(self, worker_config):
+        try:
+            # default: 1 (min 1, max 100)
+            self.concurrency = min(max(1, int(worker_config.get("concurrency", 1))), 100)
+        except (TypeError, ValueError):
+            raise ImproperlyConfigured(f"{self.name} concurrency must be an integer")
+        try:
+            # default: 10s (min 1s, max 1h)
+            self.retry_delay = min(max(1, int(worker_config.get("retry_delay", 10))), 3600)
+        except (TypeError, ValueError):
+            raise ImproperlyConfigured(f"{self.name} retry_delay must be an integer")
+        try:
+            # default: 100 (min 1, max 10000)
+            self.max_retries = min(max(1, int(worker_config.get("max_retries", 100))), 10000)
+        except (TypeError, ValueError):
+            raise ImproperlyConfigured(f"{self.name} max_retries must be an integer")
+        try:
+            # default: 1 (min 1, max max_batch_size)
+            self.batch_size = min(max(1, int(worker_config.get("batch_size", 1))), self.max_batch_size)
+        except (TypeError, ValueError):
+            raise ImproperlyConfigured(f"{self.name} batch_size must be an integer")
+        if self.concurrency > 1:
+            # keep the thread pool busy
+            self.configure_prefetch_count(worker_config,
+                                          default=2 * self.concurrency * self.batch_size,
+                                          minimum=self.concurrency * self.batch_size)
+        else:
+            # the broker must be able to deliver a full batch
+            self.configure_prefetch_count(worker_config,
+                                          default=self.batch_size if self.batch_size > 1 else None,
+                                          minimum=self.batch_size)
+
+    def run(self, *args, **kwargs):
+        self.log_info("run")
+        super().setup_metrics_exporter(*args, **kwargs)
+        if self.concurrency > 1:
+            self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix=self.name)
+            kwargs.setdefault("safety_interval", self.concurrent_safety_interval)
+        try:
+            super().run(*args, **kwargs)
+        finally:
+            if self.executor:
+                self.executor.shutdown(wait=True)
+                self.executor = None
+
+    def get_queues(self):
+        raise NotImplementedError
+
+    def get_consumers(self, _, default_channel):
+        return [Consumer(default_channel,
+                         queues=self.get_queues(),
+                         accept=['json'],
+                         prefetch_count=self.prefetch_count,
+                         callbacks=[self.on_message])]
+
+    def get_queue_name(self, message):
+        raise NotImplementedError
+
+    def handle_message(self, body, message):
+        """Handle the message body. Called in the consumer thread or in a thread pool thread.
+
+        Returns the processed counter label, and an iterator of (serialized event, exchange, event type)
+        to publish.
+        """
+        raise NotImplementedError
+
+    def handle_messages(self, batch):
+        """Handle a batch of (body, message). Called in the consumer thread or in a thread pool thread.
+
+        Returns a list of (processed counter label, outputs iterator), one per message.
+        To override in the workers with a max_batch_size > 1.
+        """
+        return [self.handle_message(body, message) for body, message in batch]
+
+    def _handle_batch(self, batch):
+        if len(batch) > 1:
+            try:
+                # the events are built in the handling thread
+                return [(label, list(outputs), None) for label, outputs in self.handle_messages(batch)]
+            except Exception:
+                logger.exception("%s - could not handle batch of %s messages. Handle them one by one.",
+                                 self.name, len(batch))
+        results = []
+        for body, message in batch:
+            try:
+                label, outputs = self.handle_message(body, message)
+                results.append((label, list(outputs), None))
+            except Exception as exception:
+                results.append((None, None, exception))
+        return results
+
+    def _handle_batch_in_pool(self, batch):
+        # the handlers can query the DB, and the pool threads are long lived
+        close_old_connections()
+        try:
+            return self._handle_batch(batch)
+        finally:
+            close_old_connections()
+
+    def on_message(self, body, message):
+        self.batch.append((body, message))
+        if len(self.batch) >= self.batch_size:
+            self.dispatch_batch()
+        elif self.batch_start_ts is None:
+            self.batch_start_ts = time.monotonic()
+
+    def dispatch_batch(self):
+        batch = self.batch
+        self.batch = []
+        self.batch_start_ts = None
+        if self.executor is None:
+            for (body, message), result in zip(batch, self._handle_batch(batch)):
+                self.finalize_message(body, message, *result)
+            return
+        channel_generation = self.channel_generation
+        future = self.executor.submit(self._handle_batch_in_pool, batch)
+        future.add_done_callback(
+            lambda f: self.handled_messages.put((channel_generation, batch, f.result()))
+        )
+        self.finalize_handled_messages()
+
+    def finalize_handled_messages(self):
+        while True:
+            try:
+                channel_generation, batch, results = self.handled_messages.get_nowait()
+            except queue.Empty:
+                return
+            if channel_generation != self.channel_generation:
+                # the unacknowledged messages will be redelivered
+                continue
+            for (body, message), result in zip(batch, results):
+                self.finalize_message(body, message, *result)
+
+    def on_iteration(self):
+        if self.batch and time.monotonic() > self.batch_start_ts + self.max_batch_age_seconds:
+            self.dispatch_batch()
+        self.finalize_handled_messages()
+
+    def on_connection_revived(self):
+        self.channel_generation += 1
+        # the delivery tags are bound to the previous channel
+        # the unacknowledged messages will be redelivered
+        self.batch = []
+        self.batch_start_ts = None
+
+    def on_consume_end(self, connection, channel):
+        if self.batch:
+            self.log_debug("handle the batched messages before graceful exit")
+            self.dispatch_batch()
+        if self.executor:
+            self.log_debug("wait for the handled messages before graceful exit")
+            self.executor.shutdown(wait=True)
+            self.executor = None
+            self.finalize_handled_messages()
+        super().on_consume_end(connection, channel)
+
+    def finalize_message(self, body, message, label, outputs, exception):
+        if exception is not None:
+            self.retry_later(body, message, exception)
+            return
+        for serialized_event, exchange, event_type in outputs:
+            self.producer.publish(serialized_event,
+                                  serializer='json',
+                                  exchange=exchange,
+                                  declare=[exchange])
+            self.inc_counter("produced_events", event_type)
+        message.ack()
+        self.inc_counter(self.processed_counter, label)
+
+    def retry_later(self, body, message, exception):
+        queue_name = self.get_queue_name(message)
+        retry_queue = get_retry_queue(queue_name, self.retry_delay)
+        retries = (message.headers or {}).get(self.retry_header, 0) + 1
+        if retries > self.max_retries:
+            logger.error("Message from queue %s could not be processed. Max retries reached. Dead letter.",
+                         queue_name,
+                         exc_info=None if isinstance(exception, RetryLater) else exception)
+            save_dead_letter(body, f"{self.name} error")
+            message.reject()
+            return
+        logger.error("Message from queue %s could not be processed. Retry #%s in %ss.",
+                     queue_name, retries, self.retry_delay,
+                     # RetryLater is expected, no traceback
+                     exc_info=None if isinstance(exception, RetryLater) else exception)
+        self.producer.publish(body,
+                              serializer='json',
+                              exchange=retry_events_exchange,
+                              routing_key=retry_queue.routing_key,
+                              headers={self.retry_header: retries},
+                              declare=[retry_queue])
+        message.ack()
+
+
+class PreprocessWorker(PipelineWorker):
     name = "preprocess worker"
     counters = (
         ("preprocessed_events", "routing_key"),
         ("produced_events", "event_type"),
     )
+    processed_counter = "preprocessed_events"
 
-    def __init__(self, connection):
-        self.connection = connection
+    def __init__(self, connection, worker_config=None):
+        super().__init__(connection, worker_config)
         # preprocessors
         self.preprocessors = {
             preprocessor.routing_key: preprocessor
@@ -77,114 +331,102 @@ class PreprocessWorker(ConsumerProducerMixin, BaseWorker):
             else:
                 yield from getattr(preprocessors_module, "get_preprocessors")()
 
-    def run(self, *args, **kwargs):
-        self.log_info("run")
-        super().setup_metrics_exporter(*args, **kwargs)
-        super().run(*args, **kwargs)
-
-    def get_consumers(self, _, default_channel):
-        queues = [
+    def get_queues(self):
+        return [
             Queue(preprocessor.routing_key, exchange=raw_events_exchange,
                   routing_key=preprocessor.routing_key, durable=True)
             for routing_key, preprocessor in self.preprocessors.items()
         ]
-        return [Consumer(default_channel,
-                         queues=queues,
-                         accept=['json'],
-                         callbacks=[self.do_preprocess_raw_event])]
 
-    def do_preprocess_raw_event(self, body, message):
+    def get_queue_name(self, message):
+        # the preprocessor queues are named after their routing keys
+        return message.delivery_info.get("routing_key")
+
+    def handle_message(self, body, message):
         routing_key = message.delivery_info.get("routing_key")
         if not routing_key:
             logger.error("Message w/o routing key")
-        else:
-            preprocessor = self.preprocessors.get(routing_key)
-            if not preprocessor:
-                logger.error("No preprocessor for routing key %s", routing_key)
-            else:
-                try:
-                    for event in preprocessor.process_raw_event(body):
-                        self.producer.publish(event.serialize(machine_metadata=False),
-                                              serializer='json',
-                                              exchange=events_exchange,
-                                              declare=[events_exchange])
-                        self.inc_counter("produced_events", event.event_type)
-                except RetryLater:
-                    logger.error("Message with routing key %s could not be processed. Re-enqueued", routing_key)
-                    message.requeue()
-                    return
-        message.ack()
-        self.inc_counter("preprocessed_events", routing_key or "UNKNOWN")
-
-
-class EnrichWorker(ConsumerProducerMixin, BaseWorker):
+            return "UNKNOWN", ()
+        preprocessor = self.preprocessors.get(routing_key)
+        if not preprocessor:
+            logger.error("No preprocessor for routing key %s", routing_key)
+            return routing_key, ()
+        return routing_key, (
+            (event.serialize(machine_metadata=False), events_exchange, event.event_type)
+            for event in preprocessor.process_raw_event(body)
+        )
+
+
+class EnrichWorker(PipelineWorker):
     name = "enrich worker"
     counters = (
         ("enriched_events", "event_type"),
         ("produced_events", "event_type"),
     )
-
-    def __init__(self, connection, enrich_event):
-        self.connection = connection
+    processed_counter = "enriched_events"
+    # the incident updates are coalesced across the batches
+    max_batch_size = 1000
+
+    def __init__(self, connection, enrich_event, worker_config=None, enrich_events=None):
+        if enrich_events is None:
+            self.max_batch_size = 1
+        super().__init__(connection, worker_config)
         self.enrich_event = enrich_event
-        self.name = "enrich worker"
+        self.enrich_events = enrich_events
 
-    def run(self, *args, **kwargs):
-        self.log_info("run")
-        super().setup_metrics_exporter(*args, **kwargs)
-        super().run(*args, **kwargs)
+    def get_queues(self):
+        return [enrich_events_queue]
 
-    def get_consumers(self, _, default_channel):
-        return [Consumer(default_channel,
-                         queues=[enrich_events_queue],
-                         accept=['json'],
-                         callbacks=[self.do_enrich_event])]
+    def get_queue_name(self, message):
+        return enrich_events_queue.name
 
-    def do_enrich_event(self, body, message):
+    def handle_message(self, body, message):
         self.log_debug("enrich event")
-        try:
-            for event in self.enrich_event(body):
-                self.producer.publish(event.serialize(machine_metadata=True),
-                                      serializer='json',
-                                      exchange=enriched_events_exchange,
-                                      declare=[enriched_events_exchange])
-                self.inc_counter("produced_events", event.event_type)
-        except Exception as exception:
-            logger.exception("Requeuing message with 1s delay: %s", exception)
-            time.sleep(1)
-            message.requeue()
-        else:
-            message.ack()
-            self.inc_counter("enriched_events", event.event_type)
+        return body['_zentral']['type'], (
+            (event.serialize(machine_metadata=True), enriched_events_exchange, event.event_type)
+            for event in self.enrich_event(body)
+        )
+
+    def handle_messages(self, batch):
+        self.log_debug("enrich %s events", len(batch))
+        return [
+            (body['_zentral']['type'],
+             ((event.serialize(machine_metadata=True), enriched_events_exchange, event.event_type)
+              for event in events))
+            for (body, _), events in zip(batch, self.enrich_events([body for body, _ in batch]))
+        ]
 
 
-class ProcessWorker(ConsumerMixin, BaseWorker):
+class ProcessWorker(PipelineWorker):
     name = "process worker"
     counters = (
         ("processed_events", "event_type"),
     )
+    processed_counter = "processed_events"
 
-    def __init__(self, connection, process_event):
-        self.connection = connection
+    def __init__(self, connection, process_event, worker_config=None, stop_process_event=None):
+        super().__init__(connection, worker_config)
         self.process_event = process_event
+        self.stop_process_event = stop_process_event
 
     def run(self, *args, **kwargs):
-        self.log_info("run")
-        super().setup_metrics_exporter(*args, **kwargs)
-        super().run(*args, **kwargs)
+        try:
+            super().run(*args, **kwargs)
+        finally:
+            if self.stop_process_event:
+                self.log_debug("stop event processing")
+                self.stop_process_event()
 
-    def get_consumers(self, _, default_channel):
-        return [Consumer(default_channel,
-                         queues=[process_events_queue],
-                         accept=['json'],
-                         callbacks=[self.do_process_event])]
+    def get_queues(self):
+        return [process_events_queue]
+
+    def get_queue_name(self, message):
+        return process_events_queue.name
 
-    def do_process_event(self, body, message):
+    def handle_message(self, body, message):
         self.log_debug("process event")
-        event_type = body['_zentral']['type']
         self.process_event(body)
-        message.ack()
-        self.inc_counter("processed_events", event_type)
+        return body['_zentral']['type'], ()
 
 
 class StoreWorker(ConsumerMixin, BaseWorker):
@@ -193,10 +435,11 @@ class StoreWorker(ConsumerMixin, BaseWorker):
         ("stored_events", "event_type"),
     )
 
-    def __init__(self, connection, event_store):
+    def __init__(self, connection, event_store, worker_config=None):
         self.connection = connection
         self.event_store = event_store
         self.name = "store worker {}".format(self.event_store.name)
+        self.configure_prefetch_count(worker_config or {})
         self.input_queue = Queue(('store_events_{}'.format(self.event_store.name)).replace(" ", "_"),
                                  exchange=enriched_events_exchange,
                                  durable=True)
@@ -210,6 +453,7 @@ class StoreWorker(ConsumerMixin, BaseWorker):
         return [Consumer(default_channel,
                          queues=[self.input_queue],
                          accept=['json'],
+                         prefetch_count=self.prefetch_count,
                          callbacks=[self.do_store_event])]
 
     def do_store_event(self, body, message):
@@ -230,27 +474,190 @@ class StoreWorker(ConsumerMixin, BaseWorker):
             self.inc_counter("stored_events", event_type)
 
 
+class BulkStoreWorker(ConsumerMixin, BaseWorker):
+    counters = (
+        ("skipped_events", "event_type"),
+        ("stored_events", "event_type"),
+    )
+    max_event_age_seconds = 5
+
+    def __init__(self, connection, event_store, worker_config=None):
+        self.connection = connection
+        self.event_store = event_store
+        self.name = "store worker {}".format(self.event_store.name)
+        # the broker must be able to deliver a full batch before the first ack
+        self.configure_prefetch_count(worker_config or {},
+                                      default=self.event_store.batch_size,
+                                      minimum=self.event_store.batch_size)
+        self.input_queue = Queue(('store_events_{}'.format(self.event_store.name)).replace(" ", "_"),
+                                 exchange=enriched_events_exchange,
+                                 durable=True)
+        self.batch = deque()
+        self.batch_start_ts = None
+
+    def run(self, *args, **kwargs):
+        self.log_info("run")
+        super().setup_metrics_exporter(*args, **kwargs)
+        super().run(*args, **kwargs)
+
+    def get_consumers(self, _, default_channel):
+        return [Consumer(default_channel,
+                         queues=[self.input_queue],
+                         accept=['json'],
+                         prefetch_count=self.prefetch_count,
+                         callbacks=[self.do_store_event])]
+
+    def on_connection_revived(self):
+        if self.batch:
+            # the delivery tags are bound to the previous channel
+            # the unacknowledged messages will be redelivered
+            self.log_error("drop %d unacknowledged event(s) after reconnection", len(self.batch))
+            self.batch.clear()
+        self.batch_start_ts = None
+
+    def on_iteration(self):
+        if self.batch and time.monotonic() > self.batch_start_ts + self.max_event_age_seconds:
+            self.log_debug("process events because max event age reached")
+            self._process_batch()
+
+    def on_consume_end(self, connection, channel):
+        if self.batch:
+            self.log_debug("process events before graceful exit")
+            self._process_batch()
+
+    def do_store_event(self, body, message):
+        event_type = body['_zentral']['type']
+        if not self.event_store.is_serialized_event_included(body):
+            self.inc_counter("skipped_events", event_type)
+            message.ack()
+            return
+        self.log_debug("queue new event for batch processing")
+        self.batch.append((message, body))
+        if self.batch_start_ts is None:
+            self.batch_start_ts = time.monotonic()
+        if len(self.batch) >= self.event_store.batch_size:
+            self.log_debug("process events because max batch size reached")
+            self._process_batch()
+
+    def _process_batch(self):
+        batch_size = len(self.batch)
+        self.log_debug("store %d events", batch_size)
+        event_info = {}
+
+        def iter_events():
+            while self.batch:
+                message, event_d = self.batch.popleft()
+                event_metadata = event_d['_zentral']
+                event_key = (event_metadata["id"], event_metadata["index"])
+                event_info[event_key] = (message, event_d)
+                yield event_d
+
+        stored_event_count = 0
+        try:
+            for stored_event_key in self.event_store.bulk_store(iter_events()):
+                try:
+                    message, event_d = event_info.pop(stored_event_key)
+                except KeyError:
+                    self.log_error("unknown stored event %s", stored_event_key)
+                else:
+                    message.ack()
+                    self.inc_counter("stored_events", event_d['_zentral']['type'])
+                    stored_event_count += 1
+        except Exception:
+            logger.exception("Could not add events to store %s", self.event_store.name)
+        finally:
+            # events consumed from the batch, but not stored
+            while self.batch:
+                message, event_d = self.batch.popleft()
+                event_metadata = event_d['_zentral']
+                event_info[(event_metadata["id"], event_metadata["index"])] = (message, event_d)
+            for message, event_d in event_info.values():
+                save_dead_letter(event_d, f"event store {self.event_store.name} error")
+                message.reject()
+            self.batch_start_ts = None
+
+        if stored_event_count < batch_size:
+            self.log_error("only %s/%s event(s) stored", stored_event_count, batch_size)
+        else:
+            self.log_debug("%s/%s events stored", stored_event_count, batch_size)
+
+
+class PublisherConfirms:
+    """Track the RabbitMQ publisher confirms of a channel in confirm mode
+
+    The messages are published without waiting, and the confirms are awaited at the end.
+    The delivery tags start at 1 when the channel is put in confirm mode.
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.published_count = 0
+        self.unconfirmed_tags = set()
+        self.nacked_tags = set()
+        channel.confirm_select()
+        channel.events["basic_ack"].add(self.on_ack)
+        channel.events["basic_nack"].add(self.on_nack)
+
+    def add_published_message(self):
+        self.published_count += 1
+        self.unconfirmed_tags.add(self.published_count)
+
+    def _confirmed_tags(self, delivery_tag, multiple):
+        if multiple:
+            return {tag for tag in self.unconfirmed_tags if tag <= delivery_tag}
+        return {delivery_tag} & self.unconfirmed_tags
+
+    def on_ack(self, delivery_tag, multiple):
+        self.unconfirmed_tags -= self._confirmed_tags(delivery_tag, multiple)
+
+    def on_nack(self, delivery_tag, multiple):
+        tags = self._confirmed_tags(delivery_tag, multiple)
+        self.unconfirmed_tags -= tags
+        self.nacked_tags |= tags
+
+    def wait(self, connection, timeout):
+        deadline = time.monotonic() + timeout
+        while self.unconfirmed_tags:
+            connection.drain_events(timeout=max(deadline - time.monotonic(), 0.001))
+        if self.nacked_tags:
+            raise MessageNacked(f"{len(self.nacked_tags)}/{self.published_count} message(s) nacked")
+
+
 class EventQueues(BaseEventQueues):
+    # max time to wait for the publisher confirms of a batch, in seconds
+    confirm_timeout = 10
+
     def __init__(self, config_d):
         super().__init__(config_d)
         self.backend_url = config_d['backend_url']
         self.transport_options = config_d.get('transport_options')
         self.connection = self._get_connection()
+        self._local = threading.local()
+        # prefetch_count, concurrency & retry_delay, by worker type
+        self.workers_config = config_d.get('workers') or {}
 
     def _get_connection(self):
         return Connection(self.backend_url, transport_options=self.transport_options)
 
+    def _get_worker_config(self, worker_type):
+        return self.workers_config.get(worker_type) or {}
+
     def get_preprocess_worker(self):
-        return PreprocessWorker(self._get_connection())
+        return PreprocessWorker(self._get_connection(), self._get_worker_config("preprocess"))
 
-    def get_enrich_worker(self, enrich_event):
-        return EnrichWorker(self._get_connection(), enrich_event)
+    def get_enrich_worker(self, enrich_event, enrich_events=None):
+        return EnrichWorker(self._get_connection(), enrich_event, self._get_worker_config("enrich"), enrich_events)
 
-    def get_process_worker(self, process_event):
-        return ProcessWorker(self._get_connection(), process_event)
+    def get_process_worker(self, process_event, stop_process_event=None):
+        return ProcessWorker(self._get_connection(), process_event, self._get_worker_config("process"),
+                             stop_process_event)
 
     def get_store_worker(self, event_store):
-        return StoreWorker(self._get_connection(), event_store)
+        worker_config = self._get_worker_config("store")
+        if event_store.batch_size > 1:
+            return BulkStoreWorker(self._get_connection(), event_store, worker_config)
+        else:
+            return StoreWorker(self._get_connection(), event_store, worker_config)
 
     def post_raw_event(self, routing_key, raw_event):
         with producers[self.connection].acquire(block=True) as producer:
@@ -261,8 +668,54 @@ class EventQueues(BaseEventQueues):
                              declare=[raw_events_exchange])
 
     def post_event(self, event):
+        serialized_event = event.serialize(machine_metadata=False)
+        batch = getattr(self._local, "batch", None)
+        if batch is not None:
+            batch.append(serialized_event)
+            return
         with producers[self.connection].acquire(block=True) as producer:
-            producer.publish(event.serialize(machine_metadata=False),
+            producer.publish(serialized_event,
                              serializer='json',
                              exchange=events_exchange,
                              declare=[events_exchange])
+
+    @contextmanager
+    def batch_posting(self):
+        if getattr(self._local, "batch", None) is not None:
+            # nested batch, the events are published by the outermost one
+            yield
+            return
+        self._local.batch = []
+        try:
+            yield
+        finally:
+            batch = self._local.batch
+            self._local.batch = None
+            if batch:
+                self._publish_batch(batch)
+
+    def _publish_batch(self, serialized_events):
+        with connections[self.connection].acquire(block=True) as connection:
+            if connection.transport.driver_name != "py-amqp":
+                # no publisher confirms
+                producer = Producer(connection.default_channel)
+                for serialized_event in serialized_events:
+                    producer.publish(serialized_event,
+                                     serializer='json',
+                                     exchange=events_exchange,
+                                     declare=[events_exchange])
+                return
+            # dedicated channel in confirm mode, to pipeline the publications
+            channel = connection.channel()
+            try:
+                confirms = PublisherConfirms(channel)
+                producer = Producer(channel)
+                for serialized_event in serialized_events:
+                    producer.publish(serialized_event,
+                                     serializer='json',
+                                     exchange=events_exchange,
+                                     declare=[events_exchange])
+                    confirms.add_published_message()
+                confirms.wait(connection, self.confirm_timeout)
+            finally:
+                channel.close()
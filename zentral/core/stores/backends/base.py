@@ -1,4 +1,6 @@
+import hashlib
 import warnings
+from django.core.cache import cache
 from zentral.core.events.filter import EventFilterSet
 
 
@@ -14,6 +16,7 @@ class BaseEventStore(object):
     probe_events = False
     probe_events_url = False
     probe_events_aggregations = False
+    last_machine_heartbeats_cache_timeout = 60  # seconds
 
     def __init__(self, config_d):
         self.name = config_d['store_name']
@@ -69,6 +72,20 @@ class BaseEventStore(object):
     def get_last_machine_heartbeats(self, serial_number, from_dt):
         return {}
 
+    def get_cached_last_machine_heartbeats(self, serial_number, from_dt):
+        """Cached version of get_last_machine_heartbeats
+
+        The heartbeats are cached for a short time, per store, machine and from_dt day.
+        """
+        cache_key = "stores_last_machine_heartbeats_{}".format(
+            hashlib.sha1(f"{self.name}|{serial_number}|{from_dt:%Y-%m-%d}".encode("utf-8")).hexdigest()
+        )
+        heartbeats = cache.get(cache_key)
+        if heartbeats is None:
+            heartbeats = self.get_last_machine_heartbeats(serial_number, from_dt)
+            cache.set(cache_key, heartbeats, self.last_machine_heartbeats_cache_timeout)
+        return heartbeats
+
     def get_machine_events_url(self, serial_number, from_dt, to_dt=None, event_type=None):
         return None
 
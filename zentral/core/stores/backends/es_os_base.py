@@ -33,6 +33,11 @@ class ESOSEventStore(BaseEventStore):
 
     LEGACY_DOC_TYPE = "doc"  # _type used with 5.6 < ES < 7
     MAX_CONNECTION_ATTEMPTS = 20
+    # bulk requests rejected with a 429 status (full write queues) are retried with an exponential backoff
+    BULK_MAX_RETRIES = 4
+    BULK_INITIAL_BACKOFF = 2  # seconds
+    BULK_MAX_BACKOFF = 30  # seconds
+    HEARTBEATS_COMPOSITE_SIZE = 1000  # buckets per machine heartbeats aggregation page
     MAPPINGS = {
         "dynamic_templates": [
             {"zentral_ip_address": {
@@ -186,6 +191,13 @@ class ESOSEventStore(BaseEventStore):
         if not self.read_index:
             raise ImproperlyConfigured("missing read index")
 
+        # bulk requests
+        try:
+            # default: 10MiB (min 1KiB, max 100MiB)
+            self.max_batch_bytes = min(max(2**10, int(config_d.get("max_batch_bytes", 10 * 2**20))), 100 * 2**20)
+        except (TypeError, ValueError):
+            raise ImproperlyConfigured("max_batch_bytes must be an integer")
+
         # kibana
         self.kibana_discover_url = config_d.get('kibana_discover_url')
         if not self.kibana_discover_url:
@@ -208,12 +220,20 @@ class ESOSEventStore(BaseEventStore):
                 return {"settings": self.index_settings,
                         "mappings": {self.LEGACY_DOC_TYPE: self.MAPPINGS}}
 
+    def _get_version(self, info):
+        version = info["version"]
+        if version.get("distribution") == "opensearch":
+            # OpenSearch was forked from Elasticsearch 7.10.2, and has no mapping types.
+            # Its API must not be used with the ES < 7 code paths.
+            return [7, 10, 2]
+        return [int(i) for i in version["number"].split(".")]
+
     def wait_and_configure(self):
         for i in range(self.MAX_CONNECTION_ATTEMPTS):
             # get or create index
             try:
                 info = self._client.info()
-                self.version = [int(i) for i in info["version"]["number"].split(".")]
+                self.version = self._get_version(info)
                 if self.default_index and not self._client.indices.exists(index=self.default_index):
                     self._client.indices.create(index=self.default_index, body=self.get_index_conf())
                     self.use_mapping_types = False
@@ -287,9 +307,10 @@ class ESOSEventStore(BaseEventStore):
         if not isinstance(event, dict):
             event_d = event.serialize()
         else:
-            event_d = event
+            # do not modify the event, it can still be used by the store worker
+            event_d = event.copy()
         index = self._get_event_index(event_d)
-        es_event_d = event_d.pop('_zentral')
+        es_event_d = event_d.pop('_zentral').copy()
         if not self.use_mapping_types:
             event_type = es_event_d['type']
             es_doc_type = self.LEGACY_DOC_TYPE
@@ -328,22 +349,25 @@ class ESOSEventStore(BaseEventStore):
         self.wait_and_configure_if_necessary()
         if self.batch_size < 2:
             raise RuntimeError("bulk_store is not available when batch_size < 2")
-        if self.version < [7]:
-            raise RuntimeError("bulk_store is not available for elasticsearch < 7")
 
         ID_SEP = "_"
 
         def iter_actions():
             for event in events:
-                index, _, doc = self._serialize_event(event)
+                index, doc_type, doc = self._serialize_event(event)
                 doc.update({"_index": index, "_id": f'{doc["id"]}{ID_SEP}{doc["index"]}'})
+                if self.version < [7]:
+                    doc["_type"] = doc_type
                 yield doc
 
         for ok, item in self._streaming_bulk(client=self._client,
                                              actions=iter_actions(),
                                              chunk_size=self.batch_size,
+                                             max_chunk_bytes=self.max_batch_bytes,
                                              raise_on_error=False, raise_on_exception=False,
-                                             max_retries=2):
+                                             max_retries=self.BULK_MAX_RETRIES,
+                                             initial_backoff=self.BULK_INITIAL_BACKOFF,
+                                             max_backoff=self.BULK_MAX_BACKOFF):
             try:
                 event_id, event_index = item["index"]["_id"].split(ID_SEP)
                 event_index = int(event_index)
@@ -363,8 +387,9 @@ class ESOSEventStore(BaseEventStore):
                             reason = error
                         else:
                             reason = "UNKNOWN"
-                    logger.error("could not index event %s %s: %s %s",
-                                 event_id, event_index, error_type or "-", reason or "-")
+                    logger.error("could not index event %s %s: %s %s %s",
+                                 event_id, event_index, item["index"].get("status", "-"),
+                                 error_type or "-", reason or "-")
 
     def _build_kibana_url(self, body, from_dt=None, to_dt=None):
         if not self.kibana_discover_url:
@@ -457,75 +482,77 @@ class ESOSEventStore(BaseEventStore):
         body = self._get_machine_events_body(serial_number, from_dt, to_dt)
         return self._get_aggregated_event_counts(body)
 
-    def get_last_machine_heartbeats(self, serial_number, from_dt):
-        body = self._get_machine_events_body(serial_number, from_dt, tag="heartbeat")
-        body.update({
-            'size': 0,
-            'aggs': {
-                'inventory_heartbeats': {
-                    'filter': self._get_type_filter('inventory_heartbeat'),
-                    'aggs': {
-                        'sources': {
-                            'terms': {
-                                'field': 'inventory.source.name',
-                                'size': 10  # TODO: HARDCODED
-                            },
-                            'aggs': {
-                                'max_created_at': {
-                                    'max': {
-                                        'field': 'created_at'
-                                    }
-                                }
-                            }
-                        }
-                    }
-                },
-                'other_events': {
-                    'filter': {'bool': {'must_not': self._get_type_filter('inventory_heartbeat')}},
-                    'aggs': {
-                        'event_types': {
-                            'terms': {
-                                'field': self._get_type_field(),
-                                'size': len([et for et in event_types.values()
-                                             if 'heartbeat' in et.tags])
-                            },
-                            'aggs': {
-                                'user_agents': {
-                                    'terms': {
-                                        'field': 'request.user_agent',
-                                        'size': 100,
-                                    },
-                                    'aggs': {
-                                        'max_created_at': {
-                                            'max': {
-                                                'field': 'created_at'
-                                            }
-                                        }
-                                    }
+    def _iter_machine_heartbeat_buckets(self, serial_number, from_dt):
+        # the version is needed to build the composite sources
+        self.wait_and_configure_if_necessary()
+        # composite aggregation, paginated, to get all the (event type, source, user agent) combinations
+        sources = []
+        for key, field in (("event_type", self._get_type_field()),
+                           ("source", "inventory.source.name"),
+                           ("user_agent", "request.user_agent")):
+            terms = {"field": field}
+            if key != "event_type" and self.version >= [6, 4]:
+                # keep the buckets for the events without source or user agent
+                terms["missing_bucket"] = True
+            sources.append({key: {"terms": terms}})
+        after_key = None
+        while True:
+            composite = {"size": self.HEARTBEATS_COMPOSITE_SIZE, "sources": sources}
+            if after_key:
+                composite["after"] = after_key
+            body = self._get_machine_events_body(serial_number, from_dt, tag="heartbeat")
+            body.update({
+                'size': 0,
+                'aggs': {
+                    'heartbeats': {
+                        'composite': composite,
+                        'aggs': {
+                            'max_created_at': {
+                                'max': {
+                                    'field': 'created_at'
                                 }
                             }
                         }
                     }
                 }
-            }
-        })
-        r = self._client.search(index=self.read_index, body=body)
+            })
+            r = self._client.search(index=self.read_index, body=body)
+            aggregation = r["aggregations"]["heartbeats"]
+            buckets = aggregation["buckets"]
+            yield from buckets
+            after_key = aggregation.get("after_key")
+            if not after_key or len(buckets) < self.HEARTBEATS_COMPOSITE_SIZE:
+                break
+
+    def get_last_machine_heartbeats(self, serial_number, from_dt):
+        inventory_heartbeats = {}
+        other_heartbeats = {}
+        for bucket in self._iter_machine_heartbeat_buckets(serial_number, from_dt):
+            key = bucket["key"]
+            max_created_at = parser.parse(bucket["max_created_at"]["value_as_string"])
+            if key["event_type"] == "inventory_heartbeat":
+                source_name = key.get("source")
+                if source_name is None:
+                    continue
+                # max over all the user agents
+                if source_name not in inventory_heartbeats or inventory_heartbeats[source_name] < max_created_at:
+                    inventory_heartbeats[source_name] = max_created_at
+            else:
+                ua_max_dates = other_heartbeats.setdefault(key["event_type"], {})
+                user_agent = key.get("user_agent")
+                if user_agent is None:
+                    continue
+                if user_agent not in ua_max_dates or ua_max_dates[user_agent] < max_created_at:
+                    ua_max_dates[user_agent] = max_created_at
         heartbeats = []
-        for bucket in r["aggregations"]["inventory_heartbeats"]["sources"]["buckets"]:
-            heartbeats.append((event_types["inventory_heartbeat"],
-                               bucket["key"],
-                               [(None, parser.parse(bucket["max_created_at"]["value_as_string"]))]))
-        for bucket in r["aggregations"]["other_events"]["event_types"]["buckets"]:
-            event_type = bucket["key"]
+        for source_name, max_created_at in sorted(inventory_heartbeats.items()):
+            heartbeats.append((event_types["inventory_heartbeat"], source_name, [(None, max_created_at)]))
+        for event_type, ua_max_dates in sorted(other_heartbeats.items()):
             event_type_class = event_types.get(event_type, None)
             if not event_type_class:
                 logger.error("Unknown event type %s", event_type)
             else:
-                ua_list = []
-                for sub_bucket in bucket["user_agents"]["buckets"]:
-                    ua = sub_bucket["key"]
-                    ua_list.append((ua, parser.parse(sub_bucket["max_created_at"]["value_as_string"])))
-                heartbeats.append((event_type_class, None, ua_list))
+                heartbeats.append((event_type_class, None, sorted(ua_max_dates.items())))
         return heartbeats
 
     def get_machine_events_url(self, serial_number, from_dt, to_dt=None, event_type=None):
@@ -1,3 +1,5 @@
+import gzip
+import json
 import logging
 import queue
 import random
@@ -5,6 +7,7 @@ import threading
 import time
 from django.utils.functional import cached_property
 import requests
+from zentral.core.exceptions import ImproperlyConfigured
 from zentral.core.stores.backends.base import BaseEventStore
 
 
@@ -23,23 +26,27 @@ class HTTPStoreClient:
             self.session.headers.update(event_store.headers)
         if event_store.username and event_store.password:
             self.session.auth = (event_store.username, event_store.password)
+        self.max_batch_bytes = event_store.max_batch_bytes
+        self.compress = event_store.compress
         self.name = name
 
     def _serialize_event(self, event):
         if not isinstance(event, dict):
             event = event.serialize()
-        payload = event.pop("_zentral")
+        else:
+            # do not modify the event, it can still be used by the store worker
+            event = event.copy()
+        payload = event.pop("_zentral").copy()
         event_type = payload.get("type")
         namespace = payload.get("namespace", event_type)
         payload[namespace] = event
         return payload
 
-    def store_event(self, event):
-        payload = self._serialize_event(event)
+    def _post(self, **kwargs):
         for i in range(self.max_retries):
-            r = self.session.post(self.endpoint_url, json=payload)
+            r = self.session.post(self.endpoint_url, **kwargs)
             if r.ok:
-                return
+                return r
             if r.status_code > 500:
                 logger.error("[%s] temporary server error", self.name)
                 if i + 1 < self.max_retries:
@@ -49,6 +56,66 @@ class HTTPStoreClient:
                     continue
             r.raise_for_status()
 
+    def store_event(self, event):
+        self._post(json=self._serialize_event(event))
+
+    # bulk
+
+    def _iter_bulk_requests(self, events):
+        # NDJSON request bodies, split to respect the max number of bytes
+        lines = []
+        event_keys = []
+        size = 0
+        for event in events:
+            payload = self._serialize_event(event)
+            line = json.dumps(payload).encode("utf-8") + b"\n"
+            if lines and size + len(line) > self.max_batch_bytes:
+                yield lines, event_keys
+                lines = []
+                event_keys = []
+                size = 0
+            lines.append(line)
+            event_keys.append((payload["id"], payload["index"]))
+            size += len(line)
+        if lines:
+            yield lines, event_keys
+
+    @staticmethod
+    def _get_failed_event_keys(response):
+        # optional {"failed_events": [{"id": "…", "index": 0}, …]} response
+        try:
+            response_d = response.json()
+        except ValueError:
+            return set()
+        if not isinstance(response_d, dict):
+            return set()
+        failed_event_keys = set()
+        for failed_event in response_d.get("failed_events") or []:
+            try:
+                failed_event_keys.add((str(failed_event["id"]), int(failed_event.get("index", 0))))
+            except (AttributeError, KeyError, TypeError, ValueError):
+                logger.warning("Invalid failed event %s", failed_event)
+        return failed_event_keys
+
+    def bulk_store_events(self, events):
+        for lines, event_keys in self._iter_bulk_requests(events):
+            data = b"".join(lines)
+            headers = {"Content-Type": "application/x-ndjson"}
+            if self.compress:
+                data = gzip.compress(data)
+                headers["Content-Encoding"] = "gzip"
+            try:
+                response = self._post(data=data, headers=headers)
+            except Exception:
+                logger.exception("[%s] could not store %s event(s)", self.name, len(event_keys))
+                continue
+            failed_event_keys = self._get_failed_event_keys(response)
+            if failed_event_keys:
+                logger.error("[%s] %s/%s event(s) not stored", self.name, len(failed_event_keys), len(event_keys))
+            for event_key in event_keys:
+                if event_key not in failed_event_keys:
+                    yield event_key
+
 
 class EventStoreThread(threading.Thread):
     def __init__(self, event_store, thread_id, in_queue, out_queue, stop_event):
@@ -85,11 +152,19 @@ class EventStoreThread(threading.Thread):
 
 class EventStore(BaseEventStore):
     max_retries = 3
+    max_batch_size = 1000
     max_concurrency = 20
 
     def __init__(self, config_d):
         super().__init__(config_d)
         self.endpoint_url = config_d["endpoint_url"]
+        # bulk requests
+        try:
+            # default: 5MiB (min 1KiB, max 100MiB)
+            self.max_batch_bytes = min(max(2**10, int(config_d.get("max_batch_bytes", 5 * 2**20))), 100 * 2**20)
+        except (TypeError, ValueError):
+            raise ImproperlyConfigured("max_batch_bytes must be an integer")
+        self.compress = bool(config_d.get("compress", False))
         self.verify_tls = config_d.get('verify_tls', True)
         self.headers = config_d.get("headers")
         self.username = config_d.get("username")
@@ -112,3 +187,8 @@ class EventStore(BaseEventStore):
 
     def store(self, event):
         self.client.store_event(event)
+
+    def bulk_store(self, events):
+        if self.batch_size < 2:
+            raise RuntimeError("bulk_store is not available when batch_size < 2")
+        yield from self.client.bulk_store_events(events)
@@ -3,7 +3,9 @@ import logging
 from logging.handlers import SysLogHandler
 import random
 import socket
+import ssl
 import time
+from django.utils.functional import cached_property
 from zentral.core.exceptions import ImproperlyConfigured
 from zentral.core.stores.backends.base import BaseEventStore
 from zentral.utils.json import remove_null_character
@@ -25,6 +27,7 @@ class EventStore(BaseEventStore):
     DEFAULT_PROTOCOL = "udp"
     DEFAULT_PORT = 514
     MAX_CONNECTION_ATTEMPTS = 10
+    max_batch_size = 1000
 
     def __init__(self, config_d):
         super(EventStore, self).__init__(config_d)
@@ -79,13 +82,50 @@ class EventStore(BaseEventStore):
             self.socket_family = socket.AF_UNIX
             self.address = unix_socket
 
+        # TLS
+        self.tls = bool(config_d.get("tls", False))
+        if self.tls and (self.socket_protocol != socket.SOCK_STREAM or self.socket_family != socket.AF_INET):
+            raise ImproperlyConfigured("Syslog TLS is only available with the tcp protocol and a host")
+        self.verify_tls = config_d.get("verify_tls", True)
+        self.tls_ca_file = config_d.get("tls_ca_file")
+
+        # framing of the TCP messages
+        # null: messages terminated by a null character
+        # octet_counting: RFC 5425 (TLS) / RFC 6587 "MSG-LEN SP SYSLOG-MSG" messages
+        framing = config_d.get("framing")
+        if not framing:
+            framing = "octet_counting" if self.tls else "null"
+        if framing not in ("null", "octet_counting"):
+            raise ImproperlyConfigured("Unknown syslog framing {}".format(framing))
+        self.octet_counting = framing == "octet_counting"
+
+    @cached_property
+    def ssl_context(self):
+        context = ssl.create_default_context(cafile=self.tls_ca_file)
+        if not self.verify_tls:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        return context
+
+    def _connect(self):
+        sock = socket.socket(self.socket_family, self.socket_protocol)
+        try:
+            if self.socket_protocol == socket.SOCK_STREAM and self.socket_family == socket.AF_INET:
+                # persistent connection
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            if self.tls:
+                sock = self.ssl_context.wrap_socket(sock, server_hostname=self.address[0])
+            sock.connect(self.address)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
     def wait_and_configure(self):
         for i in range(self.MAX_CONNECTION_ATTEMPTS):
             try:
-                self.socket = socket.socket(self.socket_family, self.socket_protocol)
-                self.socket.connect(self.address)
+                self.socket = self._connect()
             except OSError:
-                self.socket.close()
                 s = (i + 1) * random.uniform(0.9, 1.1)
                 logger.warning('Could not connect socket ADDR %s FAM %s PROTO %s %d/%d. Sleep %ds',
                                self.address, self.socket_family, self.socket_protocol,
@@ -97,8 +137,15 @@ class EventStore(BaseEventStore):
         else:
             raise Exception('Could not connect socket')
 
-    def store(self, event):
-        self.wait_and_configure_if_necessary()
+    def _reconnect(self):
+        try:
+            self.socket.close()
+        except OSError:
+            pass
+        self.configured = False
+        self.wait_and_configure()
+
+    def _serialize_event(self, event):
         if not isinstance(event, dict):
             event = event.serialize()
         msg = json.dumps(remove_null_character(event))
@@ -106,6 +153,47 @@ class EventStore(BaseEventStore):
             msg = "@ecc: " + msg
         msg = self.priority + msg.encode("utf-8")
         if self.socket_protocol == socket.SOCK_STREAM:
-            self.socket.sendall(msg + b'\x00')
-        else:
-            self.socket.send(msg)
+            if self.octet_counting:
+                return b"%d %s" % (len(msg), msg)
+            return msg + b'\x00'
+        return msg
+
+    def _send(self, msgs):
+        for attempt in range(2):
+            try:
+                if self.socket_protocol == socket.SOCK_STREAM:
+                    # many messages per send
+                    self.socket.sendall(b"".join(msgs))
+                else:
+                    # one message per datagram
+                    for msg in msgs:
+                        self.socket.send(msg)
+            except OSError:
+                if attempt:
+                    raise
+                # the messages are sent again after the reconnection
+                logger.warning("Could not send %d syslog message(s). Reconnect.", len(msgs))
+                self._reconnect()
+            else:
+                return
+
+    def store(self, event):
+        self.wait_and_configure_if_necessary()
+        self._send([self._serialize_event(event)])
+
+    def bulk_store(self, events):
+        self.wait_and_configure_if_necessary()
+
+        if self.batch_size < 2:
+            raise RuntimeError("bulk_store is not available when batch_size < 2")
+
+        event_keys = []
+        msgs = []
+        for event in events:
+            if not isinstance(event, dict):
+                event = event.serialize()
+            event_keys.append((event["_zentral"]["id"], event["_zentral"]["index"]))
+            msgs.append(self._serialize_event(event))
+        if msgs:
+            self._send(msgs)
+        yield from event_keys
@@ -3,7 +3,7 @@ from datetime import datetime
 import hashlib
 from django.core.exceptions import FieldDoesNotExist
 from django.utils.functional import cached_property
-from django.utils.timezone import is_aware, make_naive
+from django.utils.timezone import get_current_timezone, is_aware, make_naive
 from django.db import IntegrityError, models, transaction
 
 
@@ -54,49 +54,83 @@ class Hasher(object):
         return h.hexdigest()
 
 
+def _prepare_commit_subtree(tree, digests, timezone):
+    """Single pass, bottom-up version of the Hasher, for the commit trees
+
+    The canonical form of each node is built once, and hashed with a single SHA-1 call.
+    The digests of the identical nodes and list items are memoized for the whole tree,
+    and the current timezone used to make the aware datetimes naive is looked up once.
+    The hashes are the same as the ones computed with the Hasher.
+    """
+    mt_hash = tree.get('mt_hash', None)
+    if mt_hash:
+        return mt_hash
+    fields = []
+    empty_keys = []
+    for k, v in tree.items():
+        if v is None or v == [] or v == {}:
+            empty_keys.append(k)
+            continue
+        if not isinstance(k, str) or not k:
+            raise ValueError("Invalid field name {}".format(k))
+        if isinstance(v, str):
+            pass
+        elif isinstance(v, dict):
+            v = _prepare_commit_subtree(v, digests, timezone)
+        elif isinstance(v, list):
+            hash_list = []
+            subtree_mt_hashes = set()
+            for item_idx, item in enumerate(v):
+                if isinstance(item, dict):
+                    subtree_mt_hash = _prepare_commit_subtree(item, digests, timezone)
+                    if subtree_mt_hash in subtree_mt_hashes:
+                        raise MTOError("Duplicated subtree in key {}".format(k))
+                    subtree_mt_hashes.add(subtree_mt_hash)
+                    hash_list.append(subtree_mt_hash)
+                else:
+                    if isinstance(item, int):
+                        item_to_hash = "i∅" + str(item)
+                    elif isinstance(item, float):
+                        item_to_hash = "f∅" + str(item)
+                    elif isinstance(item, datetime):
+                        if is_aware(item):
+                            item = make_naive(item, timezone)
+                        item_to_hash = "d∅" + item.isoformat()
+                    elif isinstance(item, str):
+                        item_to_hash = "s∅" + item
+                    else:
+                        raise MTOError("Unsupported list item type")
+                    item_to_hash = (str(item_idx) + item_to_hash).encode('utf-8')  # order is important
+                    item_hash = digests.get(item_to_hash)
+                    if item_hash is None:
+                        item_hash = digests[item_to_hash] = hashlib.sha1(item_to_hash).hexdigest()
+                    hash_list.append(item_hash)
+            hash_list.sort()
+            v = "".join(hash_list)
+        elif isinstance(v, datetime):
+            if is_aware(v):
+                tree[k] = v = make_naive(v, timezone)
+            v = v.isoformat()
+        elif isinstance(v, int):
+            v = str(v)
+        else:
+            raise ValueError("Invalid field value {} for field {}".format(v, k))
+        fields.append((k, v))
+    for k in empty_keys:
+        del tree[k]
+    fields.sort()
+    canonical_form = "".join(k + v for k, v in fields).encode('utf-8')
+    mt_hash = digests.get(canonical_form)
+    if mt_hash is None:
+        mt_hash = digests[canonical_form] = hashlib.sha1(canonical_form).hexdigest()
+    tree['mt_hash'] = mt_hash
+    return mt_hash
+
+
 def prepare_commit_tree(tree):
     if not isinstance(tree, dict):
         raise MTOError("Commit tree is not a dict")
-    if tree.get('mt_hash', None):
-        return
-    h = Hasher()
-    for k, v in list(tree.items()):
-        if h.is_empty_value(v):
-            tree.pop(k)
-        else:
-            if isinstance(v, dict):
-                prepare_commit_tree(v)
-                v = v['mt_hash']
-            elif isinstance(v, list):
-                hash_list = []
-                for item_idx, item in enumerate(v):
-                    if isinstance(item, dict):
-                        prepare_commit_tree(item)
-                        subtree_mt_hash = item['mt_hash']
-                        if subtree_mt_hash in hash_list:
-                            raise MTOError("Duplicated subtree in key {}".format(k))
-                        else:
-                            hash_list.append(subtree_mt_hash)
-                    else:
-                        if isinstance(item, int):
-                            item_to_hash = "i∅" + str(item)
-                        elif isinstance(item, float):
-                            item_to_hash = "f∅" + str(item)
-                        elif isinstance(item, datetime):
-                            if is_aware(item):
-                                item = make_naive(item)
-                            item_to_hash = "d∅" + item.isoformat()
-                        elif isinstance(item, str):
-                            item_to_hash = "s∅" + item
-                        else:
-                            raise MTOError("Unsupported list item type")
-                        item_to_hash = str(item_idx) + item_to_hash  # order is important
-                        hash_list.append(hashlib.sha1(item_to_hash.encode('utf-8')).hexdigest())
-                v = hash_list
-            elif isinstance(v, datetime) and is_aware(v):
-                tree[k] = v = make_naive(v)
-            h.add_field(k, v)
-    tree['mt_hash'] = h.hexdigest()
+    _prepare_commit_subtree(tree, {}, get_current_timezone())
 
 
 def cleanup_commit_tree(tree):
@@ -167,6 +201,151 @@ class MTObjectManager(models.Manager):
                 created = True
         return obj, created
 
+    def _collect_bulk_commit_nodes(self, tree, nodes):
+        # depth first, to get the height of each node.
+        # the nodes of a given height only depend on the nodes of a lower height.
+        if not isinstance(tree, dict):
+            raise MTOError("Commit tree is not a dict")
+        obj = self.model()
+        height = 0
+        for k, v in tree.items():
+            if isinstance(v, dict):
+                try:
+                    f = obj.get_mt_field(k, many_to_one=True)
+                except MTOError:
+                    # JSONField ??? verified when the object is built
+                    continue
+                height = max(height, f.related_model.objects._collect_bulk_commit_nodes(v, nodes) + 1)
+            elif isinstance(v, list):
+                f = obj.get_mt_field(k, many_to_many=True)
+                for sv in v:
+                    height = max(height, f.related_model.objects._collect_bulk_commit_nodes(sv, nodes) + 1)
+        key = (self.model, tree['mt_hash'])
+        node = nodes.get(key)
+        if node is None:
+            nodes[key] = [height, tree]
+        else:
+            node[0] = max(node[0], height)
+        return height
+
+    def _build_bulk_commit_obj(self, tree, objs):
+        obj = self.model()
+        fk_fields = []
+        m2m_fields = []
+        m2m_values = {}
+        for k, v in tree.items():
+            if k == 'mt_hash':  # special excluded field
+                obj.mt_hash = v
+            elif isinstance(v, dict):
+                try:
+                    f = obj.get_mt_field(k, many_to_one=True)
+                except MTOError:
+                    # JSONField ???
+                    f = obj.get_mt_field(k)
+                    if isinstance(f, models.JSONField):
+                        t = copy.deepcopy(v)
+                        cleanup_commit_tree(t)
+                        setattr(obj, k, t)
+                    else:
+                        raise MTOError('Cannot set field "{}" to dict value'.format(k))
+                else:
+                    setattr(obj, k, objs[(f.related_model, v['mt_hash'])])
+                    fk_fields.append(k)
+            elif isinstance(v, list):
+                f = obj.get_mt_field(k, many_to_many=True)
+                ol = [objs[(f.related_model, sv['mt_hash'])] for sv in v]
+                m2m_fields.append((f, ol))
+                m2m_values[k] = ol
+            else:
+                obj.get_mt_field(k)
+                setattr(obj, k, v)
+        # the related objects are already in the DB, no need to verify the foreign keys
+        # the mt_hash unicity is enforced by the DB
+        obj.full_clean(exclude=fk_fields, validate_unique=False, validate_constraints=False)
+        if not obj.hash(recursive=False, m2m_values=m2m_values) == obj.mt_hash:
+            raise MTOError('Obj {} Hash missmatch!!!'.format(obj))
+        return obj, m2m_fields
+
+    def _bulk_create_objs(self, new_objs, objs):
+        mt_hashes = [obj.mt_hash for obj, _ in new_objs]
+        try:
+            with transaction.atomic():
+                self.bulk_create([obj for obj, _ in new_objs])
+        except IntegrityError:
+            # some objects have been concurrently created
+            # insert them one by one, to know which ones are created by this call
+            created_mt_hashes = set()
+            for obj, _ in new_objs:
+                try:
+                    with transaction.atomic():
+                        obj.save(force_insert=True)
+                except IntegrityError:
+                    pass
+                else:
+                    created_mt_hashes.add(obj.mt_hash)
+            created_objs = {obj.mt_hash: obj for obj in self.filter(mt_hash__in=mt_hashes)}
+        else:
+            created_objs = {obj.mt_hash: obj for obj, _ in new_objs}
+            created_mt_hashes = set(mt_hashes)
+        through_objs = {}
+        for obj, m2m_fields in new_objs:
+            obj = created_objs[obj.mt_hash]
+            objs[(self.model, obj.mt_hash)] = obj
+            for f, ol in m2m_fields:
+                through = f.remote_field.through
+                for m2m_obj in ol:
+                    through_objs.setdefault(through, []).append(
+                        through(**{f.m2m_column_name(): obj.pk, f.m2m_reverse_name(): m2m_obj.pk})
+                    )
+        for through, through_obj_list in through_objs.items():
+            through.objects.bulk_create(through_obj_list, ignore_conflicts=True)
+        return created_mt_hashes
+
+    def bulk_commit(self, tree):
+        """Commit a tree, resolving the existing objects with one query per model.
+
+        Only the missing objects and their many to many relationships are created, in bulk.
+        The objects of the models with a custom save method are committed one by one.
+        Returns the same (obj, created) tuple as commit().
+        """
+        prepare_commit_tree(tree)
+        obj = self.filter(mt_hash=tree['mt_hash']).first()
+        if obj:
+            return obj, False
+        root_key = (self.model, tree['mt_hash'])
+        nodes = {}
+        self._collect_bulk_commit_nodes(tree, nodes)
+        # existing objects
+        model_mt_hashes = {}
+        for model, mt_hash in nodes.keys():
+            if (model, mt_hash) != root_key:
+                model_mt_hashes.setdefault(model, []).append(mt_hash)
+        objs = {}
+        for model, mt_hashes in model_mt_hashes.items():
+            for obj in model.objects.filter(mt_hash__in=mt_hashes):
+                objs[(model, obj.mt_hash)] = obj
+        # missing objects, grouped by height and model
+        missing_nodes = {}
+        for (model, mt_hash), (height, subtree) in nodes.items():
+            if (model, mt_hash) not in objs:
+                missing_nodes.setdefault((height, model.__name__), (model, []))[1].append(subtree)
+        created = False
+        with transaction.atomic():
+            for _, (model, subtrees) in sorted(missing_nodes.items(), key=lambda i: i[0]):
+                if model.save is not models.Model.save:
+                    # custom save logic, cannot use bulk_create
+                    for subtree in subtrees:
+                        obj, obj_created = model.objects.commit(subtree)
+                        objs[(model, obj.mt_hash)] = obj
+                        if (model, obj.mt_hash) == root_key:
+                            created = obj_created
+                    continue
+                new_objs = [model.objects._build_bulk_commit_obj(subtree, objs) for subtree in subtrees]
+                created_mt_hashes = model.objects._bulk_create_objs(new_objs, objs)
+                if model == self.model and tree['mt_hash'] in created_mt_hashes:
+                    created = True
+        return objs[root_key], created
+
 
 class AbstractMTObject(models.Model):
     mt_hash = models.CharField(max_length=40, unique=True)
@@ -209,17 +388,21 @@ class AbstractMTObject(models.Model):
                                                                       f.many_to_one, f.many_to_many))
         return f
 
-    def _iter_mto_fields(self):
+    def _iter_mto_fields(self, m2m_values=None):
         for f in self._meta.get_fields():
             if f.name not in self.mt_excluded_field_set and not f.auto_created:
-                v = getattr(self, f.name)
-                if f.many_to_many:
-                    v = v.all()
+                if f.many_to_many and m2m_values is not None:
+                    # values of an object not yet saved
+                    v = m2m_values.get(f.name, [])
+                else:
+                    v = getattr(self, f.name)
+                    if f.many_to_many:
+                        v = v.all()
                 yield f, v
 
-    def hash(self, recursive=True):
+    def hash(self, recursive=True, m2m_values=None):
         h = Hasher()
-        for f, v in self._iter_mto_fields():
+        for f, v in self._iter_mto_fields(m2m_values):
             if f.many_to_one and v:
                 if recursive:
                     v = v.hash()
@@ -0,0 +1,73 @@
+from datetime import datetime
+import logging
+import random
+import select
+import threading
+import time
+from django.db import connection
+
+
+logger = logging.getLogger("zentral.utils.pg_notifications")
+
+
+class PostgresNotificationListener(threading.Thread):
+    """Thread waiting for the notifications on a PostgreSQL channel
+
+    The callback is called with the list of the received payloads, or with None
+    after a DB error, when some notifications might have been missed.
+    The listener stops if the callback returns False.
+    """
+
+    def __init__(self, channel, callback):
+        super().__init__(daemon=True)
+        self.channel = channel
+        self.callback = callback
+        self.error_state = False
+        self.last_heartbeat = None
+
+    def run(self):
+        while True:
+            self.last_heartbeat = datetime.utcnow()
+            # LISTEN query
+            try:
+                cur = connection.cursor()
+                cur.execute('LISTEN {}'.format(self.channel))
+                connection.commit()
+            except Exception as db_err:
+                connection.close_if_unusable_or_obsolete()
+                self.error_state = True
+                sleep_time = 2 * (1 + random.random())
+                logger.error("Could not execute the LISTEN query: %s. Sleep %ss.", db_err, sleep_time)
+                time.sleep(sleep_time)
+                continue
+
+            # are we recovering from an error ?
+            if self.error_state:
+                # we might have missed some notifications
+                logger.info("DB error recovery on channel '%s'.", self.channel)
+                if self.callback(None) is False:
+                    logger.error("Stop error recovery for notifications on channel '%s'.", self.channel)
+                    return
+                self.error_state = False
+
+            logger.info("Waiting for notifications on channel '%s'", self.channel)
+            pg_con = connection.connection
+            while True:
+                self.last_heartbeat = datetime.utcnow()
+                if select.select([pg_con], [], [], 5) == ([], [], []):
+                    pass
+                else:
+                    try:
+                        pg_con.poll()
+                    except Exception as db_err:
+                        connection.close_if_unusable_or_obsolete()
+                        self.error_state = True
+                        logger.error("Could not poll() the DB connection: %s", db_err)
+                        break
+                    if pg_con.notifies:
+                        payloads = []
+                        while pg_con.notifies:
+                            payloads.append(pg_con.notifies.pop(0).payload)
+                        if self.callback(payloads) is False:
+                            logger.error("Stop waiting for notifications on channel '%s'.", self.channel)
+                            return